@@ -14,20 +14,48 @@ sys.path.insert(0, str(BASE_DIR))
 # Cambiar al directorio base para que las rutas relativas funcionen
 os.chdir(BASE_DIR)
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List, Dict
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+from typing import Optional, List, Dict, AsyncIterator, Literal
+from contextlib import asynccontextmanager
+import json
+import math
+import time
+import threading
 import uvicorn
 from datetime import datetime
 
 from chatbot.chatbot import RAGChatbot
+from chatbot.session_store import create_session_store
+from rag.rag_pipeline import RAGPipeline
+from rag.concurrency import shutdown_cpu_executor
+from rag.admission import AdmissionRejected
+from llm.http_pool import aclose_async_http_client
+from monitoring.tracing import get_tracer
+from monitoring.metrics import get_metrics, process_rss_bytes
+from monitoring.logger import shutdown_logging
+from monitoring.profiler import get_profiler
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Libera el pool HTTP de los LLMs y el executor de CPU y vacía la cola de logs al apagar la API"""
+    yield
+    await aclose_async_http_client()
+    shutdown_cpu_executor()
+    shutdown_logging()
+
 
 # Inicializar FastAPI
 app = FastAPI(
     title="Chatbot VOAE API",
     description="API REST para el Chatbot de la Vicerrectoría de Orientación y Asuntos Estudiantiles",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS para permitir requests desde el frontend
@@ -39,10 +67,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Estado global del chatbot
-chatbot_instance = None
-chat_sessions = {}  # {session_id: chatbot_instance}
-session_llm_providers = {}  # {session_id: llm_provider}
+# Estado global del chatbot: un pipeline por proveedor compartido por todas
+# las sesiones (el modelo de embeddings se carga una sola vez)
+pipelines = {}  # {llm_provider: RAGPipeline}
+# Sesiones con expiración por inactividad, límite LRU y tope de memoria
+# (SESSION_STORE=sqlite conserva el historial y lo comparte entre workers)
+session_store = create_session_store()
+# Traza por petición: el pipeline agrega sus etapas a la traza de /chat
+tracer = get_tracer()
+# Profiling de peticiones individuales (header X-Profile-Token o ?profile=<token>)
+profiler = get_profiler()
+# Registro de métricas expuesto en /metrics (formato de Prometheus)
+metrics = get_metrics()
+metrics.describe("rag_active_sessions", "Sesiones de chat vivas en este proceso")
+metrics.describe("rag_loaded_pipelines", "Pipelines RAG cargados (uno por proveedor de LLM)")
+metrics.describe("rag_loaded_models", "Modelos cargados por tipo (embedding o llm)")
+metrics.describe("rag_index_documents", "Chunks de documentos y preguntas de FAQ indexados")
+metrics.describe("rag_cache_hit_ratio", "Proporción de aciertos de cada caché por proveedor")
+metrics.describe("process_resident_memory_bytes", "Memoria residente (RSS) del proceso")
+state_lock = threading.Lock()  # Serializa la creación del chatbot de una sesión (operación breve)
+pipelines_lock = threading.Lock()  # Serializa la creación de pipelines (lenta: carga modelos)
 
 
 # Modelos Pydantic
@@ -52,6 +96,8 @@ class ChatRequest(BaseModel):
     top_k: Optional[int] = 4
     temperature: Optional[float] = 0.7
     llm_provider: Optional[str] = None  # "groq" o "deepseek"
+    latency_budget_ms: Optional[float] = None  # None = REQUEST_LATENCY_BUDGET_MS
+    mode: Literal["generative", "extractive"] = "generative"  # extractive: FAQ o pasajes, sin LLM
 
 
 class ChatResponse(BaseModel):
@@ -60,6 +106,15 @@ class ChatResponse(BaseModel):
     match_type: Optional[str] = None
     best_faq_similarity: Optional[float] = None
     context_type: Optional[str] = None
+    intent: Optional[str] = None
+    model_route: Optional[str] = None
+    context_stats: Optional[Dict] = None
+    queue_ms: Optional[Dict] = None
+    degradations: List[str] = []
+    deadline: Optional[Dict] = None
+    extractive: Optional[Dict] = None
+    timings: Optional[Dict[str, float]] = None  # ms por etapa (embed, faq_search, doc_search, llm_total, ...)
+    profile: Optional[Dict] = None  # Archivos del perfil (solo en peticiones perfiladas)
     relevant_documents: List[Dict] = []
     timestamp: str
 
@@ -85,23 +140,45 @@ class ModelChangeRequest(BaseModel):
 
 
 # Funciones auxiliares
+def get_pipeline(llm_provider: str) -> RAGPipeline:
+    """Obtiene o crea el pipeline compartido de un proveedor"""
+    with pipelines_lock:
+        if llm_provider not in pipelines:
+            # Reutilizar el modelo de embeddings ya cargado por otro proveedor
+            embedder = next(iter(pipelines.values())).embedder if pipelines else None
+            pipelines[llm_provider] = RAGPipeline(llm_provider=llm_provider, embedder=embedder)
+
+        return pipelines[llm_provider]
+
+
 def get_chatbot(session_id: str = "default", llm_provider: str = None) -> RAGChatbot:
-    """Obtiene o crea una instancia del chatbot para la sesión"""
+    """
+    Obtiene o crea una instancia del chatbot para la sesión
+
+    Puede cargar modelos la primera vez: desde los endpoints async se
+    llama con run_in_threadpool para no bloquear el event loop.
+    """
     # Si no se especifica proveedor, usar el guardado o default
     if llm_provider is None:
-        llm_provider = session_llm_providers.get(session_id, "deepseek")
+        llm_provider = session_store.get_provider(session_id) or "deepseek"
+
+    pipeline = get_pipeline(llm_provider)
 
-    # Si no existe el chatbot o cambió el proveedor, recrear
-    if session_id not in chat_sessions or session_llm_providers.get(session_id) != llm_provider:
-        # Cerrar chatbot anterior si existe
-        if session_id in chat_sessions:
-            chat_sessions[session_id].close()
+    with state_lock:
+        chatbot = session_store.get(session_id)
 
-        # Crear nuevo chatbot con el proveedor especificado
-        chat_sessions[session_id] = RAGChatbot(max_history=10, llm_provider=llm_provider)
-        session_llm_providers[session_id] = llm_provider
+        # Si no existe el chatbot (o expiró) o cambió el proveedor, recrear
+        if chatbot is None or session_store.get_provider(session_id) != llm_provider:
+            # Crear nuevo chatbot sobre el pipeline compartido del proveedor;
+            # el almacén cierra el anterior y restaura el historial persistido
+            chatbot = RAGChatbot(
+                max_history=10,
+                llm_provider=llm_provider,
+                pipeline=pipeline
+            )
+            session_store.put(session_id, chatbot, llm_provider)
 
-    return chat_sessions[session_id]
+        return chatbot
 
 
 # Endpoints
@@ -125,43 +202,276 @@ async def health_check():
     }
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+def collect_gauges():
     """
-    Endpoint principal para interactuar con el chatbot
+    Actualiza los gauges que se leen en el momento del scrape: sesiones
+    activas, modelos cargados, tamaño del índice, RSS del proceso y
+    proporción de aciertos de las cachés de cada pipeline
+    """
+    metrics.set_gauge("rag_active_sessions", session_store.get_stats()['sessions'])
+
+    rss = process_rss_bytes()
+    if rss is not None:
+        metrics.set_gauge("process_resident_memory_bytes", rss)
+
+    # Copia sin pipelines_lock: el lock se mantiene mientras se carga un modelo
+    loaded = dict(pipelines)
+    metrics.set_gauge("rag_loaded_pipelines", len(loaded))
+
+    if loaded:
+        metrics.set_gauge("rag_loaded_models", 1, labels={"kind": "embedding", "model": "BAAI/bge-m3"})
+        pipeline = next(iter(loaded.values()))
+        metrics.set_gauge("rag_index_documents", pipeline.repository.count_documents(), labels={"index": "documents"})
+        metrics.set_gauge("rag_index_documents", pipeline.repository.count_faq_questions(), labels={"index": "faq"})
+
+    for provider, pipeline in loaded.items():
+        metrics.set_gauge(
+            "rag_loaded_models", 1, labels={"kind": "llm", "model": f"{provider}/{pipeline.llm_client.model}"}
+        )
+
+        compression = pipeline.context_compressor.get_stats()
+        lookups = compression['cache_hits'] + compression['cache_misses']
+        ratios = {
+            "semantic": pipeline.semantic_cache.get_stats()['hit_ratio'],
+            "llm_response": pipeline.llm_response_cache.get_stats()['hit_ratio'],
+            "sentence_embeddings": compression['cache_hits'] / lookups if lookups else 0.0
+        }
+        for cache, ratio in ratios.items():
+            metrics.set_gauge("rag_cache_hit_ratio", ratio, labels={"cache": cache, "provider": provider})
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Métricas del proceso en el formato de texto de Prometheus
+
+    Histogramas de latencia (petición y etapa), tamaño de lote de embeddings
+    y tokens por proveedor; gauges de sesiones, modelos, índice, memoria y
+    aciertos de caché.
+    """
+    await run_in_threadpool(collect_gauges)
+    return PlainTextResponse(
+        metrics.render_prometheus(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+async def answer_chat(request: ChatRequest, trace) -> ChatResponse:
+    """
+    Responde un mensaje de /chat registrando las etapas en la traza de la petición
 
     Args:
         request: ChatRequest con el mensaje del usuario
+        trace: Traza de la petición
 
     Returns:
         ChatResponse con la respuesta del chatbot y metadata
     """
-    try:
-        # Obtener chatbot de la sesión (con proveedor LLM si se especifica)
-        chatbot = get_chatbot(request.session_id, request.llm_provider)
+    # Obtener chatbot de la sesión (con proveedor LLM si se especifica)
+    chatbot = await run_in_threadpool(get_chatbot, request.session_id, request.llm_provider)
 
-        # Procesar mensaje
-        result = chatbot.chat(
+    # Procesar mensaje (embedding en el executor de CPU, LLM asíncrono);
+    # el pipeline registra sus etapas en la traza de la petición
+    with tracer.activate(trace):
+        result = await chatbot.achat(
             user_message=request.message,
             top_k=request.top_k,
             temperature=request.temperature,
-            use_rag=True
+            use_rag=True,
+            latency_budget_ms=request.latency_budget_ms,
+            mode=request.mode
         )
+    await run_in_threadpool(session_store.save, request.session_id, chatbot)
+
+    # Construir respuesta (validación del modelo de respuesta)
+    response = ChatResponse(
+        answer=result.get("answer", "No se pudo generar una respuesta"),
+        session_id=request.session_id,
+        match_type=result.get("match_type"),
+        best_faq_similarity=result.get("best_faq_similarity"),
+        context_type=result.get("context_type"),
+        intent=result.get("intent"),
+        model_route=result.get("model_route"),
+        context_stats=result.get("context_stats"),
+        queue_ms=result.get("queue_ms"),
+        degradations=result.get("degradations") or [],
+        deadline=result.get("deadline"),
+        extractive=result.get("extractive"),
+        relevant_documents=result.get("relevant_documents", []),
+        timestamp=datetime.now().isoformat()
+    )
 
-        # Construir respuesta
-        return ChatResponse(
-            answer=result.get("answer", "No se pudo generar una respuesta"),
-            session_id=request.session_id,
-            match_type=result.get("match_type"),
-            best_faq_similarity=result.get("best_faq_similarity"),
-            context_type=result.get("context_type"),
-            relevant_documents=result.get("relevant_documents", []),
-            timestamp=datetime.now().isoformat()
-        )
+    # Los tiempos de una pregunta coalescida vienen de la petición que la calculó
+    response.timings = {**(result.get("timings") or {}), **trace.timings_ms()}
+    return response
+
+
+def encode_chat_response(response: ChatResponse, trace) -> JSONResponse:
+    """
+    Codifica la respuesta de /chat a JSON dentro del handler, para que la
+    etapa 'serialization' mida la codificación real (FastAPI la haría
+    después de que el handler devuelve, fuera de la traza)
+
+    El campo timings de la respuesta se fija antes de codificar, por lo que
+    no incluye esta etapa; la traza y el histograma de etapas sí.
+
+    Args:
+        response: ChatResponse ya armado
+        trace: Traza de la petición
+
+    Returns:
+        JSONResponse con el cuerpo ya codificado
+    """
+    serialization_started = time.monotonic()
+    encoded = JSONResponse(content=jsonable_encoder(response))
+    trace.record("serialization", serialization_started)
+    return encoded
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(
+    request: ChatRequest,
+    profile: Optional[str] = None,
+    x_profile_token: Optional[str] = Header(None)
+):
+    """
+    Endpoint principal para interactuar con el chatbot
+
+    Args:
+        request: ChatRequest con el mensaje del usuario
+        profile: Token de administración para perfilar esta petición (?profile=...)
+        x_profile_token: El mismo token en el header X-Profile-Token
 
+    Returns:
+        ChatResponse con la respuesta del chatbot y metadata
+    """
+    trace = tracer.start("POST /chat", {"session_id": request.session_id, "rag.mode": request.mode}, kind=2)
+    error = None
+    try:
+        if profiler.authorized(x_profile_token or profile):
+            # El perfil se guarda con el id de la traza (el mismo de los spans y los logs)
+            async with profiler.profile(trace.trace_id) as profile_info:
+                response = await answer_chat(request, trace)
+            response.profile = profile_info
+        else:
+            response = await answer_chat(request, trace)
+
+        return encode_chat_response(response, trace)
+
+    except AdmissionRejected as e:
+        error = str(e)
+        # Cola llena: rechazo inmediato para que el cliente reintente más tarde
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
     except Exception as e:
+        error = str(e)
         raise HTTPException(status_code=500, detail=f"Error al procesar el mensaje: {str(e)}")
 
+    finally:
+        tracer.finish(trace, error=error)
+
+
+def error_event(error: Exception) -> dict:
+    """Evento de error del streaming (con retry_after si la petición fue rechazada por saturación)"""
+    if isinstance(error, AdmissionRejected):
+        return {
+            "type": "error",
+            "data": {"detail": str(error), "status": 429, "retry_after": math.ceil(error.retry_after)}
+        }
+    return {"type": "error", "data": {"detail": f"Error al procesar el mensaje: {str(error)}"}}
+
+
+def format_sse(event: dict) -> str:
+    """Serializa un evento del pipeline en formato Server-Sent Events"""
+    return f"event: {event['type']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+
+async def stream_chat_events(request: ChatRequest) -> AsyncIterator[dict]:
+    """
+    Genera los eventos de streaming de una petición de chat
+
+    El primer evento trae la metadata de recuperación; el evento 'done'
+    agrega session_id y timestamp al resultado completo.
+    """
+    chatbot = await run_in_threadpool(get_chatbot, request.session_id, request.llm_provider)
+
+    async for event in chatbot.achat_stream(
+        user_message=request.message,
+        top_k=request.top_k,
+        temperature=request.temperature,
+        latency_budget_ms=request.latency_budget_ms,
+        mode=request.mode
+    ):
+        if event["type"] in ("metadata", "done"):
+            event["data"]["session_id"] = request.session_id
+        if event["type"] == "done":
+            event["data"]["timestamp"] = datetime.now().isoformat()
+            await run_in_threadpool(session_store.save, request.session_id, chatbot)
+        yield event
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Endpoint de chat con la respuesta emitida token a token (Server-Sent Events)
+
+    Eventos: 'metadata' (documentos y tipo de match), 'token' (fragmento
+    de la respuesta), 'done' (resultado completo) o 'error'.
+
+    Args:
+        request: ChatRequest con el mensaje del usuario
+
+    Returns:
+        StreamingResponse con media type text/event-stream
+    """
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            async for event in stream_chat_events(request):
+                yield format_sse(event)
+        except Exception as e:
+            yield format_sse(error_event(e))
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Variante WebSocket del chat con streaming
+
+    Cada mensaje recibido es un JSON con el formato de ChatRequest; por cada
+    uno se envían eventos JSON {"type": ..., "data": ...} igual que en /chat/stream.
+    """
+    await websocket.accept()
+
+    try:
+        while True:
+            payload = await websocket.receive_json()
+
+            try:
+                request = ChatRequest(**payload)
+            except ValidationError as e:
+                await websocket.send_json({"type": "error", "data": {"detail": str(e)}})
+                continue
+
+            try:
+                async for event in stream_chat_events(request):
+                    await websocket.send_json(event)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                await websocket.send_json(error_event(e))
+
+    except WebSocketDisconnect:
+        pass
+
 
 @app.get("/stats", response_model=StatsResponse)
 async def get_stats(session_id: str = "default"):
@@ -175,11 +485,11 @@ async def get_stats(session_id: str = "default"):
         StatsResponse con estadísticas del sistema
     """
     try:
-        chatbot = get_chatbot(session_id)
-        stats = chatbot.get_stats()
+        chatbot = await run_in_threadpool(get_chatbot, session_id)
+        stats = await run_in_threadpool(chatbot.get_stats)
 
         # Obtener el proveedor actual de la sesión
-        current_provider = session_llm_providers.get(session_id, "deepseek")
+        current_provider = session_store.get_provider(session_id) or "deepseek"
 
         return StatsResponse(
             total_documents=stats["total_documents"],
@@ -207,7 +517,7 @@ async def get_history(session_id: str = "default"):
         HistoryResponse con el historial de la sesión
     """
     try:
-        chatbot = get_chatbot(session_id)
+        chatbot = await run_in_threadpool(get_chatbot, session_id)
         history = chatbot.get_history()
 
         # Formatear historial
@@ -241,8 +551,9 @@ async def clear_history(session_id: str = "default"):
         Mensaje de confirmación
     """
     try:
-        chatbot = get_chatbot(session_id)
+        chatbot = await run_in_threadpool(get_chatbot, session_id)
         chatbot.clear_history()
+        await run_in_threadpool(session_store.save, session_id, chatbot)
 
         return {
             "message": "Historial limpiado exitosamente",
@@ -265,9 +576,9 @@ async def delete_session(session_id: str):
     Returns:
         Mensaje de confirmación
     """
-    if session_id in chat_sessions:
-        chat_sessions[session_id].close()
-        del chat_sessions[session_id]
+    deleted = await run_in_threadpool(session_store.delete, session_id)
+
+    if deleted:
         return {
             "message": f"Sesión {session_id} eliminada",
             "timestamp": datetime.now().isoformat()
@@ -282,11 +593,15 @@ async def list_sessions():
     Lista todas las sesiones activas
 
     Returns:
-        Lista de IDs de sesiones activas
+        Lista de IDs de sesiones activas y estadísticas del almacén
+        (memoria por sesión, evicciones por TTL, LRU o memoria)
     """
+    sessions = session_store.list_sessions()
+
     return {
-        "sessions": list(chat_sessions.keys()),
-        "count": len(chat_sessions),
+        "sessions": sessions,
+        "count": len(sessions),
+        "store": session_store.get_stats(),
         "timestamp": datetime.now().isoformat()
     }
 
@@ -310,19 +625,11 @@ async def change_model(request: ModelChangeRequest):
                 detail="Proveedor inválido. Usa 'groq' o 'deepseek'"
             )
 
-        # Forzar recreación del chatbot con nuevo proveedor
-        if request.session_id in chat_sessions:
-            chat_sessions[request.session_id].close()
-            del chat_sessions[request.session_id]
-
-        # Actualizar el proveedor guardado
-        session_llm_providers[request.session_id] = request.llm_provider
-
-        # Crear nuevo chatbot con el proveedor especificado
-        chatbot = get_chatbot(request.session_id, request.llm_provider)
+        # Crear nuevo chatbot con el proveedor especificado (reemplaza al anterior)
+        chatbot = await run_in_threadpool(get_chatbot, request.session_id, request.llm_provider)
 
         # Obtener stats del nuevo chatbot
-        stats = chatbot.get_stats()
+        stats = await run_in_threadpool(chatbot.get_stats)
 
         return {
             "message": f"Modelo cambiado exitosamente a {request.llm_provider}",
@@ -80,16 +80,22 @@ def main():
                 if not user_input:
                     continue
 
-                # Obtener respuesta del chatbot
-                result = chatbot.chat(
+                # Obtener respuesta del chatbot, mostrando los tokens a medida que llegan
+                result = {}
+                started = False
+                for event in chatbot.chat_stream(
                     user_message=user_input,
                     top_k=4,
-                    temperature=0.7,
-                    use_rag=True
-                )
-
-                # Mostrar respuesta
-                print(f"\n🎓 VOAE: {result['answer']}\n")
+                    temperature=0.7
+                ):
+                    if event["type"] == "token":
+                        if not started:
+                            print("\n🎓 VOAE: ", end="", flush=True)
+                            started = True
+                        print(event["data"]["content"], end="", flush=True)
+                    elif event["type"] == "done":
+                        result = event["data"]
+                print("\n")
 
                 # Mostrar información de match (si disponible)
                 if result.get("match_type"):
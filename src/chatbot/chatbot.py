@@ -5,49 +5,96 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from typing import List, Tuple, Optional
+import asyncio
+from typing import AsyncIterator, Iterator, List, Tuple, Optional
 from rag.rag_pipeline import RAGPipeline
+from rag.retrieval_reuse import SessionRetrievalCache
+from chatbot.memory import ConversationMemory
 
 
 class RAGChatbot:
     """Chatbot con historial de conversación y sistema RAG"""
 
-    def __init__(self, docs_folder: str = "data/docs", max_history: int = 5, llm_provider: str = "deepseek"):
+    def __init__(
+        self,
+        docs_folder: str = "data/docs",
+        max_history: int = 5,
+        llm_provider: str = "deepseek",
+        pipeline: Optional[RAGPipeline] = None
+    ):
         """
         Inicializa el chatbot con ChromaDB
 
         Args:
             docs_folder: Carpeta con documentos
-            max_history: Número máximo de mensajes a recordar en el historial
+            max_history: Número de turnos que se recuerdan textuales (los anteriores
+                se resumen en la memoria)
             llm_provider: Proveedor de LLM ("groq" o "deepseek")
+            pipeline: Pipeline ya inicializado para compartir entre sesiones (opcional)
         """
-        self.pipeline = RAGPipeline(docs_folder, llm_provider=llm_provider)
+        self.pipeline = pipeline if pipeline is not None else RAGPipeline(docs_folder, llm_provider=llm_provider)
+        self.owns_pipeline = pipeline is None
         self.max_history = max_history
-        self.conversation_history = []
+
+        # Últimos turnos + resumen de los anteriores, con tope de tokens.
+        # Es thread-safe: la modifican varias peticiones concurrentes de la misma sesión
+        self.memory = ConversationMemory(
+            token_counter=self.pipeline.context_builder.count_tokens,
+            max_turns=max_history,
+            llm_client=self.pipeline.llm_client
+        )
+
+        # Candidatos recuperados en el último turno (los seguimientos los reutilizan)
+        self.retrieval_cache = SessionRetrievalCache()
 
     def _format_history_for_llm(self) -> str:
         """
-        Formatea el historial de conversación para el LLM
+        Formatea la memoria de la conversación para el LLM
 
         Returns:
             String con el historial formateado
         """
-        if not self.conversation_history:
+        memory = self.memory.render()
+        if not memory:
             return ""
 
-        history_text = "\n\n=== Historial de conversación ===\n"
-        for user_msg, assistant_msg in self.conversation_history:
-            history_text += f"\nUsuario: {user_msg}\nAsistente: {assistant_msg}\n"
-        history_text += "=== Fin del historial ===\n\n"
+        return f"\n\n=== Historial de conversación ===\n{memory}\n=== Fin del historial ===\n\n"
+
+    def _rag_kwargs(
+        self,
+        user_message: str,
+        top_k: int,
+        temperature: float,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
+    ) -> dict:
+        """
+        Argumentos de la consulta RAG con la memoria de la conversación
 
-        return history_text
+        La pregunta de seguimiento se condensa con el tema de la conversación
+        para la búsqueda, la memoria se incluye en el prompt y los candidatos
+        del turno anterior se reutilizan si la consulta sigue en el mismo tema.
+        """
+        return {
+            "question": user_message,
+            "top_k": top_k,
+            "temperature": temperature,
+            "enable_faq": True,
+            "retrieval_query": self.memory.condense_query(user_message),
+            "conversation": self.memory.render() or None,
+            "retrieval_cache": self.retrieval_cache,
+            "latency_budget_ms": latency_budget_ms,
+            "mode": mode
+        }
 
     def chat(
         self,
         user_message: str,
         top_k: int = 4,
         temperature: float = 0.7,
-        use_rag: bool = True
+        use_rag: bool = True,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
     ) -> dict:
         """
         Procesa un mensaje del usuario y genera una respuesta
@@ -57,24 +104,19 @@ class RAGChatbot:
             top_k: Número de documentos relevantes a recuperar
             temperature: Temperatura para DeepSeek
             use_rag: Si es True, usa RAG; si es False, solo usa el historial
+            latency_budget_ms: Presupuesto de latencia de la petición (opcional)
+            mode: 'generative' (LLM) o 'extractive' (FAQ o pasajes, sin LLM)
 
         Returns:
             Diccionario con respuesta y metadatos
         """
         if not user_message or not user_message.strip():
-            return {
-                "answer": "Por favor, escribe un mensaje.",
-                "relevant_documents": [],
-                "error": "Empty message"
-            }
+            return self._empty_message_result()
 
         # Si usa RAG, hacer consulta con sistema FAQ híbrido
         if use_rag:
             result = self.pipeline.query_with_faq(
-                question=user_message,
-                top_k=top_k,
-                temperature=temperature,
-                enable_faq=True
+                **self._rag_kwargs(user_message, top_k, temperature, latency_budget_ms, mode)
             )
         else:
             # Sin RAG, solo conversación con historial
@@ -102,40 +144,155 @@ class RAGChatbot:
                 }
 
         # Agregar al historial (mantener solo los últimos max_history)
-        self.conversation_history.append((user_message, result["answer"]))
+        self._add_to_history(user_message, result["answer"])
+
+        return result
+
+    def chat_stream(
+        self,
+        user_message: str,
+        top_k: int = 4,
+        temperature: float = 0.7,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
+    ) -> Iterator[dict]:
+        """
+        Procesa un mensaje del usuario emitiendo la respuesta por partes (con RAG)
+
+        Args:
+            user_message: Mensaje del usuario
+            top_k: Número de documentos relevantes a recuperar
+            temperature: Temperatura base para el LLM
+            latency_budget_ms: Presupuesto de latencia de la petición (opcional)
+            mode: 'generative' (LLM) o 'extractive' (FAQ o pasajes, sin LLM)
 
-        # Limitar el historial
-        if len(self.conversation_history) > self.max_history:
-            self.conversation_history = self.conversation_history[-self.max_history:]
+        Yields:
+            Eventos de RAGPipeline.query_with_faq_stream ('metadata', 'token', 'done')
+        """
+        if not user_message or not user_message.strip():
+            result = self._empty_message_result()
+            yield {"type": "token", "data": {"content": result["answer"]}}
+            yield {"type": "done", "data": result}
+            return
+
+        rag_kwargs = self._rag_kwargs(user_message, top_k, temperature, latency_budget_ms, mode)
+        for event in self.pipeline.query_with_faq_stream(**rag_kwargs):
+            if event["type"] == "done":
+                self._add_to_history(user_message, event["data"]["answer"])
+            yield event
+
+    async def achat(
+        self,
+        user_message: str,
+        top_k: int = 4,
+        temperature: float = 0.7,
+        use_rag: bool = True,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
+    ) -> dict:
+        """
+        Versión asíncrona de chat (no bloquea el event loop)
+
+        Args:
+            user_message: Mensaje del usuario
+            top_k: Número de documentos relevantes a recuperar
+            temperature: Temperatura base para el LLM
+            use_rag: Si es True, usa RAG; si es False, solo usa el historial
+            latency_budget_ms: Presupuesto de latencia de la petición (opcional)
+            mode: 'generative' (LLM) o 'extractive' (FAQ o pasajes, sin LLM)
+
+        Returns:
+            Diccionario con respuesta y metadatos
+        """
+        if not user_message or not user_message.strip():
+            return self._empty_message_result()
+
+        if not use_rag:
+            # simple_chat solo existe en versión síncrona
+            return await asyncio.to_thread(self.chat, user_message, top_k, temperature, False)
+
+        result = await self.pipeline.aquery_with_faq(
+            **self._rag_kwargs(user_message, top_k, temperature, latency_budget_ms, mode)
+        )
+        await self._aadd_to_history(user_message, result["answer"])
 
         return result
 
+    async def achat_stream(
+        self,
+        user_message: str,
+        top_k: int = 4,
+        temperature: float = 0.7,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
+    ) -> AsyncIterator[dict]:
+        """
+        Versión asíncrona de chat_stream (mismos eventos)
+
+        Yields:
+            Eventos de RAGPipeline.aquery_with_faq_stream ('metadata', 'token', 'done')
+        """
+        if not user_message or not user_message.strip():
+            result = self._empty_message_result()
+            yield {"type": "token", "data": {"content": result["answer"]}}
+            yield {"type": "done", "data": result}
+            return
+
+        rag_kwargs = self._rag_kwargs(user_message, top_k, temperature, latency_budget_ms, mode)
+        async for event in self.pipeline.aquery_with_faq_stream(**rag_kwargs):
+            if event["type"] == "done":
+                await self._aadd_to_history(user_message, event["data"]["answer"])
+            yield event
+
+    def _empty_message_result(self) -> dict:
+        """Respuesta para un mensaje vacío"""
+        return {
+            "answer": "Por favor, escribe un mensaje.",
+            "relevant_documents": [],
+            "error": "Empty message"
+        }
+
+    def _add_to_history(self, user_message: str, answer: str):
+        """
+        Agrega un turno a la memoria (los que salen de la ventana pasan al resumen)
+
+        Args:
+            user_message: Mensaje del usuario
+            answer: Respuesta del asistente
+        """
+        self.memory.add_turn(user_message, answer)
+
+    async def _aadd_to_history(self, user_message: str, answer: str):
+        """Versión asíncrona de _add_to_history (el resumen con LLM corre en un hilo)"""
+        if self.memory.summarizes_with_llm:
+            await asyncio.to_thread(self._add_to_history, user_message, answer)
+        else:
+            self._add_to_history(user_message, answer)
+
     def clear_history(self):
         """Limpia el historial de conversación"""
-        self.conversation_history = []
+        self.memory.clear()
+        self.retrieval_cache.clear()
         print("Historial de conversación limpiado")
 
     def get_history(self) -> List[Tuple[str, str]]:
         """
-        Obtiene el historial de conversación
+        Obtiene los turnos recientes de la conversación (sin el resumen)
 
         Returns:
             Lista de tuplas (user_message, assistant_message)
         """
-        return self.conversation_history.copy()
+        return self.memory.get_turns()
 
     def set_max_history(self, max_history: int):
         """
-        Cambia el número máximo de mensajes en el historial
+        Cambia el número de turnos que se recuerdan textuales
 
         Args:
             max_history: Nuevo límite de historial
         """
         self.max_history = max_history
-
-        # Recortar historial actual si excede el nuevo límite
-        if len(self.conversation_history) > max_history:
-            self.conversation_history = self.conversation_history[-max_history:]
+        self.memory.set_max_turns(max_history)
 
     def get_stats(self) -> dict:
         """
@@ -147,13 +304,24 @@ class RAGChatbot:
         stats = self.pipeline.get_stats()
         stats.update({
             "max_history": self.max_history,
-            "current_history_length": len(self.conversation_history)
+            "current_history_length": len(self.get_history()),
+            "memory": self.memory.get_stats()
         })
         return stats
 
+    def memory_bytes(self) -> int:
+        """
+        Memoria aproximada que ocupa la sesión (sin el pipeline compartido)
+
+        Returns:
+            Bytes de la conversación y de los candidatos guardados
+        """
+        return self.memory.memory_bytes() + self.retrieval_cache.memory_bytes()
+
     def close(self):
-        """Cierra la conexión del pipeline"""
-        self.pipeline.close()
+        """Cierra la conexión del pipeline (si no es compartido)"""
+        if self.owns_pipeline:
+            self.pipeline.close()
 
 
 if __name__ == "__main__":
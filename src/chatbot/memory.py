@@ -0,0 +1,362 @@
+"""
+Módulo de memoria de conversación: últimos turnos textuales más un resumen
+compacto de los anteriores, todo dentro de un tope de tokens
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from monitoring.logger import get_logger
+
+logger = get_logger("rag.memory")
+
+
+class ConversationMemory:
+    """
+    Memoria de una sesión de chat.
+
+    - Guarda los últimos max_turns turnos tal cual.
+    - Los turnos que salen de esa ventana se agregan a un resumen, de forma
+      incremental: en cada actualización solo se procesan los turnos que salen,
+      nunca toda la conversación.
+    - render() devuelve resumen + turnos recientes sin pasar de max_tokens,
+      por lo que el costo del prompt no crece con la longitud de la sesión.
+    - condense_query() completa las preguntas de seguimiento ("¿y los
+      requisitos?") con el tema de la conversación para la búsqueda.
+
+    El resumen es extractivo por defecto (sin costo de LLM). Con
+    MEMORY_SUMMARIZER=llm lo actualiza el LLM a partir del resumen anterior
+    y los turnos que salen.
+    """
+
+    DEFAULT_MAX_TOKENS = 600
+    DEFAULT_SUMMARY_MAX_TOKENS = 200
+    SUMMARY_ANSWER_CHARS = 160  # Parte de cada respuesta que entra al resumen extractivo
+    SUMMARY_HEADER = "Resumen de turnos anteriores:\n"
+
+    # Preguntas que dependen de la conversación anterior
+    FOLLOWUP_PATTERN = re.compile(
+        r"^\W*(y|e|pero|entonces|tambi[eé]n|adem[aá]s|ok|vale)\b"
+        r"|\b(eso|esto|esa|ese|esas|esos|ello|dicho|dicha|su|sus|ah[ií]|all[ií]|lo anterior|"
+        r"m[aá]s detalles?|m[aá]s informaci[oó]n|expl[ií]ca(me)?( mejor)?|un ejemplo|otra vez)\b",
+        re.IGNORECASE
+    )
+    FOLLOWUP_MAX_WORDS = 2  # "¿requisitos?", "¿y cuándo?"
+
+    def __init__(
+        self,
+        token_counter: Callable[[str], int],
+        max_turns: int = 5,
+        max_tokens: Optional[int] = None,
+        summary_max_tokens: Optional[int] = None,
+        llm_client=None
+    ):
+        """
+        Inicializa la memoria (los valores omitidos se leen de .env)
+
+        Args:
+            token_counter: Función que cuenta tokens
+            max_turns: Turnos que se conservan textuales
+            max_tokens: Tope de tokens de render() (MEMORY_MAX_TOKENS)
+            summary_max_tokens: Tope de tokens del resumen (MEMORY_SUMMARY_MAX_TOKENS); se
+                recorta para que el resumen con su encabezado quepa en max_tokens
+            llm_client: Cliente con simple_chat, necesario si MEMORY_SUMMARIZER=llm
+        """
+        load_dotenv()
+
+        if max_tokens is None:
+            max_tokens = int(os.getenv('MEMORY_MAX_TOKENS', self.DEFAULT_MAX_TOKENS))
+        if summary_max_tokens is None:
+            summary_max_tokens = int(os.getenv('MEMORY_SUMMARY_MAX_TOKENS', self.DEFAULT_SUMMARY_MAX_TOKENS))
+
+        self.count_tokens = token_counter
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        # El resumen y su encabezado deben dejar lugar en render() para al menos un turno
+        summary_limit = max_tokens - token_counter(self.SUMMARY_HEADER) - 1
+        self.summary_max_tokens = max(0, min(summary_max_tokens, summary_limit))
+
+        summarizer = os.getenv('MEMORY_SUMMARIZER', 'extractive').lower()
+        self.llm_client = llm_client if summarizer == 'llm' else None
+
+        self.turns: List[Tuple[str, str]] = []
+        self.summary = ""
+        self.topic = None  # Última pregunta autónoma (tema de los seguimientos)
+
+        self._lock = threading.Lock()
+        self._summary_lock = threading.Lock()  # Serializa las actualizaciones del resumen
+
+    @property
+    def summarizes_with_llm(self) -> bool:
+        """True si el resumen lo actualiza el LLM (add_turn puede tardar)"""
+        return self.llm_client is not None
+
+    def is_followup(self, question: str) -> bool:
+        """
+        Detecta si una pregunta depende de la conversación anterior
+
+        Args:
+            question: Pregunta del usuario
+
+        Returns:
+            True si parece una pregunta de seguimiento
+        """
+        words = re.findall(r'\w+', question)
+        return len(words) <= self.FOLLOWUP_MAX_WORDS or bool(self.FOLLOWUP_PATTERN.search(question))
+
+    def condense_query(self, question: str) -> str:
+        """
+        Construye la consulta de búsqueda para una pregunta
+
+        Las preguntas de seguimiento se completan con la última pregunta
+        autónoma de la sesión; las demás se usan tal cual.
+
+        Args:
+            question: Pregunta del usuario
+
+        Returns:
+            Consulta para la búsqueda (la misma pregunta si no es un seguimiento)
+        """
+        with self._lock:
+            topic = self.topic
+
+        if topic is None or not self.is_followup(question):
+            return question
+        return f"{topic} {question.strip()}"
+
+    def add_turn(self, user_message: str, answer: str):
+        """
+        Agrega un turno y mueve al resumen los que exceden la ventana o el tope
+
+        Args:
+            user_message: Mensaje del usuario
+            answer: Respuesta del asistente
+        """
+        with self._lock:
+            self.turns.append((user_message, answer))
+            if self.topic is None or not self.is_followup(user_message):
+                self.topic = user_message.strip()
+
+            evicted = []
+            recent_budget = self.max_tokens - self.summary_max_tokens
+            while self.turns and (
+                len(self.turns) > self.max_turns
+                or (len(self.turns) > 1 and self._turns_tokens(self.turns) > recent_budget)
+            ):
+                evicted.append(self.turns.pop(0))
+
+        if evicted:
+            self._fold_into_summary(evicted)
+
+    def _turns_tokens(self, turns: List[Tuple[str, str]]) -> int:
+        return sum(self.count_tokens(user) + self.count_tokens(answer) for user, answer in turns)
+
+    def _fold_into_summary(self, evicted: List[Tuple[str, str]]):
+        """Actualiza el resumen con los turnos que salieron de la ventana"""
+        with self._summary_lock:
+            with self._lock:
+                summary = self.summary
+
+            new_summary = None
+            if self.llm_client is not None:
+                new_summary = self._summarize_with_llm(summary, evicted)
+            if new_summary is None:
+                new_summary = self._summarize_extractive(summary, evicted)
+
+            with self._lock:
+                self.summary = new_summary
+
+    def _summarize_extractive(self, summary: str, turns: List[Tuple[str, str]]) -> str:
+        """
+        Resumen sin LLM: una línea por turno (pregunta y comienzo de la respuesta)
+
+        Si excede summary_max_tokens se eliminan las líneas más antiguas.
+        """
+        lines = [line for line in summary.split('\n') if line]
+        for user_message, answer in turns:
+            first_sentence = re.split(r'(?<=[.!?])\s', answer.strip(), maxsplit=1)[0]
+            if len(first_sentence) > self.SUMMARY_ANSWER_CHARS:
+                first_sentence = first_sentence[:self.SUMMARY_ANSWER_CHARS].rstrip() + "…"
+            lines.append(f"- {user_message.strip()} → {first_sentence}")
+
+        while len(lines) > 1 and self.count_tokens("\n".join(lines)) > self.summary_max_tokens:
+            lines.pop(0)
+        return self._truncate("\n".join(lines), self.summary_max_tokens)
+
+    def _summarize_with_llm(self, summary: str, turns: List[Tuple[str, str]]) -> Optional[str]:
+        """
+        Resumen incremental con el LLM (resumen anterior + turnos que salen)
+
+        Returns:
+            Resumen nuevo, o None si la llamada falla (se usa el extractivo)
+        """
+        turns_text = "\n".join(f"Usuario: {user}\nAsistente: {answer}" for user, answer in turns)
+        message = (
+            "Actualiza el resumen de una conversación entre un estudiante y el asistente universitario. "
+            "Conserva los temas consultados, los datos concretos ya dados y las preferencias del estudiante. "
+            f"Responde solo con el resumen, en menos de {self.summary_max_tokens} tokens.\n\n"
+            f"Resumen actual:\n{summary or '(vacío)'}\n\n"
+            f"Turnos nuevos:\n{turns_text}"
+        )
+        try:
+            new_summary = self.llm_client.simple_chat(
+                message=message,
+                temperature=0.1,
+                max_tokens=self.summary_max_tokens
+            )
+        except Exception as e:
+            logger.warning(
+                "memory.summary_failed", f"No se pudo resumir la conversación con el LLM: {str(e)}",
+                error_type=type(e).__name__, turns=len(turns)
+            )
+            return None
+        return self._truncate(new_summary.strip(), self.summary_max_tokens)
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Recorta un texto (proporcionalmente en caracteres) hasta max_tokens"""
+        if max_tokens <= 0:
+            return ""
+        tokens = self.count_tokens(text)
+        while tokens > max_tokens and text:
+            keep = int(len(text) * max_tokens / tokens) - 1
+            if keep <= 0:
+                return ""
+            # Cada vuelta acorta el texto, incluso con el "…" agregado
+            text = text[:keep].rstrip() + "…"
+            tokens = self.count_tokens(text)
+        return text
+
+    def render(self) -> str:
+        """
+        Memoria para el prompt: resumen y turnos recientes dentro de max_tokens
+
+        Returns:
+            Texto de la memoria (vacío si no hay conversación)
+        """
+        with self._lock:
+            summary = self.summary
+            turns = list(self.turns)
+
+        parts = []
+        if summary:
+            parts.append(f"{self.SUMMARY_HEADER}{summary}")
+
+        budget = self.max_tokens - self.count_tokens("\n\n".join(parts))
+        recent = []
+        # Los turnos más nuevos tienen prioridad; las respuestas largas se recortan
+        for user_message, answer in reversed(turns):
+            if budget <= 0:
+                break
+            line = self._truncate(f"Usuario: {user_message}\nAsistente: {answer}", budget)
+            tokens = self.count_tokens(line)
+            if tokens == 0:
+                break
+            recent.insert(0, line)
+            budget -= tokens
+
+        if recent:
+            parts.append("\n".join(recent))
+        return "\n\n".join(parts)
+
+    def get_turns(self) -> List[Tuple[str, str]]:
+        """Turnos textuales (user_message, answer)"""
+        with self._lock:
+            return list(self.turns)
+
+    def set_max_turns(self, max_turns: int):
+        """
+        Cambia la ventana de turnos textuales
+
+        Args:
+            max_turns: Nuevo número de turnos
+        """
+        with self._lock:
+            self.max_turns = max_turns
+            evicted = self.turns[:-max_turns] if len(self.turns) > max_turns else []
+            self.turns = self.turns[len(evicted):]
+
+        if evicted:
+            self._fold_into_summary(evicted)
+
+    def export_state(self) -> Dict:
+        """
+        Estado serializable de la memoria (para persistir la sesión)
+
+        Returns:
+            Diccionario con turns, summary y topic
+        """
+        with self._lock:
+            return {
+                'turns': [list(turn) for turn in self.turns],
+                'summary': self.summary,
+                'topic': self.topic
+            }
+
+    def load_state(self, state: Dict):
+        """
+        Restaura la memoria desde export_state
+
+        Args:
+            state: Diccionario con turns, summary y topic
+        """
+        with self._lock:
+            self.turns = [tuple(turn) for turn in state.get('turns', [])]
+            self.summary = state.get('summary', "")
+            self.topic = state.get('topic')
+
+    def memory_bytes(self) -> int:
+        """Tamaño aproximado del texto guardado, en bytes"""
+        with self._lock:
+            texts = [self.summary, self.topic or ""] + [text for turn in self.turns for text in turn]
+        return sum(len(text.encode('utf-8')) for text in texts)
+
+    def clear(self):
+        """Olvida la conversación"""
+        with self._lock:
+            self.turns = []
+            self.summary = ""
+            self.topic = None
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas de la memoria
+
+        Returns:
+            Diccionario con turnos, tokens del resumen y tokens de render()
+        """
+        rendered = self.render()
+        with self._lock:
+            summary = self.summary
+            turns = len(self.turns)
+        return {
+            'turns': turns,
+            'summary_tokens': self.count_tokens(summary),
+            'memory_tokens': self.count_tokens(rendered),
+            'max_tokens': self.max_tokens
+        }
+
+
+if __name__ == "__main__":
+    # Test: 12 turnos con max_turns=3 -> el prompt de memoria no crece
+    import sys
+    from pathlib import Path
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from ingestion.markdown_chunker import approximate_token_count
+
+    memory = ConversationMemory(approximate_token_count, max_turns=3, max_tokens=300, summary_max_tokens=120)
+
+    questions = ["¿Qué becas ofrece la VOAE?", "¿Puedes darme más detalles?", "¿y los requisitos?",
+                 "¿Dónde queda el comedor?", "¿Cuál es su horario?", "¿Cómo obtengo horas VOAE?"] * 2
+    for i, question in enumerate(questions, 1):
+        print(f"{question:32} -> búsqueda: {memory.condense_query(question)}")
+        memory.add_turn(question, f"Respuesta número {i}. " + "Detalle adicional de la respuesta. " * 8)
+        print(f"{'':32}    tokens de memoria: {memory.get_stats()['memory_tokens']}")
+
+    print(f"\n{memory.render()}")
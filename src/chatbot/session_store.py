@@ -0,0 +1,496 @@
+"""
+Módulo de almacenamiento de sesiones de chat con expiración por inactividad,
+límite de sesiones (LRU) y tope de memoria
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from monitoring.logger import get_logger
+
+logger = get_logger("rag.sessions")
+
+
+class _Entry:
+    """Sesión viva: chatbot, proveedor y contabilidad de memoria"""
+
+    __slots__ = ("chatbot", "llm_provider", "last_access", "memory_bytes", "version")
+
+    def __init__(self, chatbot, llm_provider: str):
+        self.chatbot = chatbot
+        self.llm_provider = llm_provider
+        self.last_access = time.monotonic()
+        self.memory_bytes = chatbot.memory_bytes()
+        self.version = 0.0  # updated_at de la última copia persistida que se cargó o guardó
+
+
+class SessionStore:
+    """
+    Sesiones de chat en memoria del proceso.
+
+    - Las sesiones sin uso por más de ttl_seconds se eliminan.
+    - Con más de max_sessions sesiones, o más de max_memory_mb en total,
+      se eliminan las usadas hace más tiempo (LRU).
+    - La memoria de cada sesión (conversación y candidatos guardados) se
+      recalcula cada vez que se guarda un turno.
+
+    Al eliminarse una sesión se pierde su historial; SQLiteSessionStore lo
+    conserva y lo comparte entre workers.
+    """
+
+    DEFAULT_TTL_SECONDS = 1800
+    DEFAULT_MAX_SESSIONS = 500
+    DEFAULT_MAX_MEMORY_MB = 200
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = None,
+        max_sessions: Optional[int] = None,
+        max_memory_mb: Optional[float] = None
+    ):
+        """
+        Inicializa el almacén (los valores omitidos se leen de .env)
+
+        Args:
+            ttl_seconds: Inactividad máxima de una sesión (SESSION_TTL_SECONDS)
+            max_sessions: Sesiones vivas como máximo (SESSION_MAX_SESSIONS)
+            max_memory_mb: Memoria total de las sesiones vivas (SESSION_MAX_MEMORY_MB)
+        """
+        load_dotenv()
+
+        if ttl_seconds is None:
+            ttl_seconds = float(os.getenv('SESSION_TTL_SECONDS', self.DEFAULT_TTL_SECONDS))
+        if max_sessions is None:
+            max_sessions = int(os.getenv('SESSION_MAX_SESSIONS', self.DEFAULT_MAX_SESSIONS))
+        if max_memory_mb is None:
+            max_memory_mb = float(os.getenv('SESSION_MAX_MEMORY_MB', self.DEFAULT_MAX_MEMORY_MB))
+
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max(1, max_sessions)
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # {session_id: _Entry}, de la menos a la más usada
+        self._memory_bytes = 0
+        self.evictions = {"ttl": 0, "lru": 0, "memory": 0}
+
+    def _remove(self, session_id: str, reason: Optional[str] = None) -> Optional[_Entry]:
+        """Quita una sesión viva (con el lock tomado) y la cierra"""
+        entry = self._sessions.pop(session_id, None)
+        if entry is None:
+            return None
+        self._memory_bytes -= entry.memory_bytes
+        if reason is not None:
+            self.evictions[reason] += 1
+        entry.chatbot.close()
+        return entry
+
+    def _evict(self):
+        """Aplica TTL, límite de sesiones y tope de memoria (con el lock tomado)"""
+        now = time.monotonic()
+
+        # El orden LRU es también el orden de último acceso: las vencidas están al inicio
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if now - entry.last_access <= self.ttl_seconds:
+                break
+            self._remove(session_id, "ttl")
+
+        while len(self._sessions) > self.max_sessions:
+            self._remove(next(iter(self._sessions)), "lru")
+
+        while len(self._sessions) > 1 and self._memory_bytes > self.max_memory_bytes:
+            self._remove(next(iter(self._sessions)), "memory")
+
+    def get(self, session_id: str):
+        """
+        Obtiene el chatbot vivo de una sesión y la marca como usada
+
+        Args:
+            session_id: ID de la sesión
+
+        Returns:
+            Chatbot de la sesión o None si no está viva
+        """
+        with self._lock:
+            self._evict()
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            entry.last_access = time.monotonic()
+            self._sessions.move_to_end(session_id)
+
+        self._refresh(session_id, entry)
+        return entry.chatbot
+
+    def get_provider(self, session_id: str) -> Optional[str]:
+        """
+        Proveedor de LLM de una sesión
+
+        Args:
+            session_id: ID de la sesión
+
+        Returns:
+            Proveedor guardado o None si la sesión no existe
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return entry.llm_provider if entry is not None else None
+
+    def put(self, session_id: str, chatbot, llm_provider: str):
+        """
+        Registra el chatbot de una sesión (reemplaza y cierra el anterior)
+
+        Args:
+            session_id: ID de la sesión
+            chatbot: RAGChatbot de la sesión
+            llm_provider: Proveedor de LLM de la sesión
+        """
+        self._restore(session_id, chatbot)
+        entry = _Entry(chatbot, llm_provider)
+        entry.version = self._persist(session_id, chatbot, llm_provider)
+
+        with self._lock:
+            self._remove(session_id)
+            self._sessions[session_id] = entry
+            self._memory_bytes += entry.memory_bytes
+            self._evict()
+
+    def save(self, session_id: str, chatbot):
+        """
+        Registra un turno nuevo: recalcula la memoria de la sesión y la persiste
+
+        Args:
+            session_id: ID de la sesión
+            chatbot: Chatbot que respondió (puede haber sido eliminado mientras tanto)
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and entry.chatbot is chatbot:
+                memory_bytes = chatbot.memory_bytes()
+                self._memory_bytes += memory_bytes - entry.memory_bytes
+                entry.memory_bytes = memory_bytes
+                llm_provider = entry.llm_provider
+                self._evict()
+            else:
+                entry = None
+                llm_provider = None
+
+        version = self._persist(session_id, chatbot, llm_provider)
+        if entry is not None:
+            entry.version = version
+
+    def pop(self, session_id: str) -> bool:
+        """
+        Cierra el chatbot vivo de una sesión (el historial persistido se conserva)
+
+        Args:
+            session_id: ID de la sesión
+
+        Returns:
+            True si la sesión estaba viva
+        """
+        with self._lock:
+            return self._remove(session_id) is not None
+
+    def delete(self, session_id: str) -> bool:
+        """
+        Elimina una sesión y su historial
+
+        Args:
+            session_id: ID de la sesión
+
+        Returns:
+            True si la sesión existía
+        """
+        return self.pop(session_id)
+
+    def list_sessions(self) -> List[str]:
+        """IDs de las sesiones vivas (de la menos a la más usada)"""
+        with self._lock:
+            self._evict()
+            return list(self._sessions)
+
+    # Extensiones para almacenes persistentes
+    def _restore(self, session_id: str, chatbot):
+        """Carga el historial persistido en un chatbot nuevo"""
+
+    def _refresh(self, session_id: str, entry: _Entry):
+        """Actualiza una sesión viva si otro proceso guardó una versión más nueva"""
+
+    def _persist(self, session_id: str, chatbot, llm_provider: Optional[str]) -> float:
+        """Guarda el historial de la sesión; devuelve su versión"""
+        return 0.0
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas del almacén
+
+        Returns:
+            Diccionario con sesiones vivas, memoria y evicciones por causa
+        """
+        with self._lock:
+            largest = max((entry.memory_bytes for entry in self._sessions.values()), default=0)
+            return {
+                'backend': 'memory',
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'ttl_seconds': self.ttl_seconds,
+                'memory_bytes': self._memory_bytes,
+                'max_memory_bytes': self.max_memory_bytes,
+                'largest_session_bytes': largest,
+                'evictions': dict(self.evictions)
+            }
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SessionStore que persiste el historial y el proveedor de cada sesión
+    en un archivo SQLite local (modo WAL).
+
+    - Una sesión eliminada de memoria (TTL, LRU o tope) recupera su
+      historial la próxima vez que se usa.
+    - Varios workers del mismo nodo comparten las sesiones: si otro proceso
+      guardó un turno más nuevo, la sesión viva se actualiza antes de usarse.
+    - Los historiales sin uso por más de history_ttl_seconds se borran del archivo.
+
+    Los candidatos de búsqueda guardados no se persisten (solo valen
+    dentro del proceso).
+    """
+
+    DEFAULT_PATH = "data/cache/sessions.sqlite3"
+    DEFAULT_HISTORY_TTL_SECONDS = 7 * 24 * 3600
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        history_ttl_seconds: Optional[float] = None,
+        **kwargs
+    ):
+        """
+        Inicializa el almacén (los valores omitidos se leen de .env)
+
+        Args:
+            db_path: Ruta del archivo SQLite (SESSION_DB_PATH)
+            history_ttl_seconds: Inactividad máxima de un historial persistido
+                (SESSION_HISTORY_TTL_SECONDS)
+            **kwargs: ttl_seconds, max_sessions y max_memory_mb de SessionStore
+        """
+        super().__init__(**kwargs)
+
+        if db_path is None:
+            db_path = os.getenv('SESSION_DB_PATH', self.DEFAULT_PATH)
+        if history_ttl_seconds is None:
+            history_ttl_seconds = float(
+                os.getenv('SESSION_HISTORY_TTL_SECONDS', self.DEFAULT_HISTORY_TTL_SECONDS)
+            )
+
+        self.db_path = Path(db_path)
+        self.history_ttl_seconds = history_ttl_seconds
+
+        # sqlite3 no permite compartir conexiones entre hilos: una por hilo
+        self._local = threading.local()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._create_table()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Obtiene la conexión SQLite del hilo actual"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_table(self):
+        """Crea la tabla de sesiones si no existe"""
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                session_id TEXT PRIMARY KEY,
+                llm_provider TEXT NOT NULL,
+                memory TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated_at ON chat_sessions(updated_at)")
+        conn.commit()
+
+    def _load(self, session_id: str) -> Optional[tuple]:
+        """Lee (llm_provider, memory, updated_at) de una sesión persistida"""
+        try:
+            return self._connect().execute(
+                "SELECT llm_provider, memory, updated_at FROM chat_sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(
+                "session.read_error", f"Error leyendo sesión {session_id}: {str(e)}", exc_info=e, session_id=session_id
+            )
+            return None
+
+    def get_provider(self, session_id: str) -> Optional[str]:
+        """
+        Proveedor de LLM de una sesión (viva o persistida)
+
+        Args:
+            session_id: ID de la sesión
+
+        Returns:
+            Proveedor guardado o None si la sesión no existe
+        """
+        provider = super().get_provider(session_id)
+        if provider is None:
+            row = self._load(session_id)
+            provider = row[0] if row is not None else None
+        return provider
+
+    def _restore(self, session_id: str, chatbot):
+        row = self._load(session_id)
+        if row is not None:
+            chatbot.memory.load_state(json.loads(row[1]))
+
+    def _refresh(self, session_id: str, entry: _Entry):
+        row = self._load(session_id)
+        if row is not None and row[2] > entry.version:
+            entry.chatbot.memory.load_state(json.loads(row[1]))
+            entry.version = row[2]
+
+    def _persist(self, session_id: str, chatbot, llm_provider: Optional[str]) -> float:
+        now = time.time()
+        memory = json.dumps(chatbot.memory.export_state(), ensure_ascii=False)
+        try:
+            conn = self._connect()
+            if llm_provider is None:
+                # Sesión ya eliminada de memoria: conservar el proveedor persistido
+                conn.execute(
+                    "UPDATE chat_sessions SET memory = ?, updated_at = ? WHERE session_id = ?",
+                    (memory, now, session_id)
+                )
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO chat_sessions (session_id, llm_provider, memory, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (session_id, llm_provider, memory, now)
+                )
+            conn.execute(
+                "DELETE FROM chat_sessions WHERE updated_at < ?",
+                (now - self.history_ttl_seconds,)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(
+                "session.save_error", f"Error guardando sesión {session_id}: {str(e)}", exc_info=e, session_id=session_id
+            )
+        return now
+
+    def delete(self, session_id: str) -> bool:
+        """
+        Elimina una sesión viva y su historial persistido
+
+        Args:
+            session_id: ID de la sesión
+
+        Returns:
+            True si la sesión existía
+        """
+        removed = self.pop(session_id)
+        try:
+            conn = self._connect()
+            cursor = conn.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+            conn.commit()
+            removed = removed or cursor.rowcount > 0
+        except sqlite3.Error as e:
+            logger.error(
+                "session.delete_error", f"Error eliminando sesión {session_id}: {str(e)}",
+                exc_info=e, session_id=session_id
+            )
+        return removed
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas del almacén
+
+        Returns:
+            Diccionario de SessionStore más la ruta y las sesiones persistidas
+        """
+        stats = super().get_stats()
+        stats['backend'] = 'sqlite'
+        stats['path'] = str(self.db_path)
+        try:
+            stats['persisted_sessions'] = self._connect().execute(
+                "SELECT COUNT(*) FROM chat_sessions"
+            ).fetchone()[0]
+        except sqlite3.Error:
+            stats['persisted_sessions'] = None
+        return stats
+
+
+def create_session_store() -> SessionStore:
+    """
+    Crea el almacén de sesiones configurado en SESSION_STORE ('memory' o 'sqlite')
+
+    Returns:
+        SessionStore o SQLiteSessionStore
+    """
+    load_dotenv()
+    backend = os.getenv('SESSION_STORE', 'memory').lower()
+    if backend == 'sqlite':
+        return SQLiteSessionStore()
+    if backend != 'memory':
+        raise ValueError(f"SESSION_STORE no soportado: {backend}. Usa 'memory' o 'sqlite'")
+    return SessionStore()
+
+
+if __name__ == "__main__":
+    # Test con chatbots simulados: LRU, TTL y recuperación del historial
+    import sys
+    import tempfile
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from chatbot.memory import ConversationMemory
+
+    class FakeChatbot:
+        def __init__(self):
+            self.memory = ConversationMemory(lambda text: len(text) // 4, max_tokens=300)
+
+        def memory_bytes(self):
+            return self.memory.memory_bytes()
+
+        def close(self):
+            pass
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteSessionStore(db_path=f"{tmp}/sessions.sqlite3", ttl_seconds=60, max_sessions=2)
+
+        for session_id in ["a", "b", "c"]:
+            chatbot = FakeChatbot()
+            store.put(session_id, chatbot, "deepseek")
+            chatbot.memory.add_turn(f"Pregunta de {session_id}", "Respuesta")
+            store.save(session_id, chatbot)
+
+        print(f"Vivas: {store.list_sessions()} (la sesión 'a' salió por LRU)")
+
+        restored = FakeChatbot()
+        store.put("a", restored, store.get_provider("a"))
+        print(f"Historial recuperado de 'a': {restored.memory.get_turns()}")
+
+        # Otro worker con el mismo archivo ve el turno guardado
+        other = SQLiteSessionStore(db_path=f"{tmp}/sessions.sqlite3")
+        other_chatbot = FakeChatbot()
+        other.put("c", other_chatbot, "deepseek")
+        other_chatbot.memory.add_turn("Segunda pregunta de c", "Otra respuesta")
+        other.save("c", other_chatbot)
+        print(f"Turnos de 'c' en este worker: {len(store.get('c').memory.get_turns())}")
+        print(store.get_stats())
@@ -1,16 +1,27 @@
 """
 Módulo para gestionar almacenamiento de embeddings usando ChromaDB
 """
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import time
+import uuid
 import chromadb
 from chromadb.config import Settings
 import numpy as np
-from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
+
+from monitoring.logger import get_logger
+
+logger = get_logger("rag.store")
 
 
 class ChromaVectorStore:
     """Clase para manejar almacenamiento de vectores con ChromaDB"""
 
+    INDEX_STAMP_ID = "index_stamp"
+
     def __init__(self, storage_path: str = "data/chroma"):
         """
         Inicializa el almacenamiento con ChromaDB
@@ -33,10 +44,42 @@ class ChromaVectorStore:
             metadata={"hnsw:space": "cosine"}  # Cosine similarity
         )
 
-        print(f"ChromaDB inicializado en: {self.storage_path}")
-        print(f"Documentos en colección: {self.collection.count()}")
+        # Índice de FAQs: un vector por variante de pregunta que apunta
+        # a un registro de respuesta compartido
+        self._create_faq_collections()
 
-    def add_document(self, filename: str, content: str, embedding: np.ndarray) -> int:
+        # Sello del índice: cambia con cada ingestion o borrado, y lo leen
+        # todos los procesos que comparten la carpeta (API e ingestion)
+        self.index_state = self.client.get_or_create_collection(name="index_state")
+
+        logger.info(
+            "store.init", f"ChromaDB inicializado en: {self.storage_path}",
+            path=str(self.storage_path), documents=self.collection.count()
+        )
+
+    def _create_faq_collections(self):
+        """Obtiene o crea las colecciones de preguntas y respuestas FAQ"""
+        self.faq_questions = self.client.get_or_create_collection(
+            name="faq_questions",
+            metadata={"hnsw:space": "cosine"}
+        )
+        self.faq_answers = self.client.get_or_create_collection(
+            name="faq_answers",
+            metadata={"hnsw:space": "cosine"}
+        )
+
+    @staticmethod
+    def _to_chroma_id(name: str) -> str:
+        """Convierte un nombre a un ID válido (sin espacios ni separadores de ruta)"""
+        return name.replace(" ", "_").replace("/", "_").replace("\\", "_")
+
+    def add_document(
+        self,
+        filename: str,
+        content: str,
+        embedding: np.ndarray,
+        metadata: Optional[dict] = None
+    ) -> int:
         """
         Añade un documento con su embedding a ChromaDB
 
@@ -44,6 +87,7 @@ class ChromaVectorStore:
             filename: Nombre del archivo
             content: Contenido del documento
             embedding: Embedding numpy array (1024 dimensiones)
+            metadata: Metadata adicional (ej: heading_path de un chunk)
 
         Returns:
             ID del documento insertado
@@ -56,14 +100,17 @@ class ChromaVectorStore:
         embedding_list = embedding.astype('float32').tolist()
 
         # Añadir a ChromaDB
+        doc_metadata = dict(metadata or {})
+        doc_metadata["filename"] = filename
+
         self.collection.add(
             embeddings=[embedding_list],
             documents=[content],
-            metadatas=[{"filename": filename}],
+            metadatas=[doc_metadata],
             ids=[doc_id]
         )
 
-        print(f"Documento '{filename}' añadido con ID: {doc_id}")
+        logger.debug("store.document_added", f"Documento '{filename}' añadido", filename=filename, doc_id=doc_id)
         return hash(doc_id)  # Retornar un hash como ID numérico
 
     def get_all_documents(self) -> List[Tuple[int, str, str, np.ndarray]]:
@@ -160,7 +207,8 @@ class ChromaVectorStore:
                 chroma_id = doc[1].replace(" ", "_").replace("/", "_").replace("\\", "_")
                 try:
                     self.collection.delete(ids=[chroma_id])
-                    print(f"Documento {doc_id} eliminado")
+                    self.touch_index_stamp()
+                    logger.info("store.document_deleted", f"Documento {doc_id} eliminado", doc_id=doc_id)
                     return True
                 except:
                     return False
@@ -183,9 +231,45 @@ class ChromaVectorStore:
             metadata={"hnsw:space": "cosine"}
         )
 
-        print(f"Se eliminaron {count} documentos")
+        # Eliminar también el índice de FAQs
+        count += self.faq_answers.count()
+        self.client.delete_collection(name="faq_questions")
+        self.client.delete_collection(name="faq_answers")
+        self._create_faq_collections()
+        self.touch_index_stamp()
+
+        logger.info("store.cleared", f"Se eliminaron {count} documentos", count=count)
         return count
 
+    def get_index_stamp(self) -> Optional[str]:
+        """
+        Obtiene el sello actual del índice
+
+        Returns:
+            Sello (cambia con cada modificación del índice), o None si nunca se modificó
+        """
+        result = self.index_state.get(ids=[self.INDEX_STAMP_ID], include=["metadatas"])
+        if not result['ids']:
+            return None
+        return result['metadatas'][0].get('stamp')
+
+    def touch_index_stamp(self) -> str:
+        """
+        Cambia el sello del índice para que los demás procesos invaliden sus cachés
+
+        Returns:
+            Sello nuevo
+        """
+        stamp = uuid.uuid4().hex
+        # La colección solo guarda metadata; el vector es un marcador de una dimensión
+        self.index_state.upsert(
+            embeddings=[[1.0]],
+            documents=[""],
+            metadatas=[{"stamp": stamp, "updated_at": time.time()}],
+            ids=[self.INDEX_STAMP_ID]
+        )
+        return stamp
+
     def search_similar(self, query_embedding: np.ndarray, top_k: int = 3) -> List[Tuple[int, str, str, float]]:
         """
         Busca los documentos más similares usando ChromaDB
@@ -232,6 +316,157 @@ class ChromaVectorStore:
 
         return similar_docs
 
+    def add_faq_entry(
+        self,
+        answer_id: str,
+        filename: str,
+        title: str,
+        answer: str,
+        answer_embedding: np.ndarray,
+        questions: List[str],
+        question_embeddings: np.ndarray
+    ):
+        """
+        Guarda una FAQ: un registro de respuesta y un vector por variante de pregunta
+
+        Args:
+            answer_id: Identificador de la respuesta (ej: "faq/faq_servicios.md#1")
+            filename: Archivo de origen
+            title: Título de la pregunta
+            answer: Texto de la respuesta
+            answer_embedding: Embedding de la FAQ completa (pregunta + respuesta)
+            questions: Variantes de la pregunta
+            question_embeddings: Embeddings de cada variante (misma longitud que questions)
+        """
+        self.faq_answers.upsert(
+            embeddings=[answer_embedding.astype('float32').tolist()],
+            documents=[answer],
+            metadatas=[{
+                "filename": filename,
+                "answer_id": answer_id,
+                "title": title,
+                "questions": "\n".join(questions)
+            }],
+            ids=[self._to_chroma_id(answer_id)]
+        )
+
+        self.faq_questions.upsert(
+            embeddings=[embedding.astype('float32').tolist() for embedding in question_embeddings],
+            documents=list(questions),
+            metadatas=[
+                {"filename": filename, "answer_id": answer_id}
+                for _ in questions
+            ],
+            ids=[self._to_chroma_id(f"{answer_id}::{i}") for i in range(len(questions))]
+        )
+
+    def delete_faq_file(self, filename: str) -> int:
+        """
+        Elimina todas las FAQs de un archivo
+
+        Args:
+            filename: Archivo de origen de las FAQs
+
+        Returns:
+            Número de respuestas eliminadas
+        """
+        existing = self.faq_answers.get(where={"filename": filename})
+        self.faq_questions.delete(where={"filename": filename})
+        self.faq_answers.delete(where={"filename": filename})
+        return len(existing['ids'])
+
+    def faq_file_exists(self, filename: str) -> bool:
+        """
+        Verifica si las FAQs de un archivo ya fueron indexadas
+
+        Args:
+            filename: Archivo de origen de las FAQs
+
+        Returns:
+            True si existe al menos una FAQ del archivo
+        """
+        try:
+            result = self.faq_answers.get(where={"filename": filename}, limit=1)
+            return len(result['ids']) > 0
+        except:
+            return False
+
+    def count_faq_questions(self) -> int:
+        """
+        Cuenta las variantes de preguntas FAQ indexadas
+
+        Returns:
+            Número de variantes
+        """
+        return self.faq_questions.count()
+
+    def search_faq_questions(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = 10
+    ) -> List[Tuple[str, str, float]]:
+        """
+        Busca las variantes de preguntas FAQ más similares a la consulta
+
+        Args:
+            query_embedding: Embedding de la consulta
+            top_k: Número de variantes a retornar
+
+        Returns:
+            Lista de tuplas (answer_id, question, similarity_score)
+        """
+        total = self.faq_questions.count()
+        if total == 0:
+            return []
+
+        results = self.faq_questions.query(
+            query_embeddings=[query_embedding.astype('float32').tolist()],
+            n_results=min(top_k, total),
+            include=["documents", "metadatas", "distances"]
+        )
+
+        matches = []
+        if results['ids'] and len(results['ids'][0]) > 0:
+            for i in range(len(results['ids'][0])):
+                matches.append((
+                    results['metadatas'][0][i]['answer_id'],
+                    results['documents'][0][i],
+                    float(1.0 - results['distances'][0][i])
+                ))
+
+        return matches
+
+    def get_faq_answers(self, answer_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Obtiene los registros de respuesta de varias FAQs
+
+        Args:
+            answer_ids: Identificadores de las respuestas
+
+        Returns:
+            Diccionario {answer_id: {'filename', 'title', 'questions', 'answer'}}
+        """
+        if not answer_ids:
+            return {}
+
+        results = self.faq_answers.get(
+            ids=[self._to_chroma_id(answer_id) for answer_id in answer_ids],
+            include=["documents", "metadatas"]
+        )
+
+        answers = {}
+        for i in range(len(results['ids'])):
+            metadata = results['metadatas'][i]
+            answers[metadata['answer_id']] = {
+                'answer_id': metadata['answer_id'],
+                'filename': metadata['filename'],
+                'title': metadata.get('title', ''),
+                'questions': metadata.get('questions', '').split("\n"),
+                'answer': results['documents'][i]
+            }
+
+        return answers
+
 
 if __name__ == "__main__":
     # Test del almacenamiento ChromaDB
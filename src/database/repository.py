@@ -7,8 +7,11 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 import numpy as np
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 from database.chroma_vector_store import ChromaVectorStore
+from monitoring.logger import get_logger
+
+logger = get_logger("rag.repository")
 
 
 class DocumentRepository:
@@ -28,7 +31,13 @@ class DocumentRepository:
         self.storage = storage
         self.storage_type = "chroma"
 
-    def insert_document(self, filename: str, content: str, embedding_bytes: bytes) -> int:
+    def insert_document(
+        self,
+        filename: str,
+        content: str,
+        embedding_bytes: bytes,
+        metadata: Optional[dict] = None
+    ) -> int:
         """
         Inserta un documento con su embedding en ChromaDB
 
@@ -36,6 +45,7 @@ class DocumentRepository:
             filename: Nombre del archivo
             content: Contenido del documento
             embedding_bytes: Embedding en formato bytes
+            metadata: Metadata adicional del documento (opcional)
 
         Returns:
             ID del documento insertado
@@ -43,7 +53,7 @@ class DocumentRepository:
         try:
             # Convertir bytes a numpy array
             embedding = np.frombuffer(embedding_bytes, dtype='float32')
-            return self.storage.add_document(filename, content, embedding)
+            return self.storage.add_document(filename, content, embedding, metadata)
         except Exception as e:
             raise Exception(f"Error al insertar documento: {str(e)}")
 
@@ -62,7 +72,7 @@ class DocumentRepository:
             for doc_id, filename, content, embedding in docs:
                 embedding_bytes = embedding.astype('float32').tobytes()
                 result.append((doc_id, filename, content, embedding_bytes))
-            print(f"Se recuperaron {len(result)} documentos")
+            logger.debug("repository.documents_loaded", f"Se recuperaron {len(result)} documentos", count=len(result))
             return result
         except Exception as e:
             raise Exception(f"Error al obtener documentos: {str(e)}")
@@ -126,6 +136,30 @@ class DocumentRepository:
         except Exception as e:
             raise Exception(f"Error al contar documentos: {str(e)}")
 
+    def get_index_stamp(self) -> Optional[str]:
+        """
+        Obtiene el sello del índice (compartido entre procesos)
+
+        Returns:
+            Sello actual, o None si el índice nunca se modificó
+        """
+        try:
+            return self.storage.get_index_stamp()
+        except Exception as e:
+            raise Exception(f"Error al leer el sello del índice: {str(e)}")
+
+    def touch_index_stamp(self) -> str:
+        """
+        Marca el índice como modificado
+
+        Returns:
+            Sello nuevo
+        """
+        try:
+            return self.storage.touch_index_stamp()
+        except Exception as e:
+            raise Exception(f"Error al actualizar el sello del índice: {str(e)}")
+
     def document_exists(self, filename: str) -> bool:
         """
         Verifica si un documento ya existe en ChromaDB
@@ -140,3 +174,108 @@ class DocumentRepository:
             return self.storage.document_exists(filename)
         except Exception as e:
             raise Exception(f"Error al verificar documento: {str(e)}")
+
+    def insert_faq_entry(
+        self,
+        entry: Dict,
+        answer_embedding_bytes: bytes,
+        question_embeddings: np.ndarray
+    ):
+        """
+        Inserta una FAQ con un vector por cada variante de pregunta
+
+        Args:
+            entry: Registro de FAQ (answer_id, filename, title, questions, answer)
+            answer_embedding_bytes: Embedding de la FAQ completa en formato bytes
+            question_embeddings: Embeddings de las variantes (una fila por pregunta)
+        """
+        try:
+            answer_embedding = np.frombuffer(answer_embedding_bytes, dtype='float32')
+            self.storage.add_faq_entry(
+                answer_id=entry['answer_id'],
+                filename=entry['filename'],
+                title=entry['title'],
+                answer=entry['answer'],
+                answer_embedding=answer_embedding,
+                questions=entry['questions'],
+                question_embeddings=question_embeddings
+            )
+        except Exception as e:
+            raise Exception(f"Error al insertar FAQ: {str(e)}")
+
+    def delete_faq_file(self, filename: str) -> int:
+        """
+        Elimina todas las FAQs de un archivo
+
+        Args:
+            filename: Archivo de origen de las FAQs
+
+        Returns:
+            Número de FAQs eliminadas
+        """
+        try:
+            return self.storage.delete_faq_file(filename)
+        except Exception as e:
+            raise Exception(f"Error al eliminar FAQs: {str(e)}")
+
+    def faq_file_exists(self, filename: str) -> bool:
+        """
+        Verifica si las FAQs de un archivo ya están indexadas
+
+        Args:
+            filename: Archivo de origen de las FAQs
+
+        Returns:
+            True si existe, False si no
+        """
+        try:
+            return self.storage.faq_file_exists(filename)
+        except Exception as e:
+            raise Exception(f"Error al verificar FAQs: {str(e)}")
+
+    def count_faq_questions(self) -> int:
+        """
+        Cuenta las variantes de preguntas FAQ indexadas
+
+        Returns:
+            Número de variantes
+        """
+        try:
+            return self.storage.count_faq_questions()
+        except Exception as e:
+            raise Exception(f"Error al contar FAQs: {str(e)}")
+
+    def search_faq_questions(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = 10
+    ) -> List[Tuple[str, str, float]]:
+        """
+        Busca las variantes de preguntas FAQ más similares
+
+        Args:
+            query_embedding: Embedding de la consulta
+            top_k: Número de variantes a retornar
+
+        Returns:
+            Lista de tuplas (answer_id, question, similarity_score)
+        """
+        try:
+            return self.storage.search_faq_questions(query_embedding, top_k)
+        except Exception as e:
+            raise Exception(f"Error al buscar FAQs: {str(e)}")
+
+    def get_faq_answers(self, answer_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Obtiene los registros de respuesta de varias FAQs
+
+        Args:
+            answer_ids: Identificadores de las respuestas
+
+        Returns:
+            Diccionario {answer_id: registro de FAQ}
+        """
+        try:
+            return self.storage.get_faq_answers(answer_ids)
+        except Exception as e:
+            raise Exception(f"Error al obtener respuestas FAQ: {str(e)}")
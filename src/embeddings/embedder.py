@@ -1,9 +1,15 @@
 """
 Módulo para generar embeddings usando BGE-M3
 """
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
 from sentence_transformers import SentenceTransformer
 import numpy as np
 
+from monitoring.metrics import SIZE_BUCKETS, get_metrics
+
 
 class Embedder:
     """Clase para generar embeddings con el modelo BGE-M3"""
@@ -12,6 +18,8 @@ class Embedder:
         """Inicializa el modelo BGE-M3"""
         print("Cargando modelo BGE-M3...")
         self.model = SentenceTransformer('BAAI/bge-m3')
+        self.metrics = get_metrics()
+        self.metrics.describe("rag_embedding_batch_size", "Textos por llamada al modelo de embeddings")
         print("Modelo cargado exitosamente")
 
     def generate_embedding(self, text: str) -> np.ndarray:
@@ -27,6 +35,7 @@ class Embedder:
         if not text or not text.strip():
             raise ValueError("El texto no puede estar vacío")
 
+        self.metrics.observe("rag_embedding_batch_size", 1, buckets=SIZE_BUCKETS)
         embedding = self.model.encode(text, normalize_embeddings=True)
         return embedding.astype('float32')
 
@@ -43,9 +52,22 @@ class Embedder:
         if not texts:
             raise ValueError("La lista de textos no puede estar vacía")
 
+        self.metrics.observe("rag_embedding_batch_size", len(texts), buckets=SIZE_BUCKETS)
         embeddings = self.model.encode(texts, normalize_embeddings=True)
         return embeddings.astype('float32')
 
+    def count_tokens(self, text: str) -> int:
+        """
+        Cuenta los tokens de un texto con el tokenizer de BGE-M3
+
+        Args:
+            text: Texto de entrada
+
+        Returns:
+            Número de tokens (sin tokens especiales)
+        """
+        return len(self.model.tokenizer(text, add_special_tokens=False)['input_ids'])
+
     def embedding_to_bytes(self, embedding: np.ndarray) -> bytes:
         """
         Convierte un embedding a bytes para almacenar en SQL Server
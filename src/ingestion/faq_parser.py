@@ -0,0 +1,126 @@
+"""
+Módulo para extraer preguntas frecuentes (FAQs) de archivos markdown
+"""
+import re
+from typing import Dict, List
+
+
+class FAQParser:
+    """
+    Convierte un archivo de FAQs en registros individuales.
+
+    Formato esperado (ver README):
+
+        ## Pregunta 1: Título descriptivo
+
+        **Pregunta:** ¿Pregunta principal? / ¿Variante 1? / ¿Variante 2?
+
+        **Respuesta:** Respuesta clara y concisa.
+
+        ---
+    """
+
+    ENTRY_HEADING_RE = re.compile(r'^##\s+(.*)$', re.MULTILINE)
+    TITLE_PREFIX_RE = re.compile(r'^Pregunta\s*\d*\s*:\s*', re.IGNORECASE)
+    QUESTION_RE = re.compile(r'\*\*Pregunta:\*\*\s*(.+)', re.IGNORECASE)
+    ANSWER_RE = re.compile(r'\*\*Respuesta:\*\*\s*(.*)', re.IGNORECASE | re.DOTALL)
+    # Las variantes se separan con '/', pero no se debe cortar dentro de URLs
+    VARIANT_SEPARATOR_RE = re.compile(r'\s+/\s+|(?<=[?!.])/')
+    TRAILING_RULE_RE = re.compile(r'\n\s*(-{3,}|\*{3,}|_{3,})\s*$')
+
+    def split_variants(self, questions_line: str) -> List[str]:
+        """
+        Divide la línea de preguntas en sus variantes
+
+        Args:
+            questions_line: Texto después de "**Pregunta:**"
+
+        Returns:
+            Lista de variantes sin duplicados, en el orden original
+        """
+        variants = []
+        for variant in self.VARIANT_SEPARATOR_RE.split(questions_line):
+            variant = variant.strip()
+            if variant and variant not in variants:
+                variants.append(variant)
+        return variants
+
+    def parse(self, filename: str, text: str) -> List[Dict]:
+        """
+        Extrae las FAQs de un archivo markdown
+
+        Args:
+            filename: Nombre del archivo (ruta relativa, ej: "faq/faq_servicios.md")
+            text: Contenido del archivo
+
+        Returns:
+            Lista de diccionarios con:
+            - answer_id: Identificador estable de la respuesta ("<filename>#<n>")
+            - filename: Archivo de origen
+            - title: Título de la pregunta
+            - questions: Variantes de la pregunta
+            - answer: Texto de la respuesta
+        """
+        entries = []
+        headings = list(self.ENTRY_HEADING_RE.finditer(text))
+
+        for i, heading in enumerate(headings):
+            start = heading.end()
+            end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+            body = text[start:end]
+
+            title = self.TITLE_PREFIX_RE.sub('', heading.group(1).strip())
+
+            answer_match = self.ANSWER_RE.search(body)
+            if not answer_match:
+                continue
+
+            answer = self.TRAILING_RULE_RE.sub('', answer_match.group(1).strip()).strip()
+            if not answer:
+                continue
+
+            question_match = self.QUESTION_RE.search(body[:answer_match.start()])
+            questions = self.split_variants(question_match.group(1)) if question_match else []
+            if not questions and title:
+                questions = [title]
+            if not questions:
+                continue
+
+            entries.append({
+                'answer_id': f"{filename}#{i + 1}",
+                'filename': filename,
+                'title': title or questions[0],
+                'questions': questions,
+                'answer': answer
+            })
+
+        return entries
+
+    @staticmethod
+    def format_entry(entry: Dict) -> str:
+        """
+        Formatea una FAQ como texto para el contexto del LLM
+
+        Args:
+            entry: Registro de FAQ (requiere 'questions' y 'answer')
+
+        Returns:
+            Texto con la pregunta y la respuesta
+        """
+        questions = " / ".join(entry['questions'])
+        return f"**Pregunta:** {questions}\n\n**Respuesta:** {entry['answer']}"
+
+
+if __name__ == "__main__":
+    # Test del parser
+    from pathlib import Path
+
+    faq_path = Path("data/docs/faq/faq_servicios.md")
+    parser = FAQParser()
+    entries = parser.parse("faq/faq_servicios.md", faq_path.read_text(encoding='utf-8'))
+
+    for entry in entries:
+        print(f"{entry['answer_id']}: {entry['title']}")
+        for question in entry['questions']:
+            print(f"  - {question}")
+        print(f"  Respuesta: {entry['answer'][:80]}...")
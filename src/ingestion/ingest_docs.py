@@ -1,23 +1,39 @@
 """
 Módulo para cargar y procesar documentos markdown
 """
+import sys
 import os
 import re
 from pathlib import Path
-from typing import List, Tuple
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from typing import Callable, Dict, List, Optional, Tuple
+from ingestion.markdown_chunker import MarkdownChunker
+from ingestion.faq_parser import FAQParser
 
 
 class DocumentIngestion:
     """Clase para cargar y procesar documentos markdown"""
 
-    def __init__(self, docs_folder: str = "data/docs"):
+    FAQ_FOLDER = "faq"
+
+    def __init__(
+        self,
+        docs_folder: str = "data/docs",
+        chunk_max_tokens: int = 256,
+        token_counter: Optional[Callable[[str], int]] = None
+    ):
         """
         Inicializa el módulo de ingestion
 
         Args:
             docs_folder: Ruta a la carpeta con archivos .md
+            chunk_max_tokens: Tamaño máximo de cada chunk en tokens del modelo
+            token_counter: Función para contar tokens (ej: Embedder.count_tokens)
         """
         self.docs_folder = docs_folder
+        self.chunker = MarkdownChunker(max_tokens=chunk_max_tokens, token_counter=token_counter)
+        self.faq_parser = FAQParser()
         self._validate_folder()
 
     def _validate_folder(self):
@@ -28,18 +44,34 @@ class DocumentIngestion:
                 f"Por favor créala y coloca archivos .md en ella."
             )
 
-    def load_markdown_files(self) -> List[Tuple[str, str]]:
+    def is_faq_file(self, filename: str) -> bool:
+        """
+        Indica si un archivo pertenece a la carpeta de FAQs
+
+        Args:
+            filename: Ruta relativa desde docs_folder
+
+        Returns:
+            True si es un archivo de FAQs
+        """
+        return Path(filename).parts[:1] == (self.FAQ_FOLDER,)
+
+    def load_markdown_files(self, subfolder: Optional[str] = None) -> List[Tuple[str, str]]:
         """
         Carga todos los archivos markdown de la carpeta
 
+        Args:
+            subfolder: Si se indica, solo carga archivos de esa subcarpeta
+
         Returns:
             Lista de tuplas (filename, content)
         """
         markdown_files = []
         docs_path = Path(self.docs_folder)
+        search_path = docs_path / subfolder if subfolder else docs_path
 
         # Buscar archivos .md y .MD recursivamente (incluye subdirectorios)
-        md_files = list(docs_path.glob("**/*.md")) + list(docs_path.glob("**/*.MD"))
+        md_files = list(search_path.glob("**/*.md")) + list(search_path.glob("**/*.MD"))
 
         if not md_files:
             print(f"Advertencia: No se encontraron archivos .md o .MD en {self.docs_folder}")
@@ -51,7 +83,7 @@ class DocumentIngestion:
                     content = f.read()
 
                 # Usar ruta relativa desde docs_folder para preservar estructura
-                filename = str(file_path.relative_to(docs_path))
+                filename = file_path.relative_to(docs_path).as_posix()
                 markdown_files.append((filename, content))
                 print(f"Cargado: {filename}")
 
@@ -66,30 +98,51 @@ class DocumentIngestion:
         """
         Limpia y preprocesa el texto
 
+        Conserva la estructura que usa el chunker: la sangría al inicio de
+        cada línea (listas anidadas) y los bloques de código (```), que se
+        dejan intactos.
+
         Args:
             text: Texto a limpiar
 
         Returns:
             Texto limpio
         """
-        # Eliminar múltiples saltos de línea
-        text = re.sub(r'\n\s*\n', '\n\n', text)
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+        lines = []
+        in_code = False
+        for line in text.split('\n'):
+            stripped = line.strip()
 
-        # Eliminar espacios al inicio/final de cada línea
-        lines = [line.strip() for line in text.split('\n')]
-        text = '\n'.join(lines)
+            if stripped.startswith(('```', '~~~')):
+                in_code = not in_code
+                lines.append(line.rstrip())
+                continue
+            if in_code:
+                lines.append(line)
+                continue
 
-        # Eliminar espacios múltiples
-        text = re.sub(r' +', ' ', text)
+            # Eliminar múltiples saltos de línea
+            if not stripped:
+                if lines and lines[-1]:
+                    lines.append('')
+                continue
 
-        # Eliminar espacios antes de puntuación
-        text = re.sub(r'\s+([.,;:!?])', r'\1', text)
+            # Eliminar espacios múltiples y espacios antes de puntuación,
+            # sin tocar la sangría
+            indent = line[:len(line) - len(line.lstrip())].replace('\t', '    ')
+            stripped = re.sub(r'[ \t]+', ' ', stripped)
+            stripped = re.sub(r' ([.,;:!?])', r'\1', stripped)
+            lines.append(indent + stripped)
 
-        return text.strip()
+        return '\n'.join(lines).strip('\n')
 
     def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
         """
-        Divide el texto en chunks para embeddings más efectivos
+        Divide el texto en chunks por número de caracteres (método legacy)
+
+        La ingestion usa chunk_markdown, que respeta la estructura del documento.
 
         Args:
             text: Texto a dividir
@@ -125,35 +178,85 @@ class DocumentIngestion:
 
         return chunks
 
-    def process_documents(self, chunk_documents: bool = False) -> List[Tuple[str, str]]:
+    def chunk_markdown(self, text: str) -> List[Dict]:
+        """
+        Divide el texto en chunks según su estructura markdown
+        (encabezados, listas y tablas) con tamaño medido en tokens
+
+        Args:
+            text: Texto markdown a dividir
+
+        Returns:
+            Lista de diccionarios con 'content', 'heading_path' y 'token_count'
+        """
+        return self.chunker.chunk(text)
+
+    def process_documents(
+        self,
+        chunk_documents: bool = False,
+        include_faq: bool = True
+    ) -> List[Tuple[str, str, Dict]]:
         """
         Procesa todos los documentos: carga, limpia y opcionalmente divide en chunks
 
         Args:
             chunk_documents: Si es True, divide los documentos en chunks
+            include_faq: Si es False, omite los archivos de la carpeta de FAQs
+                (se indexan por separado con process_faq_documents)
 
         Returns:
-            Lista de tuplas (filename, processed_content)
+            Lista de tuplas (filename, processed_content, metadata)
         """
         documents = self.load_markdown_files()
         processed_docs = []
 
         for filename, content in documents:
+            if not include_faq and self.is_faq_file(filename):
+                continue
+
             # Limpiar el texto
             cleaned_content = self.clean_text(content)
 
             if chunk_documents:
-                # Dividir en chunks
-                chunks = self.chunk_text(cleaned_content)
+                # Dividir en chunks respetando la estructura markdown
+                chunks = self.chunk_markdown(cleaned_content)
                 for i, chunk in enumerate(chunks):
                     chunk_filename = f"{filename}_chunk_{i+1}"
-                    processed_docs.append((chunk_filename, chunk))
+                    metadata = {
+                        "source": filename,
+                        "chunk_index": i + 1,
+                        "heading_path": chunk['heading_path'],
+                        "token_count": chunk['token_count']
+                    }
+                    processed_docs.append((chunk_filename, chunk['content'], metadata))
             else:
-                processed_docs.append((filename, cleaned_content))
+                processed_docs.append((filename, cleaned_content, {"source": filename}))
 
         print(f"Documentos procesados: {len(processed_docs)}")
         return processed_docs
 
+    def process_faq_documents(self) -> Dict[str, List[Dict]]:
+        """
+        Carga los archivos de FAQs y los divide en un registro por pregunta
+
+        Returns:
+            Diccionario {filename: lista de FAQs} (ver FAQParser.parse)
+        """
+        faq_path = Path(self.docs_folder) / self.FAQ_FOLDER
+        if not faq_path.exists():
+            return {}
+
+        faq_files = {}
+        for filename, content in self.load_markdown_files(subfolder=self.FAQ_FOLDER):
+            entries = self.faq_parser.parse(filename, content)
+            if not entries:
+                print(f"Advertencia: No se encontraron FAQs con el formato esperado en {filename}")
+            faq_files[filename] = entries
+
+        total = sum(len(entries) for entries in faq_files.values())
+        print(f"FAQs procesadas: {total}")
+        return faq_files
+
 
 if __name__ == "__main__":
     # Test del módulo
@@ -161,7 +264,7 @@ if __name__ == "__main__":
         ingestion = DocumentIngestion()
         documents = ingestion.process_documents()
 
-        for filename, content in documents[:2]:  # Mostrar primeros 2
+        for filename, content, metadata in documents[:2]:  # Mostrar primeros 2
             print(f"\n--- {filename} ---")
             print(f"Longitud: {len(content)} caracteres")
             print(f"Primeros 200 caracteres: {content[:200]}...")
@@ -0,0 +1,354 @@
+"""
+Módulo para dividir documentos markdown respetando su estructura
+(encabezados, listas, tablas) con un presupuesto de tokens por chunk
+"""
+import re
+from typing import Callable, Dict, List, Optional
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Aproxima el número de tokens de un texto cuando no hay tokenizer disponible
+
+    Cuenta palabras y signos de puntuación por separado, lo que se acerca
+    bastante al conteo de tokenizers subword para texto en español.
+
+    Args:
+        text: Texto a medir
+
+    Returns:
+        Número aproximado de tokens
+    """
+    return len(re.findall(r'\w+|[^\w\s]', text))
+
+
+class MarkdownChunker:
+    """
+    Divide markdown en secciones coherentes y las agrupa en chunks
+    de tamaño máximo medido en tokens del modelo.
+
+    Cada chunk conserva la ruta de encabezados donde se encuentra
+    (ej: "Becas UNAH > Requisitos") para usarla como metadata.
+    """
+
+    HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*$')
+    LIST_ITEM_RE = re.compile(r'^([-*+]|\d+[.)])\s+')
+    TABLE_ROW_RE = re.compile(r'^\|.*\|?$')
+    TABLE_SEPARATOR_RE = re.compile(r'^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$')
+    RULE_RE = re.compile(r'^(-{3,}|\*{3,}|_{3,})$')
+    FENCE_RE = re.compile(r'^(```|~~~)')
+    SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+
+    HEADING_SEPARATOR = " > "
+
+    def __init__(
+        self,
+        max_tokens: int = 256,
+        min_tokens: int = 32,
+        token_counter: Optional[Callable[[str], int]] = None
+    ):
+        """
+        Inicializa el chunker
+
+        Args:
+            max_tokens: Tamaño máximo de cada chunk en tokens
+            min_tokens: Chunks más pequeños se fusionan con la sección siguiente
+            token_counter: Función que cuenta tokens (por defecto, aproximación)
+        """
+        if max_tokens <= 0:
+            raise ValueError("max_tokens debe ser mayor que 0")
+
+        self.max_tokens = max_tokens
+        self.min_tokens = min(min_tokens, max_tokens)
+        self.count_tokens = token_counter or approximate_token_count
+
+    def parse_blocks(self, text: str) -> List[Dict]:
+        """
+        Divide el markdown en bloques estructurales
+
+        Args:
+            text: Documento markdown
+
+        Returns:
+            Lista de diccionarios con:
+            - type: 'heading', 'paragraph', 'list', 'table', 'code' o 'rule'
+            - text: Contenido del bloque
+            - heading_path: Lista de encabezados que contienen al bloque
+        """
+        blocks = []
+        headings = []  # [(nivel, titulo)]
+        current_lines = []
+        current_type = None
+
+        def flush():
+            nonlocal current_lines, current_type
+            if current_lines:
+                blocks.append({
+                    'type': current_type,
+                    'text': '\n'.join(current_lines).strip(),
+                    'heading_path': [title for _, title in headings]
+                })
+            current_lines = []
+            current_type = None
+
+        lines = text.split('\n')
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            stripped = line.strip()
+
+            # Bloques de código: se conservan completos
+            if self.FENCE_RE.match(stripped):
+                flush()
+                fence = stripped[:3]
+                code_lines = [line]
+                i += 1
+                while i < len(lines):
+                    code_lines.append(lines[i])
+                    if lines[i].strip().startswith(fence):
+                        break
+                    i += 1
+                current_type = 'code'
+                current_lines = code_lines
+                flush()
+                i += 1
+                continue
+
+            heading = self.HEADING_RE.match(stripped)
+            if heading:
+                flush()
+                level = len(heading.group(1))
+                title = heading.group(2).strip()
+                headings = [(lvl, t) for lvl, t in headings if lvl < level]
+                headings.append((level, title))
+                blocks.append({
+                    'type': 'heading',
+                    'text': stripped,
+                    'heading_path': [t for _, t in headings]
+                })
+            elif not stripped:
+                # Una línea vacía termina el bloque, excepto dentro de una lista
+                # (los items pueden estar separados por líneas vacías)
+                if current_type != 'list':
+                    flush()
+                elif i + 1 < len(lines) and not self.LIST_ITEM_RE.match(lines[i + 1].strip()):
+                    flush()
+            elif self.RULE_RE.match(stripped):
+                flush()
+                blocks.append({
+                    'type': 'rule',
+                    'text': stripped,
+                    'heading_path': [t for _, t in headings]
+                })
+            elif self.TABLE_ROW_RE.match(stripped):
+                if current_type != 'table':
+                    flush()
+                    current_type = 'table'
+                current_lines.append(stripped)
+            elif self.LIST_ITEM_RE.match(stripped):
+                if current_type != 'list':
+                    flush()
+                    current_type = 'list'
+                current_lines.append(line)
+            else:
+                if current_type == 'table':
+                    flush()
+                if current_type is None:
+                    current_type = 'paragraph'
+                # Las líneas de continuación de un item quedan dentro de la lista
+                current_lines.append(line)
+
+            i += 1
+
+        flush()
+        return blocks
+
+    def _split_block(self, block: Dict) -> List[str]:
+        """
+        Divide un bloque que excede max_tokens en partes más pequeñas
+
+        Las tablas repiten su encabezado en cada parte, las listas se dividen
+        por items y los párrafos por oraciones.
+
+        Args:
+            block: Bloque estructural
+
+        Returns:
+            Lista de fragmentos de texto
+        """
+        text = block['text']
+        block_type = block['type']
+
+        if block_type == 'table':
+            rows = text.split('\n')
+            header = []
+            if len(rows) > 1 and self.TABLE_SEPARATOR_RE.match(rows[1]):
+                header, rows = rows[:2], rows[2:]
+            units = rows
+            prefix = '\n'.join(header)
+            joiner = '\n'
+        elif block_type == 'list':
+            units = []
+            for line in text.split('\n'):
+                if self.LIST_ITEM_RE.match(line.strip()) or not units:
+                    units.append(line)
+                else:
+                    units[-1] += '\n' + line
+            prefix = ''
+            joiner = '\n'
+        elif block_type == 'code':
+            units = text.split('\n')
+            prefix = ''
+            joiner = '\n'
+        else:
+            units = [s for s in self.SENTENCE_RE.split(text) if s.strip()]
+            prefix = ''
+            joiner = ' '
+
+        parts = []
+        current = []
+        prefix_tokens = self.count_tokens(prefix) if prefix else 0
+
+        for unit in units:
+            candidate = joiner.join(current + [unit])
+            if current and prefix_tokens + self.count_tokens(candidate) > self.max_tokens:
+                parts.append(joiner.join(current))
+                current = [unit]
+            else:
+                current.append(unit)
+
+        if current:
+            parts.append(joiner.join(current))
+
+        result = []
+        for part in parts:
+            full = f"{prefix}\n{part}" if prefix else part
+            if self.count_tokens(full) > self.max_tokens:
+                result.extend(self._split_words(full))
+            else:
+                result.append(full)
+
+        return result
+
+    def _split_words(self, text: str) -> List[str]:
+        """
+        Último recurso: divide un texto por palabras respetando max_tokens
+
+        Args:
+            text: Texto a dividir
+
+        Returns:
+            Lista de fragmentos
+        """
+        parts = []
+        current = []
+
+        for word in text.split(' '):
+            candidate = ' '.join(current + [word])
+            if current and self.count_tokens(candidate) > self.max_tokens:
+                parts.append(' '.join(current))
+                current = [word]
+            else:
+                current.append(word)
+
+        if current:
+            parts.append(' '.join(current))
+
+        return parts
+
+    def chunk(self, text: str) -> List[Dict]:
+        """
+        Divide un documento markdown en chunks respetando su estructura
+
+        Args:
+            text: Documento markdown
+
+        Returns:
+            Lista de diccionarios con:
+            - content: Texto del chunk
+            - heading_path: Ruta de encabezados (ej: "Becas > Requisitos")
+            - token_count: Número de tokens del chunk
+        """
+        chunks = []
+        current = []
+        current_tokens = 0
+        current_path = None
+        last_path = []
+
+        def flush():
+            nonlocal current, current_tokens, current_path
+            content = '\n\n'.join(current).strip()
+            if content:
+                path = current_path if current_path is not None else last_path
+                chunks.append({
+                    'content': content,
+                    'heading_path': self.HEADING_SEPARATOR.join(path),
+                    'token_count': self.count_tokens(content)
+                })
+            current = []
+            current_tokens = 0
+            current_path = None
+
+        for block in self.parse_blocks(text):
+            last_path = block['heading_path']
+
+            if block['type'] == 'rule':
+                # Un separador horizontal cierra la sección (ej: entre FAQs)
+                flush()
+                continue
+
+            if block['type'] == 'heading':
+                # Nueva sección: cerrar el chunk actual salvo que sea muy pequeño
+                # (ej: solo contiene el título del documento)
+                if current_tokens >= self.min_tokens:
+                    flush()
+                current.append(block['text'])
+                current_tokens += self.count_tokens(block['text'])
+                continue
+
+            block_tokens = self.count_tokens(block['text'])
+
+            if block_tokens > self.max_tokens:
+                pieces = self._split_block(block)
+            else:
+                pieces = [block['text']]
+
+            for piece in pieces:
+                piece_tokens = self.count_tokens(piece)
+                if current and current_tokens + piece_tokens > self.max_tokens:
+                    flush()
+                if current_path is None:
+                    current_path = block['heading_path']
+                current.append(piece)
+                current_tokens += piece_tokens
+
+        flush()
+        return chunks
+
+
+if __name__ == "__main__":
+    # Test del módulo
+    sample = """# Becas UNAH
+
+Información general sobre becas.
+
+## Requisitos
+
+- Ser estudiante activo
+- Índice mayor a 70%
+
+| Tipo | Monto |
+|------|-------|
+| Excelencia | L. 3,000 |
+| Socioeconómica | L. 2,000 |
+
+---
+
+## Proceso
+
+PASO 1: Ingresa al portal. PASO 2: Completa el formulario.
+"""
+    chunker = MarkdownChunker(max_tokens=40, min_tokens=8)
+    for i, chunk in enumerate(chunker.chunk(sample), 1):
+        print(f"--- Chunk {i} [{chunk['heading_path']}] ({chunk['token_count']} tokens) ---")
+        print(chunk['content'])
@@ -1,29 +1,47 @@
 """
 Módulo para interactuar con la API de DeepSeek
 """
+import sys
 import os
+import json
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import httpx
 import requests
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
+from typing import AsyncIterator, Callable, Iterator, List, Dict, Optional
+from llm.http_pool import post_chat_completion, stream_chat_completion, extract_message_content, report_usage
+from llm.prompts import build_chat_request
 
 
 class DeepSeekClient:
     """Cliente para la API de DeepSeek"""
 
-    def __init__(self):
-        """Inicializa el cliente de DeepSeek"""
+    def __init__(self, response_cache=None):
+        """
+        Inicializa el cliente de DeepSeek
+
+        Args:
+            response_cache: LLMResponseCache para reutilizar respuestas (opcional)
+        """
         load_dotenv()
 
         self.api_key = os.getenv('DEEPSEEK_API_KEY')
         if not self.api_key:
             raise ValueError("DEEPSEEK_API_KEY no está configurada en .env")
 
-        self.api_url = "https://api.deepseek.com/v1/chat/completions"
+        self.api_url = os.getenv('DEEPSEEK_API_URL', "https://api.deepseek.com/v1/chat/completions")
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
         self.model = "deepseek-chat"
+        self.response_cache = response_cache
+
+        # Sesión con keep-alive: reutiliza la conexión TCP+TLS entre llamadas
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
 
     def generate_response(
         self,
@@ -31,7 +49,11 @@ class DeepSeekClient:
         context_documents: List[str],
         temperature: float = 0.7,
         max_tokens: int = 2000,
-        context_type: str = "docs_only"
+        context_type: str = "docs_only",
+        model: Optional[str] = None,
+        on_usage: Optional[Callable[[Dict], None]] = None,
+        conversation: Optional[str] = None,
+        timeout: Optional[float] = None
     ) -> str:
         """
         Genera una respuesta usando el contexto RAG
@@ -42,97 +64,134 @@ class DeepSeekClient:
             temperature: Temperatura para la generación (0-1)
             max_tokens: Máximo de tokens en la respuesta
             context_type: Tipo de contexto - 'faq_only', 'faq_and_docs', 'docs_only'
+            model: Modelo a usar en esta llamada (default: self.model)
+            on_usage: Callback con el uso de tokens {prompt_tokens, completion_tokens}
+            conversation: Memoria de la conversación (resumen y últimos turnos) para el prompt
+            timeout: Segundos máximos de espera de la API (None = el del cliente)
 
         Returns:
             Respuesta generada por DeepSeek
         """
-        # Construir el prompt RAG
-        context = "\n\n---\n\n".join(context_documents)
-
-        # Seleccionar prompt según tipo de contexto
-        if context_type == "faq_only":
-            system_prompt = """Eres un asistente de FAQ universitario.
-
-REGLAS ESTRICTAS:
-1. Responde ÚNICAMENTE usando las preguntas frecuentes (FAQs) proporcionadas
-2. Si la pregunta coincide con una FAQ, usa EXACTAMENTE la respuesta de esa FAQ
-3. NO combines información de múltiples FAQs a menos que sea necesario
-4. NO inventes información ni uses conocimiento externo
-5. Sé conciso y directo
-6. Si no hay una FAQ que responda la pregunta exactamente, di: "No encontré esa pregunta en mi FAQ"
-"""
-
-            user_prompt = f"""FAQs disponibles:
-
-{context}
-
-Pregunta del estudiante:
-{query}
-
-Instrucción: Responde SOLO si la pregunta coincide con una de las FAQs anteriores."""
-
-        elif context_type == "faq_and_docs":
-            system_prompt = """Eres un asistente universitario que ayuda a estudiantes.
-
-REGLAS:
-1. Tienes FAQs (preguntas frecuentes) y documentos adicionales
-2. PRIORIZA las FAQs si responden la pregunta
-3. Usa los documentos solo si las FAQs no son suficientes
-4. NO inventes información
-5. Sé conciso y preciso"""
+        model = model or self.model
+        payload, cache_key = build_chat_request(
+            "deepseek", model, query, context_documents, context_type, conversation,
+            temperature, max_tokens, self.response_cache
+        )
+
+        # Respuestas con temperatura baja: reutilizar si el prompt ya fue respondido
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
 
-            user_prompt = f"""Contexto disponible (FAQs primero, luego documentos):
-
-{context}
+        try:
+            response = self.session.post(
+                self.api_url,
+                headers=self.headers,
+                json=payload,
+                timeout=min(30, timeout) if timeout is not None else 30
+            )
 
-Pregunta del estudiante:
-{query}
+            response.raise_for_status()
+            result = response.json()
+            report_usage(result, on_usage)
 
-Instrucción: Prioriza la información de las FAQs si está disponible."""
+            if 'choices' in result and len(result['choices']) > 0:
+                answer = result['choices'][0]['message']['content'].strip()
+            else:
+                raise Exception("Respuesta de la API no tiene el formato esperado")
 
-        else:  # docs_only (flujo original)
-            system_prompt = """Eres un asistente útil que responde preguntas basándose ÚNICAMENTE en el contexto proporcionado.
-Si la información no está en el contexto, di claramente que no tienes esa información.
-No inventes información ni uses conocimiento externo al contexto."""
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Error al llamar a la API de DeepSeek: {str(e)}")
 
-            user_prompt = f"""Usa SOLO esta información de contexto para responder:
+        if cache_key is not None:
+            self.response_cache.set(cache_key, "deepseek", model, answer)
 
-{context}
+        return answer
 
-Pregunta del usuario:
-{query}"""
+    def generate_response_stream(
+        self,
+        query: str,
+        context_documents: List[str],
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        context_type: str = "docs_only",
+        model: Optional[str] = None,
+        on_usage: Optional[Callable[[Dict], None]] = None,
+        conversation: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        Genera una respuesta usando el contexto RAG, emitiendo los tokens
+        a medida que llegan (modo stream=True de la API)
 
-        # Preparar el payload
-        payload = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": temperature,
-            "max_tokens": max_tokens
-        }
+        Args:
+            query: Pregunta del usuario
+            context_documents: Lista de documentos relevantes como contexto
+            temperature: Temperatura para la generación (0-1)
+            max_tokens: Máximo de tokens en la respuesta
+            context_type: Tipo de contexto - 'faq_only', 'faq_and_docs', 'docs_only'
+            model: Modelo a usar en esta llamada (default: self.model)
+            on_usage: Callback con el uso de tokens {prompt_tokens, completion_tokens}
+            conversation: Memoria de la conversación (resumen y últimos turnos) para el prompt
 
+        Yields:
+            Fragmentos de texto de la respuesta
+        """
+        model = model or self.model
+        payload, cache_key = build_chat_request(
+            "deepseek", model, query, context_documents, context_type, conversation,
+            temperature, max_tokens, self.response_cache
+        )
+
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        payload["stream"] = True
+        if on_usage is not None:
+            # El uso de tokens llega en un último chunk sin 'choices'
+            payload["stream_options"] = {"include_usage": True}
+
+        parts = []
         try:
-            response = requests.post(
+            with self.session.post(
                 self.api_url,
                 headers=self.headers,
                 json=payload,
-                timeout=30
-            )
+                timeout=30,
+                stream=True
+            ) as response:
+                response.raise_for_status()
 
-            response.raise_for_status()
-            result = response.json()
+                # Formato Server-Sent Events: líneas "data: {...}" hasta "data: [DONE]"
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
 
-            if 'choices' in result and len(result['choices']) > 0:
-                answer = result['choices'][0]['message']['content']
-                return answer.strip()
-            else:
-                raise Exception("Respuesta de la API no tiene el formato esperado")
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+
+                    chunk = json.loads(data)
+                    report_usage(chunk, on_usage)
+
+                    choices = chunk.get('choices') or []
+                    if not choices:
+                        continue
+
+                    content = choices[0].get('delta', {}).get('content')
+                    if content:
+                        parts.append(content)
+                        yield content
 
         except requests.exceptions.RequestException as e:
             raise Exception(f"Error al llamar a la API de DeepSeek: {str(e)}")
 
+        if cache_key is not None and parts:
+            self.response_cache.set(cache_key, "deepseek", model, "".join(parts).strip())
+
     def simple_chat(
         self,
         message: str,
@@ -160,7 +219,7 @@ Pregunta del usuario:
         }
 
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.api_url,
                 headers=self.headers,
                 json=payload,
@@ -179,6 +238,110 @@ Pregunta del usuario:
             raise Exception(f"Error al llamar a la API de DeepSeek: {str(e)}")
 
 
+class AsyncDeepSeekClient(DeepSeekClient):
+    """
+    Cliente asíncrono de DeepSeek para el camino async de la API.
+
+    Usa el cliente HTTP compartido del proceso (pool keep-alive, HTTP/2),
+    por lo que no ocupa un hilo por llamada. Reutiliza los prompts y la
+    caché de respuestas del cliente síncrono.
+    """
+
+    async def agenerate_response(
+        self,
+        query: str,
+        context_documents: List[str],
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        context_type: str = "docs_only",
+        model: Optional[str] = None,
+        on_usage: Optional[Callable[[Dict], None]] = None,
+        conversation: Optional[str] = None
+    ) -> str:
+        """
+        Versión asíncrona de generate_response
+
+        Args:
+            query: Pregunta del usuario
+            context_documents: Lista de documentos relevantes como contexto
+            temperature: Temperatura para la generación (0-1)
+            max_tokens: Máximo de tokens en la respuesta
+            context_type: Tipo de contexto - 'faq_only', 'faq_and_docs', 'docs_only'
+            model: Modelo a usar en esta llamada (default: self.model)
+            on_usage: Callback con el uso de tokens {prompt_tokens, completion_tokens}
+            conversation: Memoria de la conversación (resumen y últimos turnos) para el prompt
+
+        Returns:
+            Respuesta generada por DeepSeek
+        """
+        model = model or self.model
+        payload, cache_key = build_chat_request(
+            "deepseek", model, query, context_documents, context_type, conversation,
+            temperature, max_tokens, self.response_cache
+        )
+
+        if cache_key is not None:
+            cached = await self.response_cache.aget(cache_key)
+            if cached is not None:
+                return cached
+
+        try:
+            result = await post_chat_completion(self.api_url, self.headers, payload)
+        except httpx.HTTPError as e:
+            raise Exception(f"Error al llamar a la API de DeepSeek: {str(e)}")
+
+        report_usage(result, on_usage)
+        answer = extract_message_content(result)
+
+        if cache_key is not None:
+            await self.response_cache.aset(cache_key, "deepseek", model, answer)
+
+        return answer
+
+    async def agenerate_response_stream(
+        self,
+        query: str,
+        context_documents: List[str],
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        context_type: str = "docs_only",
+        model: Optional[str] = None,
+        on_usage: Optional[Callable[[Dict], None]] = None,
+        conversation: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Versión asíncrona de generate_response_stream
+
+        Yields:
+            Fragmentos de texto de la respuesta
+        """
+        model = model or self.model
+        payload, cache_key = build_chat_request(
+            "deepseek", model, query, context_documents, context_type, conversation,
+            temperature, max_tokens, self.response_cache
+        )
+
+        if cache_key is not None:
+            cached = await self.response_cache.aget(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        if on_usage is not None:
+            payload["stream_options"] = {"include_usage": True}
+
+        parts = []
+        try:
+            async for token in stream_chat_completion(self.api_url, self.headers, payload, on_usage):
+                parts.append(token)
+                yield token
+        except httpx.HTTPError as e:
+            raise Exception(f"Error al llamar a la API de DeepSeek: {str(e)}")
+
+        if cache_key is not None and parts:
+            await self.response_cache.aset(cache_key, "deepseek", model, "".join(parts).strip())
+
+
 if __name__ == "__main__":
     # Test del cliente
     try:
@@ -1,16 +1,23 @@
 """
 Módulo para interactuar con la API de Groq (ultra-rápida)
 """
+import sys
 import os
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import httpx
 from dotenv import load_dotenv
-from typing import List
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
 from groq import Groq
+from llm.http_pool import post_chat_completion, stream_chat_completion, extract_message_content, report_usage
+from llm.prompts import build_chat_request
 
 
 class GroqClient:
     """Cliente para la API de Groq con modelos ultra-rápidos"""
 
-    def __init__(self, model: str = "llama-3.3-70b-versatile"):
+    def __init__(self, model: str = "llama-3.3-70b-versatile", response_cache=None):
         """
         Inicializa el cliente de Groq
 
@@ -19,6 +26,7 @@ class GroqClient:
                 - "llama-3.3-70b-versatile": Llama 3.3 70B (mejor calidad, recomendado)
                 - "llama-3.1-8b-instant": Llama 3.1 8B (más rápido)
                 - "llama-3.2-90b-text-preview": Llama 3.2 90B (experimental)
+            response_cache: LLMResponseCache para reutilizar respuestas (opcional)
         """
         load_dotenv()
 
@@ -28,6 +36,25 @@ class GroqClient:
 
         self.client = Groq(api_key=self.api_key)
         self.model = model
+        self.response_cache = response_cache
+
+    @staticmethod
+    def _report_sdk_usage(usage, on_usage: Optional[Callable[[Dict], None]]):
+        """
+        Llama a on_usage con el uso de tokens de un objeto 'usage' del SDK de Groq
+
+        Args:
+            usage: Objeto usage de la respuesta (o de x_groq en el último chunk del stream)
+            on_usage: Callback opcional
+        """
+        if on_usage is None or usage is None:
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        on_usage({
+            'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+            'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+            'cached_prompt_tokens': getattr(details, 'cached_tokens', 0) or 0
+        })
 
     def generate_response(
         self,
@@ -35,7 +62,11 @@ class GroqClient:
         context_documents: List[str],
         temperature: float = 0.3,
         max_tokens: int = 850,
-        context_type: str = "docs_only"
+        context_type: str = "docs_only",
+        model: Optional[str] = None,
+        on_usage: Optional[Callable[[Dict], None]] = None,
+        conversation: Optional[str] = None,
+        timeout: Optional[float] = None
     ) -> str:
         """
         Genera una respuesta usando el contexto RAG
@@ -46,83 +77,105 @@ class GroqClient:
             temperature: Temperatura para la generación (0-1)
             max_tokens: Máximo de tokens en la respuesta
             context_type: Tipo de contexto - 'faq_only', 'faq_and_docs', 'docs_only'
+            model: Modelo a usar en esta llamada (default: self.model)
+            on_usage: Callback con el uso de tokens {prompt_tokens, completion_tokens}
+            conversation: Memoria de la conversación (resumen y últimos turnos) para el prompt
+            timeout: Segundos máximos de espera de la API (None = el del cliente)
 
         Returns:
             Respuesta generada por Groq
         """
-        # Construir el prompt RAG
-        context = "\n\n---\n\n".join(context_documents)
-
-        # Seleccionar prompt según tipo de contexto
-        if context_type == "faq_only":
-            system_prompt = """Eres un asistente de FAQ universitario.
-
-REGLAS ESTRICTAS:
-1. Responde ÚNICAMENTE usando las preguntas frecuentes (FAQs) proporcionadas
-2. Si la pregunta coincide con una FAQ, usa EXACTAMENTE la respuesta de esa FAQ
-3. NO combines información de múltiples FAQs a menos que sea necesario
-4. NO inventes información ni uses conocimiento externo
-5. Sé conciso y directo
-6. Si no hay una FAQ que responda la pregunta exactamente, di: "No encontré esa pregunta en mi FAQ"
-"""
-
-            user_prompt = f"""FAQs disponibles:
-
-{context}
+        model = model or self.model
+        payload, cache_key = build_chat_request(
+            "groq", model, query, context_documents, context_type, conversation,
+            temperature, max_tokens, self.response_cache
+        )
 
-Pregunta del estudiante:
-{query}
+        # Respuestas con temperatura baja: reutilizar si el prompt ya fue respondido
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
 
-Instrucción: Responde SOLO si la pregunta coincide con una de las FAQs anteriores."""
+        if timeout is not None:
+            payload["timeout"] = timeout
 
-        elif context_type == "faq_and_docs":
-            system_prompt = """Eres un asistente universitario que ayuda a estudiantes.
-
-REGLAS:
-1. Tienes FAQs (preguntas frecuentes) y documentos adicionales
-2. PRIORIZA las FAQs si responden la pregunta
-3. Usa los documentos solo si las FAQs no son suficientes
-4. NO inventes información
-5. Sé conciso y preciso"""
-
-            user_prompt = f"""Contexto disponible (FAQs primero, luego documentos):
-
-{context}
+        try:
+            chat_completion = self.client.chat.completions.create(**payload)
 
-Pregunta del estudiante:
-{query}
+            answer = chat_completion.choices[0].message.content.strip()
+            self._report_sdk_usage(getattr(chat_completion, 'usage', None), on_usage)
 
-Instrucción: Prioriza la información de las FAQs si está disponible."""
+        except Exception as e:
+            raise Exception(f"Error al llamar a la API de Groq: {str(e)}")
 
-        else:  # docs_only (flujo original)
-            system_prompt = """Eres un asistente útil que responde preguntas basándose ÚNICAMENTE en el contexto proporcionado.
-Si la información no está en el contexto, di claramente que no tienes esa información.
-No inventes información ni uses conocimiento externo al contexto.
-Sé conciso y directo en tus respuestas."""
+        if cache_key is not None:
+            self.response_cache.set(cache_key, "groq", model, answer)
 
-            user_prompt = f"""Usa SOLO esta información de contexto para responder:
+        return answer
 
-{context}
+    def generate_response_stream(
+        self,
+        query: str,
+        context_documents: List[str],
+        temperature: float = 0.3,
+        max_tokens: int = 850,
+        context_type: str = "docs_only",
+        model: Optional[str] = None,
+        on_usage: Optional[Callable[[Dict], None]] = None,
+        conversation: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        Genera una respuesta usando el contexto RAG, emitiendo los tokens
+        a medida que llegan (modo stream=True de la API)
 
-Pregunta del usuario:
-{query}"""
+        Args:
+            query: Pregunta del usuario
+            context_documents: Lista de documentos relevantes como contexto
+            temperature: Temperatura para la generación (0-1)
+            max_tokens: Máximo de tokens en la respuesta
+            context_type: Tipo de contexto - 'faq_only', 'faq_and_docs', 'docs_only'
+            model: Modelo a usar en esta llamada (default: self.model)
+            on_usage: Callback con el uso de tokens {prompt_tokens, completion_tokens}
+            conversation: Memoria de la conversación (resumen y últimos turnos) para el prompt
 
+        Yields:
+            Fragmentos de texto de la respuesta
+        """
+        model = model or self.model
+        payload, cache_key = build_chat_request(
+            "groq", model, query, context_documents, context_type, conversation,
+            temperature, max_tokens, self.response_cache
+        )
+
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        parts = []
         try:
-            chat_completion = self.client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                model=self.model,
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
+            stream = self.client.chat.completions.create(**payload, stream=True)
 
-            return chat_completion.choices[0].message.content.strip()
+            for chunk in stream:
+                # Groq envía el uso de tokens en x_groq.usage del último chunk
+                x_groq = getattr(chunk, 'x_groq', None)
+                self._report_sdk_usage(getattr(x_groq, 'usage', None), on_usage)
+
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    parts.append(content)
+                    yield content
 
         except Exception as e:
             raise Exception(f"Error al llamar a la API de Groq: {str(e)}")
 
+        if cache_key is not None and parts:
+            self.response_cache.set(cache_key, "groq", model, "".join(parts).strip())
+
     def simple_chat(
         self,
         message: str,
@@ -156,6 +209,123 @@ Pregunta del usuario:
             raise Exception(f"Error al llamar a la API de Groq: {str(e)}")
 
 
+class AsyncGroqClient(GroqClient):
+    """
+    Cliente asíncrono de Groq para el camino async de la API.
+
+    Llama al endpoint compatible con OpenAI de Groq con el cliente HTTP
+    compartido del proceso (pool keep-alive, HTTP/2) en lugar del SDK
+    síncrono, por lo que no ocupa un hilo por llamada.
+    """
+
+    def __init__(self, model: str = "llama-3.3-70b-versatile", response_cache=None):
+        """
+        Inicializa el cliente asíncrono de Groq
+
+        Args:
+            model: Modelo a usar (ver GroqClient)
+            response_cache: LLMResponseCache para reutilizar respuestas (opcional)
+        """
+        super().__init__(model=model, response_cache=response_cache)
+
+        self.api_url = os.getenv('GROQ_API_URL', "https://api.groq.com/openai/v1/chat/completions")
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    async def agenerate_response(
+        self,
+        query: str,
+        context_documents: List[str],
+        temperature: float = 0.3,
+        max_tokens: int = 850,
+        context_type: str = "docs_only",
+        model: Optional[str] = None,
+        on_usage: Optional[Callable[[Dict], None]] = None,
+        conversation: Optional[str] = None
+    ) -> str:
+        """
+        Versión asíncrona de generate_response
+
+        Args:
+            query: Pregunta del usuario
+            context_documents: Lista de documentos relevantes como contexto
+            temperature: Temperatura para la generación (0-1)
+            max_tokens: Máximo de tokens en la respuesta
+            context_type: Tipo de contexto - 'faq_only', 'faq_and_docs', 'docs_only'
+            model: Modelo a usar en esta llamada (default: self.model)
+            on_usage: Callback con el uso de tokens {prompt_tokens, completion_tokens}
+            conversation: Memoria de la conversación (resumen y últimos turnos) para el prompt
+
+        Returns:
+            Respuesta generada por Groq
+        """
+        model = model or self.model
+        payload, cache_key = build_chat_request(
+            "groq", model, query, context_documents, context_type, conversation,
+            temperature, max_tokens, self.response_cache
+        )
+
+        if cache_key is not None:
+            cached = await self.response_cache.aget(cache_key)
+            if cached is not None:
+                return cached
+
+        try:
+            result = await post_chat_completion(self.api_url, self.headers, payload)
+        except httpx.HTTPError as e:
+            raise Exception(f"Error al llamar a la API de Groq: {str(e)}")
+
+        report_usage(result, on_usage)
+        answer = extract_message_content(result)
+
+        if cache_key is not None:
+            await self.response_cache.aset(cache_key, "groq", model, answer)
+
+        return answer
+
+    async def agenerate_response_stream(
+        self,
+        query: str,
+        context_documents: List[str],
+        temperature: float = 0.3,
+        max_tokens: int = 850,
+        context_type: str = "docs_only",
+        model: Optional[str] = None,
+        on_usage: Optional[Callable[[Dict], None]] = None,
+        conversation: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Versión asíncrona de generate_response_stream
+
+        Yields:
+            Fragmentos de texto de la respuesta
+        """
+        model = model or self.model
+        payload, cache_key = build_chat_request(
+            "groq", model, query, context_documents, context_type, conversation,
+            temperature, max_tokens, self.response_cache
+        )
+
+        if cache_key is not None:
+            cached = await self.response_cache.aget(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        parts = []
+        try:
+            async for token in stream_chat_completion(self.api_url, self.headers, payload, on_usage):
+                parts.append(token)
+                yield token
+        except httpx.HTTPError as e:
+            raise Exception(f"Error al llamar a la API de Groq: {str(e)}")
+
+        if cache_key is not None and parts:
+            await self.response_cache.aset(cache_key, "groq", model, "".join(parts).strip())
+
+
 if __name__ == "__main__":
     # Test del cliente
     try:
@@ -0,0 +1,303 @@
+"""
+Módulo con el cliente HTTP asíncrono compartido (pool de conexiones keep-alive,
+HTTP/2) para las llamadas a las APIs de LLM compatibles con OpenAI
+"""
+import os
+import json
+import asyncio
+import threading
+import weakref
+from typing import AsyncIterator, Callable, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+
+# {event loop: httpx.AsyncClient}; la entrada se descarta cuando el loop se cierra o se libera
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def _http2_available() -> bool:
+    """Indica si el paquete h2 está instalado (requerido por httpx para HTTP/2)"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def build_limits_and_timeout() -> tuple:
+    """
+    Lee la configuración del pool desde .env
+
+    Variables:
+        LLM_HTTP_MAX_CONNECTIONS: Conexiones simultáneas máximas (default: 20)
+        LLM_HTTP_MAX_KEEPALIVE: Conexiones inactivas que se mantienen abiertas (default: 10)
+        LLM_HTTP_KEEPALIVE_EXPIRY: Segundos antes de cerrar una conexión inactiva (default: 30)
+        LLM_HTTP_CONNECT_TIMEOUT: Timeout de conexión en segundos (default: 5)
+        LLM_HTTP_READ_TIMEOUT: Timeout de lectura en segundos (default: 30)
+        LLM_HTTP_WRITE_TIMEOUT: Timeout de envío del cuerpo de la petición en segundos (default: 10)
+        LLM_HTTP_POOL_TIMEOUT: Espera máxima por una conexión libre del pool (default: 5)
+
+    Returns:
+        Tupla (httpx.Limits, httpx.Timeout)
+    """
+    load_dotenv()
+
+    limits = httpx.Limits(
+        max_connections=int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', 20)),
+        max_keepalive_connections=int(os.getenv('LLM_HTTP_MAX_KEEPALIVE', 10)),
+        keepalive_expiry=float(os.getenv('LLM_HTTP_KEEPALIVE_EXPIRY', 30))
+    )
+    timeout = httpx.Timeout(
+        connect=float(os.getenv('LLM_HTTP_CONNECT_TIMEOUT', 5)),
+        read=float(os.getenv('LLM_HTTP_READ_TIMEOUT', 30)),
+        write=float(os.getenv('LLM_HTTP_WRITE_TIMEOUT', 10)),
+        pool=float(os.getenv('LLM_HTTP_POOL_TIMEOUT', 5))
+    )
+    return limits, timeout
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Obtiene el cliente HTTP asíncrono compartido del event loop actual
+
+    Todas las llamadas a LLMs del proceso reutilizan sus conexiones, evitando
+    un handshake TCP+TLS por petición. Se usa HTTP/2 si h2 está instalado
+    y LLM_HTTP2 no es 'false'.
+
+    Returns:
+        httpx.AsyncClient compartido
+    """
+    loop = asyncio.get_running_loop()
+
+    with _clients_lock:
+        # Las conexiones de un cliente guardan referencias a su loop, así que un
+        # loop cerrado no siempre se libera solo: sus entradas se quitan aquí
+        for closed_loop in [other for other in _clients if other.is_closed()]:
+            del _clients[closed_loop]
+
+        client = _clients.get(loop)
+        if client is None or client.is_closed:
+            limits, timeout = build_limits_and_timeout()
+            use_http2 = os.getenv('LLM_HTTP2', 'true').lower() in ('1', 'true', 'yes') and _http2_available()
+            client = httpx.AsyncClient(http2=use_http2, limits=limits, timeout=timeout)
+            _clients[loop] = client
+
+    return client
+
+
+async def aclose_async_http_client():
+    """Cierra el cliente compartido del event loop actual (al apagar la aplicación)"""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+
+async def post_chat_completion(url: str, headers: Dict, payload: Dict) -> Dict:
+    """
+    Llama a un endpoint /chat/completions compatible con OpenAI
+
+    Args:
+        url: URL del endpoint
+        headers: Headers (incluye Authorization)
+        payload: Cuerpo JSON de la petición
+
+    Returns:
+        Respuesta JSON de la API
+    """
+    client = get_async_http_client()
+    response = await client.post(url, headers=headers, json=payload)
+    response.raise_for_status()
+    return response.json()
+
+
+async def stream_chat_completion(
+    url: str,
+    headers: Dict,
+    payload: Dict,
+    on_usage: Optional[Callable[[Dict], None]] = None
+) -> AsyncIterator[str]:
+    """
+    Llama a un endpoint /chat/completions en modo stream=True
+
+    Args:
+        url: URL del endpoint
+        headers: Headers (incluye Authorization)
+        payload: Cuerpo JSON de la petición (se fuerza stream=True)
+        on_usage: Callback con el uso de tokens si la API lo envía en el último chunk
+
+    Yields:
+        Fragmentos de texto de la respuesta
+    """
+    client = get_async_http_client()
+    payload = dict(payload, stream=True)
+
+    async with client.stream("POST", url, headers=headers, json=payload) as response:
+        response.raise_for_status()
+
+        # Formato Server-Sent Events: líneas "data: {...}" hasta "data: [DONE]"
+        async for line in response.aiter_lines():
+            if not line or not line.startswith("data:"):
+                continue
+
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+
+            chunk = json.loads(data)
+            report_usage(chunk, on_usage)
+
+            choices = chunk.get('choices') or []
+            if not choices:
+                continue
+
+            content = choices[0].get('delta', {}).get('content')
+            if content:
+                yield content
+
+
+def extract_usage(data: Dict) -> Optional[Dict]:
+    """
+    Extrae el uso de tokens de una respuesta o de un chunk de stream
+
+    DeepSeek lo envía en 'usage'; Groq también en 'x_groq.usage' al final del stream.
+    Los tokens del prompt servidos desde la caché de prefijos del proveedor
+    vienen en 'prompt_cache_hit_tokens' (DeepSeek) o en
+    'prompt_tokens_details.cached_tokens' (formato OpenAI, usado por Groq).
+
+    Args:
+        data: Respuesta JSON o chunk del stream
+
+    Returns:
+        Diccionario con prompt_tokens, completion_tokens y cached_prompt_tokens,
+        o None si no viene
+    """
+    usage = data.get('usage') or (data.get('x_groq') or {}).get('usage')
+    if not usage:
+        return None
+
+    cached_tokens = usage.get('prompt_cache_hit_tokens')
+    if cached_tokens is None:
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens')
+
+    return {
+        'prompt_tokens': usage.get('prompt_tokens') or 0,
+        'completion_tokens': usage.get('completion_tokens') or 0,
+        'cached_prompt_tokens': cached_tokens or 0
+    }
+
+
+def report_usage(data: Dict, on_usage: Optional[Callable[[Dict], None]]):
+    """Llama a on_usage si la respuesta trae el uso de tokens"""
+    if on_usage is None:
+        return
+    usage = extract_usage(data)
+    if usage is not None:
+        on_usage(usage)
+
+
+def extract_message_content(result: Dict) -> str:
+    """
+    Extrae el texto de una respuesta /chat/completions
+
+    Args:
+        result: Respuesta JSON de la API
+
+    Returns:
+        Contenido del primer mensaje
+
+    Raises:
+        Exception: Si la respuesta no tiene el formato esperado
+    """
+    if 'choices' in result and len(result['choices']) > 0:
+        return result['choices'][0]['message']['content'].strip()
+    raise Exception("Respuesta de la API no tiene el formato esperado")
+
+
+if __name__ == "__main__":
+    # Test contra un servidor HTTP local que imita la API (sin llamadas reales)
+    import sys
+    import threading
+    from pathlib import Path
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+    connections = set()  # (host, puerto) de cada conexión TCP que abrió el cliente
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            connections.add(self.client_address)
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if body.get("stream"):
+                chunks = [
+                    f"data: {json.dumps({'choices': [{'delta': {'content': word}}]})}\n\n"
+                    for word in ["Hola ", "desde ", "el ", "servidor ", "local"]
+                ] + ["data: [DONE]\n\n"]
+                payload = "".join(chunks).encode()
+                content_type = "text/event-stream"
+            else:
+                payload = json.dumps({
+                    "choices": [{"message": {"content": "Respuesta del servidor local"}}]
+                }).encode()
+                content_type = "application/json"
+
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+    os.environ.setdefault("DEEPSEEK_API_KEY", "test")
+    os.environ["DEEPSEEK_API_URL"] = url
+
+    from llm.deepseek_client import AsyncDeepSeekClient
+
+    async def main():
+        client = AsyncDeepSeekClient()
+        answers = await asyncio.gather(*[
+            client.agenerate_response("¿Qué es Python?", ["Python es un lenguaje."])
+            for _ in range(5)
+        ])
+        print(f"Respuestas concurrentes: {answers}")
+        assert answers == ["Respuesta del servidor local"] * 5
+
+        # Llamadas sucesivas: reutilizan las conexiones keep-alive, sin handshakes nuevos
+        opened = len(connections)
+        for _ in range(5):
+            await client.agenerate_response("¿Qué es Python?", ["Python es un lenguaje."])
+        print(f"Conexiones abiertas: {opened} (5 llamadas más, {len(connections) - opened} nuevas)")
+        assert len(connections) == opened, "las llamadas sucesivas abrieron conexiones nuevas"
+
+        tokens = [token async for token in client.agenerate_response_stream("¿Qué es Python?", ["..."])]
+        print(f"Tokens: {tokens}")
+        assert "".join(tokens) == "Hola desde el servidor local"
+
+        shared = get_async_http_client()
+        assert shared is get_async_http_client()
+        await aclose_async_http_client()
+        assert shared.is_closed and asyncio.get_running_loop() not in _clients
+
+    asyncio.run(main())
+
+    # Cada asyncio.run crea un loop: el cliente que dejó abierto un loop ya cerrado se descarta
+    async def leave_open():
+        get_async_http_client()
+
+    asyncio.run(leave_open())
+    asyncio.run(leave_open())
+    print(f"Clientes registrados después de dos loops: {len(_clients)}")
+    assert len(_clients) <= 1
+    server.shutdown()
@@ -0,0 +1,223 @@
+"""
+Módulo de política de rutas de modelo: elige el modelo y el límite de tokens
+según el tipo de contexto y su tamaño, y registra latencia y uso por ruta
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import os
+import json
+import threading
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from llm.router import LatencyTracker
+from llm.prompts import cache_hit_ratio
+
+
+class ModelRoutingPolicy:
+    """
+    Política de rutas de modelo.
+
+    Cada ruta es un diccionario:
+    - name: nombre de la ruta (aparece en estadísticas y respuestas)
+    - context_types: tipos de contexto que atiende (omitido = cualquiera)
+    - max_context_tokens: tamaño máximo del contexto (omitido = sin límite)
+    - models: {proveedor: modelo}; un proveedor omitido usa su modelo por defecto
+    - max_tokens: tope de tokens de la respuesta (omitido = el pedido)
+
+    Se usa la primera ruta que coincide, por lo que las rutas más
+    específicas van primero y la última debería ser un comodín.
+
+    La ruta rápida (fast_route) no participa de la selección: es la que usa
+    el pipeline cuando el presupuesto de latencia de la petición no alcanza
+    para la ruta elegida.
+    """
+
+    DEFAULT_ROUTES = [
+        {
+            # Respuestas cortas sobre una FAQ: el modelo pequeño es suficiente
+            "name": "faq_small",
+            "context_types": ["faq_only"],
+            "max_context_tokens": 1500,
+            "models": {"groq": "llama-3.1-8b-instant"},
+            "max_tokens": 500
+        },
+        {
+            "name": "faq_and_docs",
+            "context_types": ["faq_and_docs"],
+            "models": {"groq": "llama-3.3-70b-versatile"}
+        },
+        {
+            "name": "docs",
+            "context_types": ["docs_only"],
+            "models": {"groq": "llama-3.3-70b-versatile"}
+        },
+        {
+            "name": "default",
+            "models": {}
+        }
+    ]
+
+    DEFAULT_FAST_ROUTE = {
+        "name": "fast",
+        "models": {"groq": "llama-3.1-8b-instant"},
+        "max_tokens": 500
+    }
+
+    def __init__(self, routes: Optional[List[Dict]] = None, fast_route: Optional[Dict] = None):
+        """
+        Inicializa la política
+
+        Args:
+            routes: Lista de rutas. Si se omite, se lee el JSON de LLM_ROUTES_FILE
+                    o se usan DEFAULT_ROUTES
+            fast_route: Ruta para peticiones sin tiempo suficiente. Si se omite, se usa
+                    DEFAULT_FAST_ROUTE con el modelo de Groq de LLM_FAST_MODEL
+        """
+        load_dotenv()
+
+        if routes is None:
+            routes_file = os.getenv('LLM_ROUTES_FILE')
+            if routes_file:
+                routes = json.loads(Path(routes_file).read_text(encoding='utf-8'))
+            else:
+                routes = self.DEFAULT_ROUTES
+
+        if not routes:
+            raise ValueError("La política de rutas necesita al menos una ruta")
+
+        self.routes = [dict(route) for route in routes]
+
+        if fast_route is None:
+            fast_route = dict(self.DEFAULT_FAST_ROUTE)
+            fast_model = os.getenv('LLM_FAST_MODEL')
+            if fast_model:
+                fast_route["models"] = {"groq": fast_model}
+        self.fast_route = dict(fast_route)
+
+        tracked = self.routes + [self.fast_route]
+        self._lock = threading.Lock()
+        self._latency = {route['name']: LatencyTracker() for route in tracked}
+        self._stats = {
+            route['name']: {
+                'requests': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cached_prompt_tokens': 0
+            }
+            for route in tracked
+        }
+
+    def select(self, context_type: str, context_tokens: int) -> Dict:
+        """
+        Elige la ruta para una consulta
+
+        Args:
+            context_type: 'faq_only', 'faq_and_docs' o 'docs_only'
+            context_tokens: Tamaño del contexto en tokens
+
+        Returns:
+            Ruta elegida (la última si ninguna coincide)
+        """
+        for route in self.routes:
+            context_types = route.get('context_types')
+            if context_types and context_type not in context_types:
+                continue
+
+            max_context_tokens = route.get('max_context_tokens')
+            if max_context_tokens is not None and context_tokens > max_context_tokens:
+                continue
+
+            return route
+
+        return self.routes[-1]
+
+    @staticmethod
+    def max_tokens_for(route: Dict, requested: int) -> int:
+        """
+        Aplica el tope de tokens de la ruta
+
+        Args:
+            route: Ruta elegida
+            requested: max_tokens pedido por el llamador
+
+        Returns:
+            max_tokens efectivo
+        """
+        cap = route.get('max_tokens')
+        return min(requested, cap) if cap else requested
+
+    def latency_estimate_ms(self, route_name: str, pct: int = 50) -> Optional[float]:
+        """
+        Latencia observada de una ruta
+
+        Args:
+            route_name: Nombre de la ruta
+            pct: Percentil
+
+        Returns:
+            Latencia en milisegundos, o None si todavía no hay muestras
+        """
+        tracker = self._latency.get(route_name)
+        value = tracker.percentile(pct) if tracker is not None else None
+        return value * 1000 if value is not None else None
+
+    def record(self, route_name: str, latency_seconds: float, usage: Optional[Dict] = None, error: bool = False):
+        """
+        Registra el resultado de una generación
+
+        Args:
+            route_name: Nombre de la ruta usada
+            latency_seconds: Duración de la llamada al LLM
+            usage: Uso de tokens {prompt_tokens, completion_tokens, cached_prompt_tokens}
+                si la API lo informó
+            error: True si la generación falló
+        """
+        if route_name not in self._stats:
+            return
+
+        self._latency[route_name].record(latency_seconds)
+
+        with self._lock:
+            stats = self._stats[route_name]
+            stats['requests'] += 1
+            if error:
+                stats['errors'] += 1
+            if usage:
+                stats['prompt_tokens'] += usage.get('prompt_tokens', 0)
+                stats['completion_tokens'] += usage.get('completion_tokens', 0)
+                stats['cached_prompt_tokens'] += usage.get('cached_prompt_tokens', 0)
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas por ruta
+
+        Returns:
+            {ruta: {requests, errors, prompt_tokens, completion_tokens, cached_prompt_tokens,
+                    prompt_cache_hit_ratio, latency_p50_ms, latency_p95_ms}}
+        """
+        with self._lock:
+            stats = {name: dict(counters) for name, counters in self._stats.items()}
+
+        for name, route_stats in stats.items():
+            route_stats['prompt_cache_hit_ratio'] = cache_hit_ratio(
+                route_stats['prompt_tokens'], route_stats['cached_prompt_tokens']
+            )
+            for pct in (50, 95):
+                value = self._latency[name].percentile(pct)
+                route_stats[f'latency_p{pct}_ms'] = round(value * 1000) if value is not None else None
+
+        return stats
+
+
+if __name__ == "__main__":
+    # Test de la política
+    policy = ModelRoutingPolicy()
+
+    for context_type, tokens in [("faq_only", 300), ("faq_only", 4000), ("faq_and_docs", 1200), ("docs_only", 6000)]:
+        route = policy.select(context_type, tokens)
+        print(f"{context_type:13} {tokens:5} tokens -> {route['name']:12} "
+              f"modelos={route['models']} max_tokens={policy.max_tokens_for(route, 2000)}")
+        policy.record(route['name'], 0.4, {'prompt_tokens': tokens, 'completion_tokens': 120, 'cached_prompt_tokens': tokens // 2})
+
+    print(f"\nStats: {policy.get_stats()}")
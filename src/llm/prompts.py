@@ -0,0 +1,211 @@
+"""
+Módulo de prompts compartido por los clientes de LLM
+
+El orden de los prompts favorece la caché de prefijos del proveedor
+(DeepSeek cobra menos y responde antes cuando el inicio del prompt ya fue
+procesado): primero todo lo estático (system prompt e instrucciones),
+después el contexto con las FAQs en orden determinista, la memoria de la
+conversación y al final la pregunta, que es lo único que cambia en cada consulta.
+"""
+from typing import Dict, List, Optional, Tuple
+
+
+SYSTEM_PROMPTS = {
+    "faq_only": """Eres un asistente de FAQ universitario.
+
+REGLAS ESTRICTAS:
+1. Responde ÚNICAMENTE usando las preguntas frecuentes (FAQs) proporcionadas
+2. Si la pregunta coincide con una FAQ, usa EXACTAMENTE la respuesta de esa FAQ
+3. NO combines información de múltiples FAQs a menos que sea necesario
+4. NO inventes información ni uses conocimiento externo
+5. Sé conciso y directo
+6. Si no hay una FAQ que responda la pregunta exactamente, di: "No encontré esa pregunta en mi FAQ\"""",
+
+    "faq_and_docs": """Eres un asistente universitario que ayuda a estudiantes.
+
+REGLAS:
+1. Tienes FAQs (preguntas frecuentes) y documentos adicionales
+2. PRIORIZA las FAQs si responden la pregunta
+3. Usa los documentos solo si las FAQs no son suficientes
+4. NO inventes información
+5. Sé conciso y preciso""",
+
+    "docs_only": """Eres un asistente útil que responde preguntas basándose ÚNICAMENTE en el contexto proporcionado.
+Si la información no está en el contexto, di claramente que no tienes esa información.
+No inventes información ni uses conocimiento externo al contexto.
+Sé conciso y directo en tus respuestas."""
+}
+
+# Instrucciones que antes iban después de la pregunta
+INSTRUCTIONS = {
+    "faq_only": "Responde SOLO si la pregunta coincide con una de las FAQs del contexto.",
+    "faq_and_docs": "Prioriza la información de las FAQs si está disponible.",
+    "docs_only": "Usa SOLO la información de contexto para responder."
+}
+
+CONTEXT_HEADERS = {
+    "faq_only": "FAQs disponibles:",
+    "faq_and_docs": "Contexto disponible (FAQs primero, luego documentos):",
+    "docs_only": "Información de contexto:"
+}
+
+QUESTION_LABELS = {
+    "faq_only": "Pregunta del estudiante:",
+    "faq_and_docs": "Pregunta del estudiante:",
+    "docs_only": "Pregunta del usuario:"
+}
+
+CONVERSATION_HEADER = "Conversación previa (úsala solo para entender a qué se refiere la pregunta):"
+
+DOCUMENT_SEPARATOR = "\n\n---\n\n"
+
+
+def build_prompts(
+    query: str,
+    context_documents: List[str],
+    context_type: str = "docs_only",
+    conversation: Optional[str] = None
+) -> Tuple[str, str]:
+    """
+    Construye el system prompt y el user prompt según el tipo de contexto
+
+    El system prompt es idéntico para todas las consultas del mismo tipo de
+    contexto; el user prompt empieza con el contexto y termina con la pregunta.
+
+    Args:
+        query: Pregunta del usuario
+        context_documents: Lista de documentos relevantes como contexto
+        context_type: Tipo de contexto - 'faq_only', 'faq_and_docs', 'docs_only'
+        conversation: Memoria de la conversación (resumen y últimos turnos), opcional
+
+    Returns:
+        Tupla (system_prompt, user_prompt)
+    """
+    if context_type not in SYSTEM_PROMPTS:
+        context_type = "docs_only"  # Flujo original
+
+    system_prompt = f"{SYSTEM_PROMPTS[context_type]}\n\nInstrucción: {INSTRUCTIONS[context_type]}"
+
+    context = DOCUMENT_SEPARATOR.join(context_documents)
+    user_prompt = f"""{CONTEXT_HEADERS[context_type]}
+
+{context}
+
+"""
+    if conversation:
+        user_prompt += f"""{CONVERSATION_HEADER}
+{conversation}
+
+"""
+    user_prompt += f"""{QUESTION_LABELS[context_type]}
+{query}"""
+
+    return system_prompt, user_prompt
+
+
+def build_chat_request(
+    provider: str,
+    model: str,
+    query: str,
+    context_documents: List[str],
+    context_type: str,
+    conversation: Optional[str],
+    temperature: float,
+    max_tokens: int,
+    response_cache=None
+) -> Tuple[Dict, Optional[str]]:
+    """
+    Arma el cuerpo de una llamada a /chat/completions y su clave en la caché de respuestas
+
+    Args:
+        provider: Proveedor del LLM (parte de la clave de caché)
+        model: Modelo de la llamada
+        query: Pregunta del usuario
+        context_documents: Lista de documentos relevantes como contexto
+        context_type: Tipo de contexto - 'faq_only', 'faq_and_docs', 'docs_only'
+        conversation: Memoria de la conversación para el prompt (opcional)
+        temperature: Temperatura para la generación
+        max_tokens: Máximo de tokens en la respuesta
+        response_cache: LLMResponseCache (opcional)
+
+    Returns:
+        Tupla (payload, clave de caché); la clave es None si no hay caché o la
+        temperatura es demasiado alta para cachear
+    """
+    system_prompt, user_prompt = build_prompts(query, context_documents, context_type, conversation)
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+
+    cache_key = None
+    if response_cache is not None and response_cache.is_cacheable(temperature):
+        cache_key = response_cache.make_key(provider, model, system_prompt, user_prompt, temperature, max_tokens)
+    return payload, cache_key
+
+
+def stable_context_order(
+    context_documents: List[str],
+    sources: List[str],
+    stable_prefix: str = "faq/"
+) -> Tuple[List[str], List[str]]:
+    """
+    Ordena el contexto para maximizar el prefijo compartido entre consultas
+
+    Los bloques estables (FAQs) van primero, ordenados por archivo y texto,
+    para que el mismo conjunto de FAQs produzca siempre el mismo prefijo
+    aunque su orden de relevancia cambie. Los documentos van después, en
+    orden de relevancia.
+
+    Args:
+        context_documents: Textos del contexto en orden de relevancia
+        sources: Archivo de origen de cada texto
+        stable_prefix: Prefijo de los archivos considerados estables
+
+    Returns:
+        Tupla (context_documents, sources) reordenada
+    """
+    pairs = list(zip(sources, context_documents))
+    stable = sorted(pair for pair in pairs if pair[0].startswith(stable_prefix))
+    others = [pair for pair in pairs if not pair[0].startswith(stable_prefix)]
+    ordered = stable + others
+    return [text for _, text in ordered], [source for source, _ in ordered]
+
+
+def cache_hit_ratio(prompt_tokens: int, cached_tokens: int) -> Optional[float]:
+    """
+    Proporción de tokens del prompt servidos desde la caché del proveedor
+
+    Args:
+        prompt_tokens: Tokens del prompt
+        cached_tokens: Tokens del prompt en caché
+
+    Returns:
+        Proporción entre 0 y 1 (None si no hubo tokens)
+    """
+    if not prompt_tokens:
+        return None
+    return round(cached_tokens / prompt_tokens, 4)
+
+
+if __name__ == "__main__":
+    import os
+
+    # Test: dos preguntas con las mismas FAQs comparten todo el prefijo salvo la pregunta
+    faqs = ["**Pregunta:** ¿Cuándo es la matrícula?\n\n**Respuesta:** En enero.",
+            "**Pregunta:** ¿Dónde está la VOAE?\n\n**Respuesta:** En el edificio A2."]
+    sources = ["faq/faq_matricula.md", "faq/faq_ubicaciones.md"]
+
+    docs, _ = stable_context_order(faqs, sources)
+    first = build_prompts("¿Cuándo matriculo?", docs, "faq_only")
+    docs, _ = stable_context_order(faqs[::-1], sources[::-1])
+    second = build_prompts("fecha de matrícula", docs, "faq_only")
+
+    shared = len(os.path.commonprefix([first[1], second[1]]))
+    print(f"System prompt idéntico: {first[0] == second[0]}")
+    print(f"Prefijo compartido del user prompt: {shared}/{len(first[1])} caracteres")
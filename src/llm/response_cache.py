@@ -0,0 +1,280 @@
+"""
+Módulo de caché exacta de respuestas del LLM persistida en SQLite
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from monitoring.logger import get_logger
+
+logger = get_logger("rag.llm_cache")
+
+
+class LLMResponseCache:
+    """
+    Caché de respuestas indexada por el prompt completo.
+
+    La clave es un hash de (proveedor, modelo, system prompt, user prompt,
+    temperature, max_tokens). Solo se cachean llamadas con temperatura baja,
+    donde el mismo prompt produce en la práctica la misma respuesta.
+
+    Se guarda en un archivo SQLite local en modo WAL, por lo que sobrevive
+    reinicios y puede compartirse entre varios workers del mismo nodo.
+    """
+
+    DEFAULT_PATH = "data/cache/llm_responses.sqlite3"
+    DEFAULT_MAX_ENTRIES = 5000
+    DEFAULT_MAX_TEMPERATURE = 0.3
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_entries: Optional[int] = None,
+        max_temperature: Optional[float] = None,
+        enabled: Optional[bool] = None
+    ):
+        """
+        Inicializa la caché (los valores omitidos se leen de .env)
+
+        Args:
+            db_path: Ruta del archivo SQLite (LLM_CACHE_PATH)
+            max_entries: Número máximo de respuestas guardadas (LLM_CACHE_MAX_ENTRIES)
+            max_temperature: Temperatura máxima cacheable (LLM_CACHE_MAX_TEMPERATURE)
+            enabled: Si es False, la caché no lee ni escribe (LLM_CACHE_ENABLED)
+        """
+        load_dotenv()
+
+        if db_path is None:
+            db_path = os.getenv('LLM_CACHE_PATH', self.DEFAULT_PATH)
+        if max_entries is None:
+            max_entries = int(os.getenv('LLM_CACHE_MAX_ENTRIES', self.DEFAULT_MAX_ENTRIES))
+        if max_temperature is None:
+            max_temperature = float(os.getenv('LLM_CACHE_MAX_TEMPERATURE', self.DEFAULT_MAX_TEMPERATURE))
+        if enabled is None:
+            enabled = os.getenv('LLM_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+        self.max_temperature = max_temperature
+        self.enabled = enabled and max_entries > 0
+
+        # sqlite3 no permite compartir conexiones entre hilos: una por hilo
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.enabled:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._create_table()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Obtiene la conexión SQLite del hilo actual"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_table(self):
+        """Crea la tabla de la caché si no existe"""
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+        conn.commit()
+
+    @staticmethod
+    def make_key(
+        provider: str,
+        model: str,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float,
+        max_tokens: int
+    ) -> str:
+        """
+        Calcula la clave de caché de una llamada al LLM
+
+        Returns:
+            Hash SHA-256 en hexadecimal
+        """
+        payload = json.dumps(
+            [provider, model, system_prompt, user_prompt, round(float(temperature), 4), int(max_tokens)],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def is_cacheable(self, temperature: float) -> bool:
+        """
+        Indica si una llamada con esta temperatura puede cachearse
+
+        Args:
+            temperature: Temperatura de la generación
+
+        Returns:
+            True si la caché está activa y la temperatura es suficientemente baja
+        """
+        return self.enabled and temperature <= self.max_temperature
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Busca una respuesta guardada
+
+        Args:
+            key: Clave calculada con make_key
+
+        Returns:
+            Respuesta guardada o None
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error("llm_cache.read_error", f"Error leyendo caché LLM: {str(e)}", exc_info=e, key=key)
+            row = None
+
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return row[0] if row is not None else None
+
+    def set(self, key: str, provider: str, model: str, response: str):
+        """
+        Guarda una respuesta y descarta las menos usadas si se excede max_entries
+
+        Args:
+            key: Clave calculada con make_key
+            provider: Proveedor del LLM
+            model: Modelo usado
+            response: Respuesta generada
+        """
+        if not self.enabled:
+            return
+
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, provider, model, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, provider, model, response, now, now)
+            )
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(
+                "llm_cache.write_error", f"Error escribiendo caché LLM: {str(e)}",
+                exc_info=e, key=key, provider=provider, model=model
+            )
+
+    async def aget(self, key: str) -> Optional[str]:
+        """
+        Versión asíncrona de get: la consulta SQLite corre en un hilo, fuera del event loop
+
+        Args:
+            key: Clave calculada con make_key
+
+        Returns:
+            Respuesta guardada o None
+        """
+        if not self.enabled:
+            return None
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, provider: str, model: str, response: str):
+        """
+        Versión asíncrona de set (la escritura SQLite corre en un hilo)
+
+        Args:
+            key: Clave calculada con make_key
+            provider: Proveedor del LLM
+            model: Modelo usado
+            response: Respuesta generada
+        """
+        if not self.enabled:
+            return
+        await asyncio.to_thread(self.set, key, provider, model, response)
+
+    def clear(self):
+        """Elimina todas las respuestas guardadas"""
+        if not self.enabled:
+            return
+        conn = self._connect()
+        conn.execute("DELETE FROM llm_cache")
+        conn.commit()
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas de la caché
+
+        Returns:
+            Diccionario con tamaño, hits, misses y hit ratio (de este proceso)
+        """
+        size = 0
+        if self.enabled:
+            size = self._connect().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'path': str(self.db_path),
+                'size': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0
+            }
+
+
+if __name__ == "__main__":
+    # Test de la caché
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = LLMResponseCache(db_path=f"{tmp}/cache.sqlite3", max_entries=2, enabled=True)
+
+        keys = [
+            cache.make_key("groq", "llama-3.3-70b-versatile", "system", f"pregunta {i}", 0.1, 850)
+            for i in range(3)
+        ]
+        for i, key in enumerate(keys):
+            cache.set(key, "groq", "llama-3.3-70b-versatile", f"respuesta {i}")
+
+        print(f"Más antigua (descartada): {cache.get(keys[0])}")
+        print(f"Más reciente: {cache.get(keys[2])}")
+        print(f"Stats: {cache.get_stats()}")
@@ -0,0 +1,813 @@
+"""
+Módulo de enrutamiento entre proveedores de LLM: reintentos con backoff,
+circuit breakers por proveedor, failover y hedging opcional
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from rag.admission import AdmissionRejected
+from monitoring.metrics import SIZE_BUCKETS, get_metrics
+from monitoring.logger import get_logger
+
+logger = get_logger("rag.router")
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de un proveedor.
+
+    - closed: las llamadas pasan normalmente
+    - open: tras failure_threshold fallos seguidos se deja de llamar al
+      proveedor durante recovery_seconds
+    - half_open: pasado ese tiempo se deja pasar una sola llamada de
+      prueba; su éxito cierra el circuito y su fallo lo vuelve a abrir.
+      Mientras la prueba está en curso las demás llamadas se rechazan; si
+      no termina en recovery_seconds, se permite otra
+    """
+
+    def __init__(self, failure_threshold: int = 3, recovery_seconds: float = 30.0):
+        """
+        Inicializa el circuit breaker
+
+        Args:
+            failure_threshold: Fallos consecutivos que abren el circuito
+            recovery_seconds: Segundos en estado abierto antes de probar de nuevo
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+
+    @property
+    def state(self) -> str:
+        """Estado actual: 'closed', 'open' o 'half_open'"""
+        with self._lock:
+            return self._state_locked()
+
+    def _state_locked(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.recovery_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """
+        Indica si se puede llamar al proveedor (en half_open, reserva la llamada de prueba)
+
+        Returns:
+            True si el circuito está cerrado, o semiabierto sin otra prueba en curso
+        """
+        with self._lock:
+            state = self._state_locked()
+            if state != "half_open":
+                return state == "closed"
+            now = time.monotonic()
+            if self._probe_started is not None and now - self._probe_started < self.recovery_seconds:
+                return False
+            self._probe_started = now
+            return True
+
+    def record_success(self):
+        """Registra una llamada exitosa (cierra el circuito)"""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self):
+        """Registra una llamada fallida (puede abrir el circuito)"""
+        with self._lock:
+            self._probe_started = None
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Ventana deslizante de latencias de un proveedor para calcular percentiles"""
+
+    def __init__(self, window: int = 200):
+        """
+        Args:
+            window: Número de muestras recientes que se conservan
+        """
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        """Agrega una muestra en segundos"""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """
+        Calcula un percentil de las muestras
+
+        Args:
+            pct: Percentil (0-100)
+
+        Returns:
+            Valor en segundos, o None si no hay muestras
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+
+class LLMRouter:
+    """
+    Router sobre varios clientes LLM con la misma interfaz que un cliente.
+
+    Los proveedores se prueban en orden: el primero es el preferido y el
+    resto son alternativas. Para cada proveedor:
+    - se reintenta con backoff exponencial con jitter
+    - un circuit breaker deja de llamarlo tras varios fallos seguidos
+    En el camino asíncrono se puede activar hedging: si el proveedor principal
+    no responde antes del p95 observado, se lanza la misma petición al
+    siguiente proveedor y se usa la primera que responda. El p95 se lleva
+    por separado para las respuestas completas y para el primer token de
+    los streams: cada camino se compara con su propia latencia.
+
+    Con un controlador de admisión, cada llamada asíncrona ocupa un lugar
+    en el límite de su proveedor ('llm:<proveedor>'). Si la cola de un
+    proveedor está llena se pasa al siguiente; si todas lo están se
+    propaga AdmissionRejected.
+    """
+
+    DEFAULT_MAX_RETRIES = 1
+    DEFAULT_BACKOFF_BASE = 0.25
+    DEFAULT_BACKOFF_MAX = 2.0
+    DEFAULT_BREAKER_FAILURES = 3
+    DEFAULT_BREAKER_RECOVERY = 30.0
+    DEFAULT_HEDGE_PERCENTILE = 95.0
+    DEFAULT_HEDGE_MIN_MS = 500
+    DEFAULT_HEDGE_DEFAULT_MS = 2500
+    MIN_SAMPLES_FOR_PERCENTILE = 20
+
+    def __init__(
+        self,
+        clients: List[Tuple[str, object]],
+        max_retries: Optional[int] = None,
+        hedge_enabled: Optional[bool] = None,
+        admission=None
+    ):
+        """
+        Inicializa el router (el resto de la configuración se lee de .env)
+
+        Args:
+            clients: Lista ordenada de (nombre del proveedor, cliente LLM)
+            max_retries: Reintentos por proveedor antes de pasar al siguiente (LLM_MAX_RETRIES)
+            hedge_enabled: Si es True, activa el hedging en el camino async (LLM_HEDGE_ENABLED)
+            admission: AdmissionController con los límites por proveedor (opcional)
+        """
+        if not clients:
+            raise ValueError("LLMRouter requiere al menos un cliente")
+
+        load_dotenv()
+
+        if max_retries is None:
+            max_retries = int(os.getenv('LLM_MAX_RETRIES', self.DEFAULT_MAX_RETRIES))
+        if hedge_enabled is None:
+            hedge_enabled = os.getenv('LLM_HEDGE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+        self.clients = list(clients)
+        self.admission = admission
+        self.max_retries = max_retries
+        self.hedge_enabled = hedge_enabled and len(self.clients) > 1
+        self.backoff_base = float(os.getenv('LLM_RETRY_BACKOFF_BASE', self.DEFAULT_BACKOFF_BASE))
+        self.backoff_max = float(os.getenv('LLM_RETRY_BACKOFF_MAX', self.DEFAULT_BACKOFF_MAX))
+        self.hedge_percentile = float(os.getenv('LLM_HEDGE_PERCENTILE', self.DEFAULT_HEDGE_PERCENTILE))
+        self.hedge_min_seconds = float(os.getenv('LLM_HEDGE_MIN_MS', self.DEFAULT_HEDGE_MIN_MS)) / 1000
+        self.hedge_default_seconds = float(os.getenv('LLM_HEDGE_DEFAULT_MS', self.DEFAULT_HEDGE_DEFAULT_MS)) / 1000
+
+        failures = int(os.getenv('LLM_BREAKER_FAILURES', self.DEFAULT_BREAKER_FAILURES))
+        recovery = float(os.getenv('LLM_BREAKER_RECOVERY_SECONDS', self.DEFAULT_BREAKER_RECOVERY))
+
+        self.breakers = {name: CircuitBreaker(failures, recovery) for name, _ in self.clients}
+        # Latencia hasta la respuesta completa (sin stream) y hasta el primer token (stream)
+        self.completion_latency = {name: LatencyTracker() for name, _ in self.clients}
+        self.first_token_latency = {name: LatencyTracker() for name, _ in self.clients}
+
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            name: {'calls': 0, 'failures': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0}
+            for name, _ in self.clients
+        }
+        self.failovers = 0
+
+        self.metrics = get_metrics()
+        self.metrics.describe("llm_prompt_tokens", "Tokens de entrada (prompt) por llamada y proveedor")
+        self.metrics.describe("llm_completion_tokens", "Tokens generados por llamada y proveedor")
+
+    @property
+    def primary(self):
+        """Cliente del proveedor preferido"""
+        return self.clients[0][1]
+
+    @property
+    def model(self) -> str:
+        """Modelo del proveedor preferido"""
+        return self.primary.model
+
+    # ------------------------------------------------------------------
+    # Utilidades
+    # ------------------------------------------------------------------
+
+    def _count(self, provider: str, key: str):
+        with self._stats_lock:
+            self.stats[provider][key] += 1
+
+    def _failover(self, provider: str):
+        with self._stats_lock:
+            self.failovers += 1
+        logger.warning("llm.failover", f"Failover a {provider}", provider=provider)
+
+    def _client_kwargs(self, provider: str, kwargs: Dict) -> Dict:
+        """
+        Adapta los argumentos de la llamada a un proveedor
+
+        El argumento 'models' ({proveedor: modelo}) de la política de rutas
+        se traduce al argumento 'model' del cliente correspondiente, y el
+        callback on_usage se envuelve para registrar los tokens del
+        proveedor en los histogramas de Prometheus.
+        """
+        call_kwargs = {key: value for key, value in kwargs.items() if key != 'models'}
+        if 'models' in kwargs:
+            call_kwargs['model'] = (kwargs['models'] or {}).get(provider)
+
+        on_usage = kwargs.get('on_usage')
+
+        def record_usage(usage: Dict):
+            labels = {"provider": provider}
+            self.metrics.observe("llm_prompt_tokens", usage.get('prompt_tokens', 0), labels, SIZE_BUCKETS)
+            self.metrics.observe("llm_completion_tokens", usage.get('completion_tokens', 0), labels, SIZE_BUCKETS)
+            if on_usage is not None:
+                on_usage(usage)
+
+        call_kwargs['on_usage'] = record_usage
+        return call_kwargs
+
+    def _backoff_seconds(self, attempt: int) -> float:
+        """Backoff exponencial con 'full jitter' para el reintento número attempt (desde 0)"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _available(self) -> List[Tuple[str, object]]:
+        """
+        Proveedores cuyo circuito permite llamarlos, en orden de preferencia
+
+        Si todos están abiertos se devuelve el preferido igualmente: es
+        mejor intentar que fallar sin llamar a nadie.
+        """
+        available = [(name, client) for name, client in self.clients if self.breakers[name].allow()]
+        return available or self.clients[:1]
+
+    def _latency_tracker(self, provider: str, stream: bool) -> LatencyTracker:
+        return self.first_token_latency[provider] if stream else self.completion_latency[provider]
+
+    def hedge_delay(self, provider: str, stream: bool = False) -> float:
+        """
+        Tiempo que se espera a un proveedor antes de lanzar el hedge
+
+        Args:
+            provider: Nombre del proveedor
+            stream: True para el primer token de un stream, False para una respuesta completa
+
+        Returns:
+            p95 (configurable) de las latencias observadas en ese camino, o un
+            valor por defecto si todavía no hay suficientes muestras
+        """
+        tracker = self._latency_tracker(provider, stream)
+        if len(tracker) < self.MIN_SAMPLES_FOR_PERCENTILE:
+            return self.hedge_default_seconds
+        return max(self.hedge_min_seconds, tracker.percentile(self.hedge_percentile))
+
+    def _record_success(self, provider: str, seconds: float, stream: bool = False):
+        """Cierra el circuito y registra la latencia (respuesta completa o primer token del stream)"""
+        self.breakers[provider].record_success()
+        self._latency_tracker(provider, stream).record(seconds)
+
+    def _record_failure(self, provider: str, error: Exception):
+        self.breakers[provider].record_failure()
+        self._count(provider, 'failures')
+        logger.warning(
+            "llm.provider_failed", f"Falló {provider}: {str(error)}",
+            provider=provider, error_type=type(error).__name__
+        )
+
+    def _all_failed(self, errors: List[str], rejected: Optional[List[AdmissionRejected]] = None) -> Exception:
+        if rejected and len(rejected) == len(errors):
+            # Ningún proveedor falló: todos estaban saturados
+            return min(rejected, key=lambda rejection: rejection.retry_after)
+        return Exception(f"Todos los proveedores LLM fallaron: {'; '.join(errors)}")
+
+    @asynccontextmanager
+    async def _slot(self, provider: str):
+        """Ocupa un lugar en el límite de concurrencia del proveedor (si hay control de admisión)"""
+        if self.admission is None:
+            yield
+            return
+        async with self.admission.slot(f"llm:{provider}"):
+            yield
+
+    # ------------------------------------------------------------------
+    # Camino síncrono
+    # ------------------------------------------------------------------
+
+    def _call_with_failover(
+        self,
+        call: Callable[[str, object, Optional[float]], str],
+        timeout: Optional[float] = None
+    ) -> str:
+        """
+        Ejecuta call(proveedor, cliente, segundos restantes) con reintentos y failover entre proveedores
+
+        Args:
+            call: Función que recibe el nombre del proveedor, su cliente y los
+                segundos que quedan (None = sin límite) y devuelve la respuesta
+            timeout: Segundos para toda la llamada, reintentos y failover incluidos (None = sin límite)
+
+        Returns:
+            Respuesta del primer proveedor que responde
+
+        Raises:
+            TimeoutError: Si se agota timeout sin respuesta
+        """
+        expires = time.monotonic() + timeout if timeout is not None else None
+        errors = []
+
+        for position, (name, client) in enumerate(self._available()):
+            if position > 0:
+                self._failover(name)
+
+            for attempt in range(self.max_retries + 1):
+                if attempt > 0:
+                    self._count(name, 'retries')
+                    backoff = self._backoff_seconds(attempt - 1)
+                    if expires is not None:
+                        backoff = min(backoff, max(0.0, expires - time.monotonic()))
+                    time.sleep(backoff)
+
+                remaining = expires - time.monotonic() if expires is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"Tiempo agotado esperando al LLM ({timeout:.1f} s); errores: {errors}")
+
+                self._count(name, 'calls')
+                start = time.monotonic()
+                try:
+                    answer = call(name, client, remaining)
+                    self._record_success(name, time.monotonic() - start)
+                    return answer
+                except Exception as e:
+                    self._record_failure(name, e)
+                    errors.append(f"{name}: {str(e)}")
+
+                if not self.breakers[name].allow():
+                    break
+
+        raise self._all_failed(errors)
+
+    def generate_response(self, timeout: Optional[float] = None, **kwargs) -> str:
+        """
+        generate_response con failover (mismos argumentos que los clientes, más 'models')
+
+        Con timeout, cada llamada recibe los segundos que quedan y no se
+        reintenta ni se cambia de proveedor una vez agotados (TimeoutError).
+        """
+        return self._call_with_failover(
+            lambda name, client, remaining: client.generate_response(
+                **self._client_kwargs(name, kwargs), timeout=remaining
+            ),
+            timeout
+        )
+
+    def simple_chat(self, **kwargs) -> str:
+        """simple_chat con failover (mismos argumentos que los clientes)"""
+        return self._call_with_failover(lambda name, client, remaining: client.simple_chat(**kwargs))
+
+    def generate_response_stream(self, **kwargs) -> Iterator[str]:
+        """
+        generate_response_stream con failover
+
+        Solo se cambia de proveedor antes del primer token: una vez que la
+        respuesta empezó a llegar, un error se propaga al llamador.
+        """
+        errors = []
+
+        for position, (name, client) in enumerate(self._available()):
+            if position > 0:
+                self._failover(name)
+
+            for attempt in range(self.max_retries + 1):
+                if attempt > 0:
+                    self._count(name, 'retries')
+                    time.sleep(self._backoff_seconds(attempt - 1))
+
+                self._count(name, 'calls')
+                start = time.monotonic()
+                stream = client.generate_response_stream(**self._client_kwargs(name, kwargs))
+                try:
+                    first = next(stream)
+                except StopIteration:
+                    self._record_success(name, time.monotonic() - start, stream=True)
+                    return
+                except Exception as e:
+                    self._record_failure(name, e)
+                    errors.append(f"{name}: {str(e)}")
+                    if not self.breakers[name].allow():
+                        break
+                    continue
+
+                self._record_success(name, time.monotonic() - start, stream=True)
+                yield first
+                yield from stream
+                return
+
+        raise self._all_failed(errors)
+
+    # ------------------------------------------------------------------
+    # Camino asíncrono (con hedging)
+    # ------------------------------------------------------------------
+
+    async def _attempt_async(self, name: str, client, kwargs: Dict) -> str:
+        """Llama a un proveedor con reintentos; registra éxito y fallos"""
+        last_error = None
+
+        async with self._slot(name):
+            for attempt in range(self.max_retries + 1):
+                if attempt > 0:
+                    self._count(name, 'retries')
+                    await asyncio.sleep(self._backoff_seconds(attempt - 1))
+
+                self._count(name, 'calls')
+                start = time.monotonic()
+                try:
+                    answer = await client.agenerate_response(**self._client_kwargs(name, kwargs))
+                    self._record_success(name, time.monotonic() - start)
+                    return answer
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self._record_failure(name, e)
+                    last_error = e
+
+                if not self.breakers[name].allow():
+                    break
+
+        raise Exception(f"{name}: {str(last_error)}")
+
+    async def agenerate_response(self, **kwargs) -> str:
+        """
+        agenerate_response con failover y hedging
+
+        Sin hedging, los proveedores se prueban uno tras otro. Con hedging,
+        si el proveedor actual no respondió dentro de su deadline (p95), se
+        lanza también el siguiente y gana el primero que responda bien.
+        """
+        providers = self._available()
+        errors = []
+        rejected = []  # Proveedores con la cola llena (no cuentan como fallo)
+        pending = {}  # {task: nombre del proveedor}
+
+        async def launch(index: int):
+            name, client = providers[index]
+            task = asyncio.ensure_future(self._attempt_async(name, client, kwargs))
+            pending[task] = name
+
+        next_index = 0
+        await launch(next_index)
+        next_index += 1
+
+        try:
+            while pending:
+                can_hedge = self.hedge_enabled and next_index < len(providers)
+                timeout = self.hedge_delay(providers[next_index - 1][0]) if can_hedge else None
+
+                done, _ = await asyncio.wait(
+                    list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    # Deadline vencido: lanzar el hedge sin cancelar el original
+                    self._count(providers[next_index - 1][0], 'hedges')
+                    logger.info(
+                        "llm.hedge", f"Hedge: lanzando {providers[next_index][0]}",
+                        provider=providers[next_index][0], slow_provider=providers[next_index - 1][0], stream=False
+                    )
+                    await launch(next_index)
+                    next_index += 1
+                    continue
+
+                for task in done:
+                    name = pending.pop(task)
+                    try:
+                        answer = task.result()
+                    except AdmissionRejected as e:
+                        rejected.append(e)
+                        errors.append(str(e))
+                        continue
+                    except Exception as e:
+                        errors.append(str(e))
+                        continue
+
+                    if pending:
+                        # Ganó la carrera contra otra petición en curso
+                        self._count(name, 'hedge_wins')
+                    return answer
+
+                # Todos los terminados fallaron: pasar al siguiente proveedor
+                if not pending and next_index < len(providers):
+                    self._failover(providers[next_index][0])
+                    await launch(next_index)
+                    next_index += 1
+
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise self._all_failed(errors, rejected)
+
+    async def _limited_stream(self, name: str, client, kwargs: Dict) -> AsyncIterator[str]:
+        """Stream de un proveedor que ocupa su lugar de concurrencia hasta terminar"""
+        async with self._slot(name):
+            async for token in client.agenerate_response_stream(**self._client_kwargs(name, kwargs)):
+                yield token
+
+    @staticmethod
+    async def _close_stream(stream):
+        try:
+            await stream.aclose()
+        except Exception:
+            pass
+
+    async def _first_token_async(self, name: str, client, kwargs: Dict) -> Tuple[AsyncIterator[str], Optional[str]]:
+        """
+        Abre el stream de un proveedor con reintentos hasta recibir el primer token
+
+        Returns:
+            Tupla (stream abierto, primer token; None si la respuesta vino vacía)
+        """
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self._count(name, 'retries')
+                await asyncio.sleep(self._backoff_seconds(attempt - 1))
+
+            self._count(name, 'calls')
+            start = time.monotonic()
+            stream = self._limited_stream(name, client, kwargs).__aiter__()
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except (asyncio.CancelledError, AdmissionRejected):
+                await self._close_stream(stream)
+                raise
+            except Exception as e:
+                self._record_failure(name, e)
+                last_error = e
+                if not self.breakers[name].allow():
+                    break
+                continue
+
+            self._record_success(name, time.monotonic() - start, stream=True)
+            return stream, first
+
+        raise Exception(f"{name}: {str(last_error)}")
+
+    async def agenerate_response_stream(self, **kwargs) -> AsyncIterator[str]:
+        """
+        agenerate_response_stream con failover y hedging sobre el primer token
+
+        Se abre el stream del proveedor preferido (con reintentos hasta el
+        primer token); si el primer token no llega antes de su deadline (p95),
+        se abre también el del siguiente proveedor y se continúa con el que
+        entregue primero. Después del primer token no se cambia de proveedor.
+        """
+        providers = self._available()
+        errors = []
+        rejected = []
+        streams = {}  # {task del primer token: nombre del proveedor}
+
+        def open_stream(index: int):
+            name, client = providers[index]
+            task = asyncio.ensure_future(self._first_token_async(name, client, kwargs))
+            streams[task] = name
+
+        next_index = 0
+        open_stream(next_index)
+        next_index += 1
+        winner = None
+
+        try:
+            while streams and winner is None:
+                can_hedge = self.hedge_enabled and next_index < len(providers)
+                timeout = self.hedge_delay(providers[next_index - 1][0], stream=True) if can_hedge else None
+
+                done, _ = await asyncio.wait(
+                    list(streams), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    self._count(providers[next_index - 1][0], 'hedges')
+                    logger.info(
+                        "llm.hedge", f"Hedge: lanzando {providers[next_index][0]}",
+                        provider=providers[next_index][0], slow_provider=providers[next_index - 1][0], stream=True
+                    )
+                    open_stream(next_index)
+                    next_index += 1
+                    continue
+
+                for task in done:
+                    name = streams.pop(task)
+                    try:
+                        stream, first = task.result()
+                    except AdmissionRejected as e:
+                        rejected.append(e)
+                        errors.append(f"{name}: {str(e)}")
+                        continue
+                    except Exception as e:
+                        errors.append(str(e))
+                        continue
+
+                    if winner is None:
+                        if streams:
+                            self._count(name, 'hedge_wins')
+                        winner = (stream, first)
+                    else:
+                        await self._close_stream(stream)
+
+                if winner is None and not streams and next_index < len(providers):
+                    self._failover(providers[next_index][0])
+                    open_stream(next_index)
+                    next_index += 1
+
+        finally:
+            # Descartar los streams que perdieron la carrera
+            for task in streams:
+                task.cancel()
+            losers = await asyncio.gather(*streams, return_exceptions=True)
+            for result in losers:
+                if isinstance(result, tuple):
+                    await self._close_stream(result[0])
+
+        if winner is None:
+            raise self._all_failed(errors, rejected)
+
+        stream, first = winner
+        if first is None:
+            return
+
+        yield first
+        async for token in stream:
+            yield token
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas del router
+
+        Returns:
+            Diccionario con estado del circuito, p95 de la respuesta completa y del
+            primer token, esperas de hedging y contadores por proveedor
+        """
+        with self._stats_lock:
+            providers = {name: dict(counters) for name, counters in self.stats.items()}
+            failovers = self.failovers
+
+        def p95_ms(tracker: LatencyTracker) -> Optional[int]:
+            p95 = tracker.percentile(95)
+            return round(p95 * 1000) if p95 is not None else None
+
+        for name in providers:
+            providers[name].update({
+                'circuit': self.breakers[name].state,
+                'completion_p95_ms': p95_ms(self.completion_latency[name]),
+                'first_token_p95_ms': p95_ms(self.first_token_latency[name]),
+                'hedge_delay_ms': round(self.hedge_delay(name) * 1000),
+                'stream_hedge_delay_ms': round(self.hedge_delay(name, stream=True) * 1000)
+            })
+
+        return {
+            'order': [name for name, _ in self.clients],
+            'hedge_enabled': self.hedge_enabled,
+            'failovers': failovers,
+            'providers': providers
+        }
+
+
+if __name__ == "__main__":
+    # Test del router con clientes simulados (sin llamadas reales)
+
+    class FakeClient:
+        def __init__(self, model: str, delay: float, fail: bool = False):
+            self.model = model
+            self.delay = delay
+            self.fail = fail
+
+        def generate_response(self, **kwargs) -> str:
+            time.sleep(self.delay)
+            if self.fail:
+                raise Exception("error simulado")
+            return f"respuesta de {self.model}"
+
+        async def agenerate_response(self, **kwargs) -> str:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                raise Exception("error simulado")
+            return f"respuesta de {self.model}"
+
+        async def agenerate_response_stream(self, **kwargs) -> AsyncIterator[str]:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                raise Exception("error simulado")
+            for token in ["respuesta ", "de ", self.model]:
+                yield token
+
+    os.environ.setdefault('LLM_RETRY_BACKOFF_BASE', '0.01')
+    os.environ.setdefault('LLM_HEDGE_DEFAULT_MS', '200')
+
+    # Failover: el primario falla y se abre su circuito
+    router = LLMRouter([("deepseek", FakeClient("deepseek-chat", 0.0, fail=True)),
+                        ("groq", FakeClient("llama", 0.0))])
+    for _ in range(3):
+        print(f"Failover: {router.generate_response(query='hola')}")
+    print(f"Circuito deepseek: {router.breakers['deepseek'].state}")
+
+    # Hedging: el primario es lento, el hedge gana
+    router = LLMRouter([("deepseek", FakeClient("deepseek-chat", 2.0)),
+                        ("groq", FakeClient("llama", 0.05))], hedge_enabled=True)
+
+    async def main():
+        start = time.monotonic()
+        answer = await router.agenerate_response(query="hola")
+        print(f"Hedge: {answer} en {time.monotonic() - start:.2f}s")
+
+        start = time.monotonic()
+        tokens = [token async for token in router.agenerate_response_stream(query="hola")]
+        print(f"Hedge (stream): {''.join(tokens)} en {time.monotonic() - start:.2f}s")
+
+    asyncio.run(main())
+    print(f"Stats: {router.get_stats()}")
+
+    # Respuestas completas lentas no alargan la espera del hedge de los streams
+    for _ in range(LLMRouter.MIN_SAMPLES_FOR_PERCENTILE):
+        router._record_success("groq", 3.0)
+        router._record_success("groq", 0.6, stream=True)
+    print(f"Espera de hedge groq: completa {router.hedge_delay('groq'):.1f}s, "
+          f"stream {router.hedge_delay('groq', stream=True):.1f}s")
+    assert router.hedge_delay('groq') > router.hedge_delay('groq', stream=True)
+
+    # Stream asíncrono: un error transitorio antes del primer token se reintenta sin failover
+    class FlakyStreamClient(FakeClient):
+        def __init__(self, model: str, failures: int):
+            super().__init__(model, 0.0)
+            self.failures = failures
+
+        async def agenerate_response_stream(self, **kwargs) -> AsyncIterator[str]:
+            if self.failures:
+                self.failures -= 1
+                raise Exception("429 simulado")
+            async for token in super().agenerate_response_stream(**kwargs):
+                yield token
+
+    async def collect(router: LLMRouter) -> str:
+        return "".join([token async for token in router.agenerate_response_stream(query="hola")])
+
+    router = LLMRouter([("deepseek", FlakyStreamClient("deepseek-chat", failures=1)),
+                        ("groq", FakeClient("llama", 0.0))], max_retries=2)
+    answer = asyncio.run(collect(router))
+    print(f"Stream con reintento: {answer} (reintentos: {router.get_stats()['providers']['deepseek']['retries']})")
+    assert answer == "respuesta de deepseek-chat" and router.get_stats()['failovers'] == 0
+
+    # Circuito semiabierto: una sola llamada de prueba a la vez
+    breaker = CircuitBreaker(failure_threshold=1, recovery_seconds=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    probes = [breaker.allow() for _ in range(5)]
+    print(f"Semiabierto, llamadas permitidas: {probes}")
+    assert probes == [True, False, False, False, False]
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+    print("OK")
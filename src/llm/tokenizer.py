@@ -0,0 +1,107 @@
+"""
+Módulo para contar tokens con el tokenizer del modelo de destino
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import os
+import threading
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from ingestion.markdown_chunker import approximate_token_count
+
+
+# Repositorios públicos de Hugging Face con el tokenizer de cada modelo
+TOKENIZER_REPOS = {
+    "llama-3.3-70b-versatile": "unsloth/Llama-3.3-70B-Instruct",
+    "llama-3.1-8b-instant": "unsloth/Llama-3.1-8B-Instruct",
+    "deepseek-chat": "deepseek-ai/DeepSeek-V3",
+}
+
+
+class TokenCounter:
+    """
+    Cuenta tokens con el tokenizer del modelo (paquete tokenizers de Hugging Face).
+
+    Si el tokenizer no se puede cargar (sin red, paquete no instalado o
+    modelo desconocido) usa approximate_token_count como respaldo.
+    """
+
+    def __init__(self, model: str, repo: Optional[str] = None, enabled: Optional[bool] = None):
+        """
+        Inicializa el contador
+
+        Args:
+            model: Nombre del modelo de LLM
+            repo: Repositorio del tokenizer (default: TOKENIZER_REPOS[model])
+            enabled: Si es False, usa siempre la aproximación (LLM_TOKENIZER_ENABLED)
+        """
+        load_dotenv()
+
+        if enabled is None:
+            enabled = os.getenv('LLM_TOKENIZER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+        self.model = model
+        self.repo = repo or TOKENIZER_REPOS.get(model)
+        self.tokenizer = None
+
+        if enabled and self.repo:
+            try:
+                from tokenizers import Tokenizer
+                self.tokenizer = Tokenizer.from_pretrained(self.repo)
+                print(f"🔤 Tokenizer de {model} cargado ({self.repo})")
+            except Exception as e:
+                print(f"⚠️  No se pudo cargar el tokenizer de {model}, se usará una aproximación: {str(e)}")
+
+    @property
+    def exact(self) -> bool:
+        """True si se usa el tokenizer real del modelo"""
+        return self.tokenizer is not None
+
+    def count(self, text: str) -> int:
+        """
+        Cuenta los tokens de un texto
+
+        Args:
+            text: Texto a medir
+
+        Returns:
+            Número de tokens (sin tokens especiales)
+        """
+        if not text:
+            return 0
+        if self.tokenizer is None:
+            return approximate_token_count(text)
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    """
+    Obtiene el contador de tokens de un modelo (se carga una sola vez por proceso)
+
+    Args:
+        model: Nombre del modelo de LLM
+
+    Returns:
+        TokenCounter compartido
+    """
+    with _counters_lock:
+        if model not in _counters:
+            _counters[model] = TokenCounter(model)
+        return _counters[model]
+
+
+if __name__ == "__main__":
+    # Test del contador
+    text = "La Vicerrectoría de Orientación y Asuntos Estudiantiles (VOAE) administra las becas de la UNAH."
+
+    for model in TOKENIZER_REPOS:
+        counter = get_token_counter(model)
+        print(f"{model}: {counter.count(text)} tokens ({'exacto' if counter.exact else 'aproximado'})")
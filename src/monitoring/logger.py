@@ -0,0 +1,272 @@
+"""
+Módulo de logging estructurado: eventos con nivel y campos, formateados
+como JSON y escritos por un hilo propio (QueueHandler + QueueListener)
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import os
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from monitoring.tracing import get_tracer
+
+
+ROOT_LOGGER = "rag"
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por evento: ts, level, logger, event, msg y los campos del evento"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "msg": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legible para la consola: hora, nivel, mensaje y campos clave=valor"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{key}={value}" for key, value in getattr(record, "fields", {}).items())
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:7} {record.getMessage()}"
+        if fields:
+            line = f"{line}  [{fields}]"
+        if record.exc_text:
+            line = f"{line}\n{record.exc_text}"
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Deja pasar solo una fracción de los eventos configurados en LOG_SAMPLE_RATES
+    (ej: "retrieval.document=0.01"). Los demás eventos pasan siempre.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        """
+        Args:
+            rates: {evento: fracción entre 0 y 1}
+        """
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(getattr(record, "event", None))
+        return rate is None or random.random() < rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler con cola acotada: si el hilo escritor no da abasto, el
+    evento se descarta (y se cuenta) en lugar de bloquear la petición
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El formateo (JSON) queda para el hilo escritor; aquí solo se
+        # resuelven el mensaje y la traza de la excepción, que no deben
+        # cruzar de hilo como referencias a objetos de la petición
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class EventLogger:
+    """
+    Logger de eventos: cada llamada lleva un nombre de evento estable
+    ('query.start', 'retrieval.document', ...), un mensaje y campos.
+
+    El nivel se comprueba antes de armar el registro, así que un evento
+    desactivado solo cuesta la llamada. Si hay una traza activa, el
+    evento incluye su trace_id para relacionarlo con los spans.
+    """
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: Nombre del logger ('rag.pipeline', 'rag.retriever', ...)
+        """
+        self._logger = logging.getLogger(name)
+
+    def is_enabled_for(self, level: int) -> bool:
+        """Indica si el nivel está activo (para evitar preparar campos costosos)"""
+        return self._logger.isEnabledFor(level)
+
+    def log(self, level: int, event: str, message: str, exc_info=None, **fields):
+        """
+        Registra un evento
+
+        Args:
+            level: Nivel de logging (logging.DEBUG, logging.INFO, ...)
+            event: Nombre del evento (clave para el muestreo)
+            message: Mensaje legible
+            exc_info: Excepción a incluir (opcional)
+            **fields: Campos estructurados del evento
+        """
+        if not self._logger.isEnabledFor(level):
+            return
+        trace = get_tracer().current()
+        if trace is not None:
+            fields.setdefault("trace_id", trace.trace_id)
+        self._logger.log(level, message, exc_info=exc_info, extra={"event": event, "fields": fields})
+
+    def debug(self, event: str, message: str, **fields):
+        self.log(logging.DEBUG, event, message, **fields)
+
+    def info(self, event: str, message: str, **fields):
+        self.log(logging.INFO, event, message, **fields)
+
+    def warning(self, event: str, message: str, **fields):
+        self.log(logging.WARNING, event, message, **fields)
+
+    def error(self, event: str, message: str, exc_info=None, **fields):
+        self.log(logging.ERROR, event, message, exc_info=exc_info, **fields)
+
+
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_configure_lock = threading.Lock()
+
+
+def configure_logging(
+    level: Optional[str] = None,
+    log_format: Optional[str] = None,
+    sample_rates: Optional[Dict[str, float]] = None,
+    queue_size: Optional[int] = None
+):
+    """
+    Configura el logger 'rag' una sola vez por proceso (los valores omitidos se leen de .env)
+
+    Args:
+        level: Nivel mínimo: debug, info, warning o error (LOG_LEVEL)
+        log_format: 'json' o 'text' (LOG_FORMAT)
+        sample_rates: Fracción de eventos a conservar por evento
+            (LOG_SAMPLE_RATES, ej: "retrieval.document=0.01,query.step=0.1")
+        queue_size: Eventos en espera como máximo antes de descartar (LOG_QUEUE_SIZE)
+    """
+    global _handler, _listener
+
+    with _configure_lock:
+        if _handler is not None:
+            return
+
+        load_dotenv()
+
+        if level is None:
+            level = os.getenv('LOG_LEVEL', 'info')
+        if log_format is None:
+            log_format = os.getenv('LOG_FORMAT', 'json')
+        if sample_rates is None:
+            sample_rates = {}
+            for item in os.getenv('LOG_SAMPLE_RATES', '').split(','):
+                if '=' in item:
+                    event, rate = item.split('=', 1)
+                    sample_rates[event.strip()] = float(rate)
+        if queue_size is None:
+            queue_size = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(TextFormatter() if log_format.lower() == 'text' else JsonFormatter())
+
+        # El filtro de muestreo corre en el hilo de la petición, antes de encolar
+        _handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        _handler.addFilter(SamplingFilter(sample_rates))
+
+        logger = logging.getLogger(ROOT_LOGGER)
+        logger.setLevel(level.upper())
+        logger.addHandler(_handler)
+        logger.propagate = False
+
+        _listener = logging.handlers.QueueListener(_handler.queue, output)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Escribe los eventos pendientes y detiene el hilo escritor"""
+    global _listener
+
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name: str) -> EventLogger:
+    """
+    Obtiene un logger de eventos (configura el logging la primera vez)
+
+    Args:
+        name: Nombre bajo 'rag' ('rag.pipeline', 'rag.retriever', ...)
+
+    Returns:
+        EventLogger
+    """
+    configure_logging()
+    return EventLogger(name)
+
+
+def get_logging_stats() -> Dict:
+    """
+    Obtiene estadísticas del logging
+
+    Returns:
+        Diccionario con nivel, eventos en cola y eventos descartados
+    """
+    if _handler is None:
+        return {'configured': False}
+    return {
+        'configured': True,
+        'level': logging.getLevelName(logging.getLogger(ROOT_LOGGER).level).lower(),
+        'queued': _handler.queue.qsize(),
+        'dropped': _handler.dropped
+    }
+
+
+if __name__ == "__main__":
+    # Test: eventos de varios niveles con muestreo del evento de depuración
+    configure_logging(level="debug", sample_rates={"retrieval.document": 0.2})
+    log = get_logger("rag.test")
+
+    log.info("query.start", "Procesando consulta", question="¿Qué becas hay?")
+    for rank in range(1, 21):
+        log.debug("retrieval.document", "Documento recuperado", rank=rank, filename=f"doc_{rank}.md")
+    log.warning("deadline.degraded", "Degradación por presupuesto de latencia", degradation="fast_model")
+    try:
+        1 / 0
+    except ZeroDivisionError as e:
+        log.error("query.error", f"Error: {e}", exc_info=e)
+
+    shutdown_logging()
+    print(get_logging_stats())
@@ -0,0 +1,247 @@
+"""
+Módulo de métricas en memoria del proceso (contadores, gauges e histogramas
+con etiquetas) y su exposición en formato de texto de Prometheus
+"""
+import os
+import sys
+import math
+import bisect
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+
+# Límites superiores de los buckets de latencia, en segundos
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Buckets para tamaños (lotes de embeddings, tokens)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas compartido por todos los componentes del proceso.
+
+    Cada serie se identifica por nombre y etiquetas, por ejemplo
+    inc("rag_coalesced_requests_total", labels={"mode": "async"}).
+
+    - Contadores (inc): solo crecen.
+    - Gauges (set_gauge): valor actual, por ejemplo la memoria del proceso.
+    - Histogramas (observe): cantidad de observaciones por bucket, suma y
+      total; de ellos se calculan percentiles en Prometheus.
+    """
+
+    def __init__(self):
+        """Inicializa un registro vacío"""
+        self._lock = threading.Lock()
+        self._counters = {}  # {nombre: {etiquetas (tupla ordenada): valor}}
+        self._gauges = {}  # {nombre: {etiquetas: valor}}
+        self._histograms = {}  # {nombre: (buckets, {etiquetas: [conteos por bucket, suma, total]})}
+        self._help = {}  # {nombre: descripción}
+
+    @staticmethod
+    def _label_key(labels: Optional[Dict[str, str]]) -> Tuple:
+        return tuple(sorted((labels or {}).items()))
+
+    def describe(self, name: str, help_text: str):
+        """
+        Registra la descripción de una métrica
+
+        Args:
+            name: Nombre de la métrica
+            help_text: Descripción legible
+        """
+        with self._lock:
+            self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, labels: Optional[Dict[str, str]] = None):
+        """
+        Incrementa un contador
+
+        Args:
+            name: Nombre de la métrica (terminado en _total por convención)
+            value: Incremento
+            labels: Etiquetas de la serie (opcional)
+        """
+        key = self._label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
+        """
+        Fija el valor actual de un gauge
+
+        Args:
+            name: Nombre de la métrica
+            value: Valor actual
+            labels: Etiquetas de la serie (opcional)
+        """
+        key = self._label_key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = float(value)
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        labels: Optional[Dict[str, str]] = None,
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        """
+        Registra una observación en un histograma
+
+        Args:
+            name: Nombre de la métrica (terminado en la unidad: _seconds, _tokens, ...)
+            value: Valor observado
+            labels: Etiquetas de la serie (opcional)
+            buckets: Límites superiores de los buckets (se fijan con la primera observación)
+        """
+        key = self._label_key(labels)
+        with self._lock:
+            bounds, series = self._histograms.setdefault(name, (tuple(buckets), {}))
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [[0] * len(bounds), 0.0, 0]
+            index = bisect.bisect_left(bounds, value)
+            if index < len(bounds):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def get_counter(self, name: str, labels: Optional[Dict[str, str]] = None) -> float:
+        """
+        Obtiene el valor actual de un contador
+
+        Returns:
+            Valor del contador (0 si no existe)
+        """
+        with self._lock:
+            return self._counters.get(name, {}).get(self._label_key(labels), 0.0)
+
+    def snapshot(self) -> Dict:
+        """
+        Obtiene todos los contadores
+
+        Returns:
+            {nombre: {"etiqueta=valor,...": valor}}
+        """
+        with self._lock:
+            return {
+                name: {
+                    ",".join(f"{label}={value}" for label, value in key): total
+                    for key, total in series.items()
+                }
+                for name, series in self._counters.items()
+            }
+
+    @staticmethod
+    def _format_labels(key: Tuple, extra: Optional[Tuple] = None) -> str:
+        """Etiquetas en el formato de Prometheus ({a="1",b="2"}), con \\, " y saltos de línea escapados"""
+        pairs = list(key) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = []
+        for label, value in pairs:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{label}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    @staticmethod
+    def _format_value(value: float) -> str:
+        value = float(value)
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return str(int(value)) if value.is_integer() else repr(value)
+
+    def render_prometheus(self) -> str:
+        """
+        Exporta todas las métricas en el formato de texto de Prometheus (0.0.4)
+
+        Returns:
+            Texto para el endpoint /metrics
+        """
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+            histograms = {
+                name: (bounds, {key: (list(state[0]), state[1], state[2]) for key, state in series.items()})
+                for name, (bounds, series) in self._histograms.items()
+            }
+            help_texts = dict(self._help)
+
+        lines = []
+
+        def header(name: str, metric_type: str):
+            if name in help_texts:
+                lines.append(f"# HELP {name} {help_texts[name]}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        for name in sorted(counters):
+            header(name, "counter")
+            for key, value in counters[name].items():
+                lines.append(f"{name}{self._format_labels(key)} {self._format_value(value)}")
+
+        for name in sorted(gauges):
+            header(name, "gauge")
+            for key, value in gauges[name].items():
+                lines.append(f"{name}{self._format_labels(key)} {self._format_value(value)}")
+
+        for name in sorted(histograms):
+            bounds, series = histograms[name]
+            header(name, "histogram")
+            for key, (counts, total_sum, count) in series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(bounds, counts):
+                    cumulative += bucket_count
+                    le = self._format_labels(key, ("le", self._format_value(bound)))
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(key, ('le', '+Inf'))} {count}")
+                lines.append(f"{name}_sum{self._format_labels(key)} {self._format_value(total_sum)}")
+                lines.append(f"{name}_count{self._format_labels(key)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def process_rss_bytes() -> Optional[int]:
+    """
+    Memoria residente (RSS) actual del proceso
+
+    Returns:
+        Bytes, o None si no se puede medir en esta plataforma
+    """
+    try:
+        with open('/proc/self/statm', encoding='ascii') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Sin /proc solo se conoce el máximo alcanzado (KB en Linux, bytes en macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """
+    Obtiene el registro de métricas del proceso
+
+    Returns:
+        MetricsRegistry compartido
+    """
+    return _registry
+
+
+if __name__ == "__main__":
+    # Test: exposición de un contador, un gauge y un histograma
+    registry = MetricsRegistry()
+    registry.describe("rag_request_duration_seconds", "Duración de las peticiones")
+    registry.inc("rag_degradations_total", labels={"degradation": "fast_model"})
+    registry.set_gauge("process_resident_memory_bytes", process_rss_bytes() or 0)
+    for seconds in (0.08, 0.3, 0.4, 1.7, 45.0):
+        registry.observe("rag_request_duration_seconds", seconds, labels={"operation": "POST /chat"})
+    print(registry.render_prometheus())
@@ -0,0 +1,345 @@
+"""
+Módulo de profiling bajo demanda: perfila una sola petición (pedida con un
+token de administración) y guarda el resultado por id de petición
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import os
+import re
+import hmac
+import time
+import asyncio
+import cProfile
+import threading
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from monitoring.logger import get_logger
+
+logger = get_logger("rag.profiler")
+
+
+class StackSampler:
+    """
+    Profiler de muestreo: un hilo toma cada interval_ms la pila de todos los
+    hilos del proceso (sys._current_frames) y cuenta las pilas repetidas.
+
+    Los hilos en espera (selector del event loop, colas o locks de los
+    executors) no se cuentan: el resultado muestra en qué se gasta la CPU.
+    El formato de salida es el de pilas colapsadas ("hilo;f1;f2 N"), que
+    leen flamegraph.pl, speedscope o inferno.
+    """
+
+    # Funciones de espera: si la pila termina en una de ellas el hilo está ocioso
+    IDLE_FUNCTIONS = {
+        ("selectors.py", "select"), ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+        ("queue.py", "get"), ("thread.py", "_worker")
+    }
+
+    def __init__(self, interval_ms: float):
+        """
+        Args:
+            interval_ms: Milisegundos entre muestras
+        """
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def available() -> bool:
+        """Indica si el intérprete permite leer las pilas de otros hilos"""
+        return hasattr(sys, "_current_frames")
+
+    @staticmethod
+    def _label(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+    def _sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            code = frame.f_code
+            if (Path(code.co_filename).name, code.co_name) in self.IDLE_FUNCTIONS:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        """Empieza a muestrear en un hilo propio"""
+        self._thread = threading.Thread(target=self._run, name="rag-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Detiene el muestreo"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        """
+        Pilas colapsadas, una por línea ("hilo;función (archivo:línea);... muestras")
+
+        Returns:
+            Texto para un generador de flamegraphs
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler:
+    """
+    Perfila peticiones individuales cuando traen el token de PROFILE_TOKEN.
+
+    Por cada petición perfilada se guardan en PROFILE_DIR:
+    - <id>.pstats: cProfile del hilo del event loop (python -m pstats, snakeviz)
+    - <id>.collapsed.txt: pilas colapsadas del profiler de muestreo (todos
+      los hilos: event loop, executor de CPU y threadpool), para un flamegraph
+
+    Si el intérprete no permite el muestreo solo se guarda el cProfile.
+    Se perfila una petición a la vez (cProfile no admite dos sesiones
+    simultáneas); mientras tanto, las demás peticiones con token se atienden
+    sin perfilar. Sin token no se hace ningún trabajo extra.
+
+    Ambos perfiles cubren el proceso entero durante la petición, no solo
+    la petición: el cProfile mide todo lo que corre en el hilo del event
+    loop (también las corrutinas de otras peticiones en curso) y el
+    muestreo ve todos los hilos. Con tráfico concurrente, el trabajo de
+    las demás peticiones aparece mezclado con el de la perfilada.
+    """
+
+    DEFAULT_DIR = "data/profiles"
+    DEFAULT_INTERVAL_MS = 5
+    DEFAULT_KEEP = 50
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        directory: Optional[str] = None,
+        interval_ms: Optional[float] = None,
+        keep: Optional[int] = None
+    ):
+        """
+        Inicializa el profiler (los valores omitidos se leen de .env)
+
+        Args:
+            token: Token de administración que activa el profiling (PROFILE_TOKEN; vacío = desactivado)
+            directory: Carpeta de los perfiles (PROFILE_DIR)
+            interval_ms: Milisegundos entre muestras del profiler de muestreo (PROFILE_INTERVAL_MS)
+            keep: Perfiles que se conservan; los más viejos se borran (PROFILE_KEEP)
+        """
+        load_dotenv()
+
+        if token is None:
+            token = os.getenv('PROFILE_TOKEN', '')
+        if directory is None:
+            directory = os.getenv('PROFILE_DIR', self.DEFAULT_DIR)
+        if interval_ms is None:
+            interval_ms = float(os.getenv('PROFILE_INTERVAL_MS', self.DEFAULT_INTERVAL_MS))
+        if keep is None:
+            keep = int(os.getenv('PROFILE_KEEP', self.DEFAULT_KEEP))
+
+        self.token = token
+        self.directory = Path(directory)
+        self.interval_ms = interval_ms
+        self.keep = max(1, keep)
+
+        self._busy = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.profiled = 0
+        self.skipped_busy = 0
+
+    @property
+    def enabled(self) -> bool:
+        """El profiling está disponible solo si hay un token configurado"""
+        return bool(self.token)
+
+    def authorized(self, token: Optional[str]) -> bool:
+        """
+        Comprueba el token de una petición (comparación en tiempo constante)
+
+        Args:
+            token: Token del header o del parámetro de la petición
+
+        Returns:
+            True si la petición se debe perfilar
+        """
+        # En bytes: compare_digest no admite str con caracteres no ASCII
+        return self.enabled and token is not None and hmac.compare_digest(
+            token.encode("utf-8"), self.token.encode("utf-8")
+        )
+
+    @staticmethod
+    def _safe_id(request_id: str) -> str:
+        """Id usable como nombre de archivo"""
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', request_id)[:128]
+
+    def _prune(self):
+        """Borra los perfiles más viejos por encima de keep"""
+        profiles = sorted(self.directory.glob("*.pstats"), key=lambda path: path.stat().st_mtime)
+        for path in profiles[:-self.keep]:
+            path.unlink(missing_ok=True)
+            path.with_name(path.name[:-len(".pstats")] + ".collapsed.txt").unlink(missing_ok=True)
+
+    @asynccontextmanager
+    async def profile(self, request_id: str) -> AsyncIterator[Optional[Dict]]:
+        """
+        Context manager asíncrono: perfila el bloque y guarda los archivos al salir
+
+        Debe usarse desde el event loop (el cProfile mide ese hilo). Los
+        archivos se escriben en un hilo aparte para no bloquear el loop.
+
+        Args:
+            request_id: Id de la petición (nombre de los archivos)
+
+        Yields:
+            Diccionario que al salir del bloque tiene id, archivos, muestras y
+            duración; None si otra petición se está perfilando
+        """
+        if not self._busy.acquire(blocking=False):
+            with self._stats_lock:
+                self.skipped_busy += 1
+            yield None
+            return
+
+        info = {"id": self._safe_id(request_id)}
+        sampler = StackSampler(self.interval_ms) if StackSampler.available() else None
+        profiler = cProfile.Profile()
+        started = time.monotonic()
+        try:
+            if sampler is not None:
+                sampler.start()
+            profiler.enable()
+            try:
+                yield info
+            finally:
+                # También se guarda el perfil de una petición que falló
+                profiler.disable()
+                if sampler is not None:
+                    sampler.stop()
+                info["duration_ms"] = round((time.monotonic() - started) * 1000, 1)
+                await asyncio.to_thread(self._save, info, profiler, sampler)
+        finally:
+            self._busy.release()
+
+    def _save(self, info: Dict, profiler: cProfile.Profile, sampler: Optional[StackSampler]):
+        """Escribe los archivos del perfil y completa info con sus rutas"""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            pstats_path = self.directory / f"{info['id']}.pstats"
+            profiler.dump_stats(str(pstats_path))
+            info["pstats"] = str(pstats_path)
+
+            if sampler is not None:
+                collapsed_path = self.directory / f"{info['id']}.collapsed.txt"
+                collapsed_path.write_text(sampler.collapsed(), encoding="utf-8")
+                info["collapsed"] = str(collapsed_path)
+                info["samples"] = sampler.samples
+
+            self._prune()
+        except OSError as e:
+            logger.error("profile.save_error", f"No se pudo guardar el perfil: {e}", exc_info=e, profile_id=info["id"])
+            return
+
+        with self._stats_lock:
+            self.profiled += 1
+        logger.info(
+            "profile.saved", f"Perfil guardado: {pstats_path}",
+            profile_id=info["id"], duration_ms=info["duration_ms"], samples=info.get("samples")
+        )
+
+    def list_profiles(self) -> List[str]:
+        """
+        Ids de los perfiles guardados, del más nuevo al más viejo
+
+        Returns:
+            Lista de ids
+        """
+        if not self.directory.exists():
+            return []
+        profiles = sorted(self.directory.glob("*.pstats"), key=lambda path: path.stat().st_mtime, reverse=True)
+        return [path.name[:-len(".pstats")] for path in profiles]
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas del profiler
+
+        Returns:
+            Diccionario con estado, carpeta, peticiones perfiladas y omitidas por estar ocupado
+        """
+        with self._stats_lock:
+            return {
+                'enabled': self.enabled,
+                'directory': str(self.directory),
+                'sampling': StackSampler.available(),
+                'profiled': self.profiled,
+                'skipped_busy': self.skipped_busy
+            }
+
+
+_profiler: Optional[RequestProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> RequestProfiler:
+    """
+    Obtiene el profiler compartido del proceso
+
+    Returns:
+        RequestProfiler único (una sesión de profiling a la vez por proceso)
+    """
+    global _profiler
+
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = RequestProfiler()
+
+    return _profiler
+
+
+if __name__ == "__main__":
+    # Test: perfil de una "petición" con trabajo de CPU en otro hilo
+    import pstats
+    import tempfile
+
+    def busy(n: int) -> int:
+        return sum(i * i for i in range(n))
+
+    async def request(profiler: RequestProfiler) -> Optional[Dict]:
+        async with profiler.profile("peticion-1") as info:
+            worker = threading.Thread(target=busy, args=(3_000_000,), name="rag-cpu_0")
+            worker.start()
+            busy(1_000_000)
+            worker.join()
+        return info
+
+    with tempfile.TemporaryDirectory() as directory:
+        profiler = RequestProfiler(token="secreto", directory=directory, interval_ms=2)
+        print(f"Autorizado: {profiler.authorized('secreto')}, sin token: {profiler.authorized(None)}")
+        assert not profiler.authorized("ñandú") and RequestProfiler(token="contraseña").authorized("contraseña")
+
+        info = asyncio.run(request(profiler))
+        print(info)
+        pstats.Stats(info["pstats"]).sort_stats("cumulative").print_stats(3)
+        print(Path(info["collapsed"]).read_text(encoding="utf-8")[:500])
+        print(profiler.get_stats())
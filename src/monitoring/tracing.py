@@ -0,0 +1,421 @@
+"""
+Módulo de trazas por petición: tiempos de cada etapa (reloj monotónico) y
+exportación de spans en formato OTLP/JSON a un archivo local
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import os
+import json
+import time
+import queue
+import atexit
+import secrets
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from monitoring.metrics import get_metrics
+
+
+class RequestTrace:
+    """
+    Traza de una petición: un span raíz y un span hijo por cada etapa.
+
+    Las duraciones se miden con time.monotonic(); las marcas de tiempo
+    absolutas de los spans se derivan del instante de inicio (time.time_ns()).
+    Una etapa que se repite (por ejemplo, el contexto rearmado al reducirlo)
+    suma su duración en timings_ms().
+    """
+
+    def __init__(self, name: str, attributes: Optional[Dict] = None, kind: int = 1):
+        """
+        Args:
+            name: Nombre del span raíz ('rag.query', 'POST /chat', ...)
+            attributes: Atributos iniciales del span raíz
+            kind: Tipo de span OTLP (1 = interno, 2 = servidor)
+        """
+        self.name = name
+        self.kind = kind
+        self.trace_id = secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+        self.start_ns = time.time_ns()
+        self.started = time.monotonic()
+        self.ended = None
+
+        self._lock = threading.Lock()
+        self._stages = []  # [(nombre, inicio, fin)] en segundos monotónicos
+
+    def record(self, stage: str, start: float, end: Optional[float] = None):
+        """
+        Registra una etapa ya medida
+
+        Args:
+            stage: Nombre de la etapa
+            start: Inicio (time.monotonic())
+            end: Fin (default: ahora)
+        """
+        if end is None:
+            end = time.monotonic()
+        with self._lock:
+            self._stages.append((stage, start, end))
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """
+        Context manager: mide la duración del bloque como una etapa
+
+        Args:
+            stage: Nombre de la etapa
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, start)
+
+    def set_attribute(self, key: str, value):
+        """Agrega un atributo al span raíz (los None se ignoran)"""
+        if value is not None:
+            self.attributes[key] = value
+
+    def end(self, error: Optional[str] = None):
+        """Marca el fin de la petición"""
+        if self.ended is None:
+            self.ended = time.monotonic()
+        if error:
+            self.error = error
+
+    def timings_ms(self) -> Dict[str, float]:
+        """
+        Milisegundos por etapa y total transcurrido
+
+        Returns:
+            {etapa: ms, ..., 'total': ms}
+        """
+        timings = {stage: round(seconds * 1000, 1) for stage, seconds in self.durations_seconds().items()}
+
+        end = self.ended if self.ended is not None else time.monotonic()
+        timings["total"] = round((end - self.started) * 1000, 1)
+        return timings
+
+    def durations_seconds(self) -> Dict[str, float]:
+        """
+        Segundos por etapa (sin redondear; las etapas repetidas se suman)
+
+        Returns:
+            {etapa: segundos}
+        """
+        with self._lock:
+            stages = list(self._stages)
+
+        durations = {}
+        for stage, start, end in stages:
+            durations[stage] = durations.get(stage, 0.0) + (end - start)
+        return durations
+
+    def _unix_nano(self, monotonic: float) -> str:
+        return str(self.start_ns + int((monotonic - self.started) * 1e9))
+
+    @staticmethod
+    def _attributes(attributes: Dict) -> List[Dict]:
+        """Atributos en formato OTLP/JSON ([{key, value: {stringValue|intValue|...}}])"""
+        converted = []
+        for key, value in attributes.items():
+            if isinstance(value, bool):
+                typed = {"boolValue": value}
+            elif isinstance(value, int):
+                typed = {"intValue": str(value)}
+            elif isinstance(value, float):
+                typed = {"doubleValue": value}
+            else:
+                typed = {"stringValue": str(value)}
+            converted.append({"key": key, "value": typed})
+        return converted
+
+    def to_spans(self) -> List[Dict]:
+        """
+        Spans de la traza en formato OTLP/JSON
+
+        Returns:
+            Lista con el span raíz y un span hijo por etapa
+        """
+        with self._lock:
+            stages = list(self._stages)
+        end = self.ended if self.ended is not None else time.monotonic()
+
+        root = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": self._unix_nano(end),
+            "attributes": self._attributes(self.attributes),
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1}
+        }
+
+        spans = [root]
+        for stage, start, stage_end in stages:
+            spans.append({
+                "traceId": self.trace_id,
+                "spanId": secrets.token_hex(8),
+                "parentSpanId": self.span_id,
+                "name": stage,
+                "kind": 1,
+                "startTimeUnixNano": self._unix_nano(start),
+                "endTimeUnixNano": self._unix_nano(stage_end),
+                "attributes": [],
+                "status": {"code": 1}
+            })
+        return spans
+
+
+# Traza de la petición HTTP en curso (la crea la API; el pipeline agrega sus etapas)
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar('current_trace', default=None)
+
+
+class Tracer:
+    """
+    Crea trazas y las escribe en TRACE_FILE: una línea JSON por petición
+    con el formato de exportación OTLP/JSON (resourceSpans), que pueden leer
+    el OpenTelemetry Collector (receptor filelog/otlpjsonfile) y otras herramientas.
+
+    Cuando el archivo supera TRACE_MAX_MB se renombra a <archivo>.1 y se
+    empieza uno nuevo (se conserva una sola rotación).
+
+    La petición solo serializa la traza y la encola; un hilo propio hace la
+    escritura (y la rotación), así el event loop nunca espera al disco. Si
+    la cola (TRACE_QUEUE_SIZE) se llena, la traza se descarta y se cuenta.
+    """
+
+    DEFAULT_FILE = "data/traces/spans.jsonl"
+    DEFAULT_MAX_MB = 50
+    DEFAULT_SERVICE_NAME = "llama-bge-chatbot"
+    DEFAULT_QUEUE_SIZE = 10000
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        path: Optional[str] = None,
+        max_mb: Optional[float] = None,
+        service_name: Optional[str] = None,
+        queue_size: Optional[int] = None
+    ):
+        """
+        Inicializa el tracer (los valores omitidos se leen de .env)
+
+        Args:
+            enabled: Escribe las trazas en el archivo (TRACE_ENABLED)
+            path: Archivo de trazas (TRACE_FILE)
+            max_mb: Tamaño máximo antes de rotar (TRACE_MAX_MB)
+            service_name: Nombre del servicio en los spans (TRACE_SERVICE_NAME)
+            queue_size: Trazas en espera de escritura como máximo antes de descartar (TRACE_QUEUE_SIZE)
+        """
+        load_dotenv()
+
+        if enabled is None:
+            enabled = os.getenv('TRACE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        if path is None:
+            path = os.getenv('TRACE_FILE', self.DEFAULT_FILE)
+        if max_mb is None:
+            max_mb = float(os.getenv('TRACE_MAX_MB', self.DEFAULT_MAX_MB))
+        if service_name is None:
+            service_name = os.getenv('TRACE_SERVICE_NAME', self.DEFAULT_SERVICE_NAME)
+        if queue_size is None:
+            queue_size = int(os.getenv('TRACE_QUEUE_SIZE', self.DEFAULT_QUEUE_SIZE))
+
+        self.enabled = enabled
+        self.path = Path(path)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.service_name = service_name
+
+        self.metrics = get_metrics()
+        self.metrics.describe(
+            "rag_request_duration_seconds", "Duración de las peticiones (POST /chat o consulta directa al pipeline)"
+        )
+        self.metrics.describe("rag_stage_duration_seconds", "Duración de cada etapa de una petición")
+
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.export_errors = 0
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        if self.enabled:
+            threading.Thread(target=self._write_loop, name="rag-trace-writer", daemon=True).start()
+            atexit.register(self.flush)
+
+    def start(self, name: str, attributes: Optional[Dict] = None, kind: int = 1) -> RequestTrace:
+        """
+        Crea una traza nueva
+
+        Args:
+            name: Nombre del span raíz
+            attributes: Atributos iniciales
+            kind: Tipo de span OTLP (1 = interno, 2 = servidor)
+
+        Returns:
+            RequestTrace
+        """
+        return RequestTrace(name, attributes, kind)
+
+    @staticmethod
+    def current() -> Optional[RequestTrace]:
+        """Traza activa de la petición en curso (None si nadie la creó)"""
+        return _current_trace.get()
+
+    @contextmanager
+    def activate(self, trace: RequestTrace) -> Iterator[RequestTrace]:
+        """
+        Context manager: hace que las etapas del pipeline se registren en la traza
+
+        Args:
+            trace: Traza de la petición
+        """
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+
+    def finish(self, trace: RequestTrace, error: Optional[str] = None):
+        """
+        Cierra la traza, registra sus duraciones en los histogramas de
+        Prometheus y la escribe en el archivo (si está activado)
+
+        Args:
+            trace: Traza de la petición
+            error: Mensaje de error (marca el span raíz con estado de error)
+        """
+        trace.end(error)
+
+        self.metrics.observe(
+            "rag_request_duration_seconds", trace.ended - trace.started,
+            labels={"operation": trace.name, "status": "error" if trace.error else "ok"}
+        )
+        for stage, seconds in trace.durations_seconds().items():
+            self.metrics.observe("rag_stage_duration_seconds", seconds, labels={"stage": stage})
+
+        if not self.enabled:
+            return
+
+        line = json.dumps({
+            "resourceSpans": [{
+                "resource": {"attributes": RequestTrace._attributes({"service.name": self.service_name})},
+                "scopeSpans": [{"scope": {"name": "rag"}, "spans": trace.to_spans()}]
+            }]
+        }, ensure_ascii=False)
+
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _write_loop(self):
+        """Hilo escritor: saca las trazas de la cola y las agrega al archivo"""
+        while True:
+            line = self._queue.get()
+            try:
+                self._write(line)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, line: str):
+        """Agrega una traza serializada al archivo (rotándolo si superó el tamaño máximo)"""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.path.exists() and self.path.stat().st_size > self.max_bytes:
+                self.path.replace(self.path.with_name(self.path.name + ".1"))
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(line + "\n")
+            with self._lock:
+                self.exported += 1
+        except OSError as e:
+            with self._lock:
+                self.export_errors += 1
+            # Import diferido: el logger importa este módulo
+            from monitoring.logger import get_logger
+            get_logger("rag.tracing").error(
+                "trace.export_error", f"No se pudo escribir la traza: {e}", exc_info=e, path=str(self.path)
+            )
+
+    def flush(self):
+        """Espera a que se escriban las trazas encoladas"""
+        if self.enabled:
+            self._queue.join()
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas del tracer
+
+        Returns:
+            Diccionario con estado, archivo, trazas escritas, en cola, descartadas y errores
+        """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'path': str(self.path),
+                'exported': self.exported,
+                'queued': self._queue.qsize(),
+                'dropped': self.dropped,
+                'export_errors': self.export_errors
+            }
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """
+    Obtiene el tracer compartido del proceso
+
+    Returns:
+        Tracer único (un solo archivo de trazas por proceso)
+    """
+    global _tracer
+
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer()
+
+    return _tracer
+
+
+if __name__ == "__main__":
+    # Test: traza simulada escrita en un archivo temporal
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        tracer = Tracer(enabled=True, path=f"{directory}/spans.jsonl")
+        trace = tracer.start("rag.query", {"mode": "generative"})
+
+        with trace.stage("embed"):
+            time.sleep(0.02)
+        with trace.stage("doc_search"):
+            time.sleep(0.01)
+        llm_started = time.monotonic()
+        time.sleep(0.03)
+        trace.record("llm_ttft", llm_started)
+        time.sleep(0.05)
+        trace.record("llm_total", llm_started)
+
+        tracer.finish(trace)
+        tracer.flush()
+        print(f"Tiempos: {trace.timings_ms()}")
+
+        exported = json.loads(Path(tracer.path).read_text(encoding='utf-8'))
+        for span in exported["resourceSpans"][0]["scopeSpans"][0]["spans"]:
+            duration_ms = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+            print(f"  {span['name']:10} {duration_ms:6.1f} ms (padre: {span.get('parentSpanId', '-')})")
+        print(tracer.get_stats())
@@ -0,0 +1,366 @@
+"""
+Módulo de control de admisión: límites de concurrencia por etapa con cola
+de espera acotada y rechazo rápido cuando la cola está llena
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Optional
+
+from dotenv import load_dotenv
+
+from monitoring.metrics import get_metrics
+
+
+class AdmissionRejected(Exception):
+    """La cola de una etapa está llena: el cliente debe reintentar más tarde"""
+
+    def __init__(self, stage: str, retry_after: float):
+        """
+        Args:
+            stage: Etapa que rechazó la petición ('embedding', 'llm:groq', ...)
+            retry_after: Segundos sugeridos antes de reintentar
+        """
+        super().__init__(f"Servicio saturado ({stage}): reintenta en {math.ceil(retry_after)} s")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+# Tiempos de espera en cola de la petición actual: {etapa: segundos}
+_queue_times: ContextVar[Optional[Dict[str, float]]] = ContextVar('admission_queue_times', default=None)
+
+
+def track_queue_times() -> Dict[str, float]:
+    """
+    Empieza a registrar los tiempos de cola de la petición actual
+
+    Las etapas que se ejecuten en esta tarea (o en tareas creadas desde ella)
+    suman su espera al diccionario devuelto.
+
+    Returns:
+        Diccionario {etapa: segundos en cola} que se llena durante la petición
+    """
+    queue_times = {}
+    _queue_times.set(queue_times)
+    return queue_times
+
+
+class ConcurrencyLimiter:
+    """
+    Límite de concurrencia de una etapa con cola FIFO acotada.
+
+    Hasta max_concurrent peticiones trabajan a la vez; las siguientes esperan
+    en una cola de hasta max_queue. Cuando la cola está llena se rechazan en
+    el acto (AdmissionRejected) con una estimación de cuándo reintentar:
+    es mejor que el cliente espere a que todas las peticiones se vuelvan lentas.
+
+    Funciona con varios event loops (el estado se protege con un lock de
+    threading y los que esperan se despiertan en su propio loop).
+    """
+
+    DEFAULT_SERVICE_SECONDS = 1.0  # Estimación inicial de la duración de la etapa
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, stage: str, max_concurrent: int, max_queue: int):
+        """
+        Inicializa el limitador
+
+        Args:
+            stage: Nombre de la etapa
+            max_concurrent: Peticiones simultáneas en la etapa
+            max_queue: Peticiones esperando como máximo (0 = rechazar si no hay lugar)
+        """
+        self.stage = stage
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque()  # [(loop, future)]
+        self._service_seconds = self.DEFAULT_SERVICE_SECONDS
+
+        self.admitted = 0
+        self.rejected = 0
+        self.queued = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+
+    def retry_after(self) -> float:
+        """Segundos estimados hasta que se libere un lugar en la cola"""
+        with self._lock:
+            return self._retry_after_locked()
+
+    def _retry_after_locked(self) -> float:
+        pending = len(self._waiters) + 1
+        return max(1.0, pending * self._service_seconds / self.max_concurrent)
+
+    async def acquire(self) -> float:
+        """
+        Espera un lugar en la etapa
+
+        Returns:
+            Segundos que se esperó en la cola
+
+        Raises:
+            AdmissionRejected: Si la cola está llena
+        """
+        start = time.monotonic()
+
+        with self._lock:
+            if self._active < self.max_concurrent and not self._waiters:
+                self._active += 1
+                self.admitted += 1
+                return 0.0
+
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected(self.stage, self._retry_after_locked())
+
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            waiter = (loop, future)
+            self._waiters.append(waiter)
+            self.queued += 1
+
+        try:
+            await future
+        except BaseException:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # El lugar ya se había asignado. Si el future quedó cancelado,
+            # _wake lo devuelve; si alcanzó a completarse, se devuelve aquí
+            if future.done() and not future.cancelled():
+                self._release_slot()
+            raise
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self.admitted += 1
+            self.queue_seconds += waited
+            self.max_queue_seconds = max(self.max_queue_seconds, waited)
+        return waited
+
+    def _release_slot(self):
+        """Pasa el lugar al siguiente en la cola o lo libera"""
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                if loop.is_closed():
+                    continue
+                # El lugar pasa directamente al que espera (_active no cambia)
+                loop.call_soon_threadsafe(self._wake, future)
+                return
+            self._active -= 1
+
+    def _wake(self, future: asyncio.Future):
+        if future.cancelled():
+            # Canceló después de recibir el lugar: pasarlo al siguiente
+            self._release_slot()
+        else:
+            future.set_result(None)
+
+    def release(self, service_seconds: Optional[float] = None):
+        """
+        Libera el lugar ocupado
+
+        Args:
+            service_seconds: Duración de la etapa (mejora la estimación de Retry-After)
+        """
+        if service_seconds is not None:
+            with self._lock:
+                self._service_seconds += self.EWMA_ALPHA * (service_seconds - self._service_seconds)
+        self._release_slot()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[float]:
+        """
+        Context manager: ocupa un lugar durante el bloque
+
+        Yields:
+            Segundos que se esperó en la cola
+        """
+        waited = await self.acquire()
+        queue_times = _queue_times.get()
+        if queue_times is not None:
+            queue_times[self.stage] = queue_times.get(self.stage, 0.0) + waited
+
+        start = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(time.monotonic() - start)
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas del limitador
+
+        Returns:
+            Diccionario con ocupación, cola, admitidas, rechazadas y tiempos de cola
+        """
+        with self._lock:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'active': self._active,
+                'waiting': len(self._waiters),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'queued': self.queued,
+                'avg_queue_ms': round(self.queue_seconds / self.queued * 1000, 1) if self.queued else 0.0,
+                'max_queue_ms': round(self.max_queue_seconds * 1000, 1),
+                'service_ms': round(self._service_seconds * 1000, 1)
+            }
+
+
+class AdmissionController:
+    """
+    Limitadores del proceso, uno por etapa costosa.
+
+    - 'embedding': EMBEDDING_MAX_CONCURRENT (default: CPU_EXECUTOR_WORKERS) y EMBEDDING_MAX_QUEUE
+    - 'llm:<proveedor>': LLM_<PROVEEDOR>_MAX_CONCURRENT y LLM_<PROVEEDOR>_MAX_QUEUE,
+      o LLM_MAX_CONCURRENT y LLM_MAX_QUEUE para todos los proveedores
+
+    Con ADMISSION_ENABLED=false no se limita nada.
+    """
+
+    DEFAULT_EMBEDDING_MAX_QUEUE = 32
+    DEFAULT_LLM_MAX_CONCURRENT = 16
+    DEFAULT_LLM_MAX_QUEUE = 64
+
+    def __init__(self, enabled: Optional[bool] = None):
+        """
+        Inicializa el controlador (la configuración se lee de .env)
+
+        Args:
+            enabled: Activa el control de admisión (ADMISSION_ENABLED)
+        """
+        load_dotenv()
+
+        if enabled is None:
+            enabled = os.getenv('ADMISSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._limiters = {}  # {etapa: ConcurrencyLimiter}
+
+    def _limits(self, stage: str):
+        """(max_concurrent, max_queue) de una etapa según .env"""
+        if stage == "embedding":
+            workers = int(os.getenv('CPU_EXECUTOR_WORKERS', min(4, os.cpu_count() or 1)))
+            return (
+                int(os.getenv('EMBEDDING_MAX_CONCURRENT', workers)),
+                int(os.getenv('EMBEDDING_MAX_QUEUE', self.DEFAULT_EMBEDDING_MAX_QUEUE))
+            )
+
+        provider = stage.split(":", 1)[-1].upper()
+        max_concurrent = os.getenv(
+            f'LLM_{provider}_MAX_CONCURRENT', os.getenv('LLM_MAX_CONCURRENT', self.DEFAULT_LLM_MAX_CONCURRENT)
+        )
+        max_queue = os.getenv(
+            f'LLM_{provider}_MAX_QUEUE', os.getenv('LLM_MAX_QUEUE', self.DEFAULT_LLM_MAX_QUEUE)
+        )
+        return int(max_concurrent), int(max_queue)
+
+    def limiter(self, stage: str) -> ConcurrencyLimiter:
+        """
+        Obtiene (o crea) el limitador de una etapa
+
+        Args:
+            stage: 'embedding' o 'llm:<proveedor>'
+
+        Returns:
+            ConcurrencyLimiter de la etapa
+        """
+        with self._lock:
+            if stage not in self._limiters:
+                self._limiters[stage] = ConcurrencyLimiter(stage, *self._limits(stage))
+            return self._limiters[stage]
+
+    @asynccontextmanager
+    async def slot(self, stage: str) -> AsyncIterator[float]:
+        """
+        Ocupa un lugar en una etapa durante el bloque (sin límite si está desactivado)
+
+        Yields:
+            Segundos que se esperó en la cola
+
+        Raises:
+            AdmissionRejected: Si la cola de la etapa está llena
+        """
+        if not self.enabled:
+            yield 0.0
+            return
+
+        metrics = get_metrics()
+        try:
+            async with self.limiter(stage).slot() as waited:
+                metrics.inc("rag_admission_queue_seconds_total", waited, labels={"stage": stage})
+                yield waited
+        except AdmissionRejected:
+            metrics.inc("rag_admission_rejected_total", labels={"stage": stage})
+            raise
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas de todas las etapas
+
+        Returns:
+            Diccionario {etapa: estadísticas}
+        """
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {
+            'enabled': self.enabled,
+            'stages': {stage: limiter.get_stats() for stage, limiter in limiters.items()}
+        }
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Obtiene el controlador de admisión compartido del proceso
+
+    Returns:
+        AdmissionController único (los límites son por proceso, no por pipeline)
+    """
+    global _controller
+
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+
+    return _controller
+
+
+if __name__ == "__main__":
+    # Test: 2 lugares y cola de 3 -> de 8 peticiones simultáneas se rechazan 3 al instante
+    async def request(limiter: ConcurrencyLimiter, number: int) -> str:
+        try:
+            async with limiter.slot() as waited:
+                await asyncio.sleep(0.2)
+                return f"#{number} atendida (cola: {waited * 1000:.0f} ms)"
+        except AdmissionRejected as e:
+            return f"#{number} rechazada (Retry-After: {math.ceil(e.retry_after)} s)"
+
+    async def main():
+        limiter = ConcurrencyLimiter("llm:groq", max_concurrent=2, max_queue=3)
+        for line in await asyncio.gather(*(request(limiter, i) for i in range(8))):
+            print(line)
+        print(limiter.get_stats())
+
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+"""
+Módulo con el executor acotado para trabajo de CPU (embeddings, scoring)
+usado por el camino asíncrono de la API
+"""
+import os
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from dotenv import load_dotenv
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    """
+    Obtiene el executor compartido para trabajo de CPU
+
+    El número de hilos se limita con CPU_EXECUTOR_WORKERS (default: 4) para que
+    varias peticiones simultáneas no saturen la CPU codificando con BGE-M3.
+
+    Returns:
+        ThreadPoolExecutor compartido del proceso
+    """
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                load_dotenv()
+                workers = int(os.getenv('CPU_EXECUTOR_WORKERS', min(4, os.cpu_count() or 1)))
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-cpu")
+
+    return _executor
+
+
+async def run_cpu(func: Callable, *args, **kwargs) -> Any:
+    """
+    Ejecuta una función bloqueante en el executor de CPU sin bloquear el event loop
+
+    La función corre con una copia del contexto de la tarea (como
+    asyncio.to_thread): ve la traza de la petición en curso.
+
+    Args:
+        func: Función a ejecutar
+        *args, **kwargs: Argumentos de la función
+
+    Returns:
+        Resultado de la función
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_cpu_executor(), functools.partial(context.run, func, *args, **kwargs)
+    )
+
+
+def shutdown_cpu_executor():
+    """Detiene el executor compartido (al apagar la aplicación)"""
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+if __name__ == "__main__":
+    # Test de concurrencia: etapas de CPU en el executor + LLM asíncrono simulado
+    import time
+
+    EMBED_SECONDS = 0.1
+    LLM_SECONDS = 0.5
+    REQUESTS = 20
+
+    def fake_embedding(text: str) -> int:
+        time.sleep(EMBED_SECONDS)  # Simula la codificación con BGE-M3
+        return len(text)
+
+    async def fake_llm(tokens: int) -> str:
+        await asyncio.sleep(LLM_SECONDS)  # Simula una llamada lenta a la API
+        return f"respuesta ({tokens})"
+
+    async def handle(question: str) -> str:
+        tokens = await run_cpu(fake_embedding, question)
+        return await fake_llm(tokens)
+
+    async def heartbeat(stop: asyncio.Event, gaps: list):
+        last = time.monotonic()
+        while not stop.is_set():
+            await asyncio.sleep(0.01)
+            now = time.monotonic()
+            gaps.append(now - last)
+            last = now
+
+    async def main():
+        stop = asyncio.Event()
+        gaps = []
+        beat = asyncio.create_task(heartbeat(stop, gaps))
+
+        start = time.monotonic()
+        answers = await asyncio.gather(*[handle(f"pregunta {i}") for i in range(REQUESTS)])
+        elapsed = time.monotonic() - start
+
+        stop.set()
+        await beat
+
+        sequential = REQUESTS * (EMBED_SECONDS + LLM_SECONDS)
+        blocked = max(gaps)
+        print(f"{REQUESTS} peticiones en {elapsed:.2f}s (secuencial serían ~{sequential:.0f}s)")
+        print(f"Mayor bloqueo del event loop: {blocked * 1000:.0f}ms")
+        print(f"Ejemplo: {answers[0]}")
+
+        assert answers == [f"respuesta ({len(f'pregunta {i}')})" for i in range(REQUESTS)]
+        # Las llamadas al LLM se solapan: aun con un solo hilo de CPU el total queda lejos del secuencial
+        assert elapsed < sequential / 3, f"sin concurrencia: {elapsed:.2f}s"
+        # Un embedding en el hilo del loop lo bloquearía EMBED_SECONDS completos
+        assert blocked < EMBED_SECONDS / 2, f"event loop bloqueado {blocked * 1000:.0f}ms"
+
+    asyncio.run(main())
+    shutdown_cpu_executor()
@@ -0,0 +1,238 @@
+"""
+Módulo para armar el contexto del LLM dentro de un presupuesto de tokens,
+eliminando texto duplicado o solapado entre documentos
+"""
+import os
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+
+class ContextBuilder:
+    """
+    Arma el contexto del LLM a partir de resultados ordenados por relevancia.
+
+    - Elimina párrafos repetidos entre documentos (ej: la misma FAQ en dos
+      resultados) y el solapamiento entre chunks consecutivos de un archivo.
+    - Llena el presupuesto de tokens en orden de relevancia; un documento que
+      no cabe entero se recorta por párrafos (u oraciones) si queda espacio suficiente.
+    - Informa cuántos tokens se descartaron por duplicados y por presupuesto.
+    """
+
+    DEFAULT_MAX_TOKENS = 3000
+    MIN_TRUNCATED_TOKENS = 64  # No incluir recortes más pequeños que esto
+    MIN_DEDUP_CHARS = 40  # Párrafos más cortos (títulos, separadores) no se deduplican
+    MIN_OVERLAP_CHARS = 40
+    MAX_OVERLAP_CHARS = 1500
+
+    def __init__(
+        self,
+        token_counter: Callable[[str], int],
+        max_tokens: Optional[int] = None
+    ):
+        """
+        Inicializa el constructor de contexto
+
+        Args:
+            token_counter: Función que cuenta tokens con el tokenizer del modelo de destino
+            max_tokens: Presupuesto de tokens del contexto (CONTEXT_MAX_TOKENS)
+        """
+        load_dotenv()
+
+        if max_tokens is None:
+            max_tokens = int(os.getenv('CONTEXT_MAX_TOKENS', self.DEFAULT_MAX_TOKENS))
+
+        self.count_tokens = token_counter
+        self.max_tokens = max_tokens
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return re.sub(r'\s+', ' ', text).strip().casefold()
+
+    @staticmethod
+    def _base_source(source: str) -> str:
+        """Archivo de origen de un chunk ("Becas.md_chunk_3" -> "Becas.md")"""
+        return re.sub(r'_chunk_\d+$', '', source)
+
+    @staticmethod
+    def _split_paragraphs(text: str) -> List[str]:
+        return [paragraph.strip() for paragraph in re.split(r'\n\s*\n', text) if paragraph.strip()]
+
+    def _trim_overlap(self, text: str, previous_texts: List[str]) -> str:
+        """
+        Quita el texto que se solapa con chunks ya incluidos del mismo archivo
+
+        Los chunks consecutivos comparten un tramo: el final de uno es el
+        inicio del siguiente (o al revés si el posterior es más relevante).
+
+        Args:
+            text: Texto del documento nuevo
+            previous_texts: Textos ya incluidos del mismo archivo
+
+        Returns:
+            Texto sin el tramo solapado
+        """
+        for previous in previous_texts:
+            limit = min(len(previous), len(text), self.MAX_OVERLAP_CHARS)
+
+            for size in range(limit, self.MIN_OVERLAP_CHARS - 1, -1):
+                if previous.endswith(text[:size]):
+                    text = text[size:]
+                    break
+
+            limit = min(len(previous), len(text), self.MAX_OVERLAP_CHARS)
+            for size in range(limit, self.MIN_OVERLAP_CHARS - 1, -1):
+                if text.endswith(previous[:size]):
+                    text = text[:-size]
+                    break
+
+        return text.strip()
+
+    def _fit_sentences(self, paragraph: str, budget: int) -> str:
+        """
+        Toma las primeras oraciones de un párrafo que caben en el presupuesto
+
+        Args:
+            paragraph: Párrafo a recortar
+            budget: Tokens disponibles
+
+        Returns:
+            Oraciones que caben (vacío si no cabe ninguna)
+        """
+        sentences = re.split(r'(?<=[.!?])\s+', paragraph)
+        kept = []
+        used = 0
+        for sentence in sentences:
+            tokens = self.count_tokens(sentence)
+            if used + tokens > budget:
+                break
+            kept.append(sentence)
+            used += tokens
+        return " ".join(kept)
+
+    def build(self, results: List[Tuple[str, str, float]], max_tokens: Optional[int] = None) -> Dict:
+        """
+        Arma el contexto dentro del presupuesto de tokens
+
+        Args:
+            results: Lista de (source, content, score) en orden de relevancia
+            max_tokens: Presupuesto de esta llamada (default: el configurado)
+
+        Returns:
+            Diccionario con:
+            - context_documents: textos a enviar al LLM
+            - sources: archivo de origen de cada texto (para citas)
+            - used_tokens: tokens del contexto armado
+            - dropped_tokens: tokens descartados por falta de presupuesto
+            - duplicate_tokens: tokens descartados por repetidos o solapados
+            - dropped_documents / truncated_documents: documentos excluidos o recortados
+            - budget: presupuesto aplicado
+        """
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        context_documents = []
+        sources = []
+        accepted_by_source = {}  # {archivo: textos incluidos}
+        accepted_normalized = ""  # Texto incluido normalizado (para detectar párrafos contenidos)
+        seen_paragraphs = set()
+
+        used_tokens = 0
+        dropped_tokens = 0
+        duplicate_tokens = 0
+        dropped_documents = 0
+        truncated_documents = 0
+
+        for source, content, _ in results:
+            original_tokens = self.count_tokens(content)
+            base_source = self._base_source(source)
+
+            text = self._trim_overlap(content, accepted_by_source.get(base_source, []))
+
+            # Descartar párrafos ya incluidos en otro documento
+            paragraphs = []
+            for paragraph in self._split_paragraphs(text):
+                normalized = self._normalize(paragraph)
+                is_duplicate = len(normalized) >= self.MIN_DEDUP_CHARS and (
+                    normalized in seen_paragraphs or normalized in accepted_normalized
+                )
+                if not is_duplicate:
+                    paragraphs.append((paragraph, normalized, self.count_tokens(paragraph)))
+
+            unique_tokens = sum(tokens for _, _, tokens in paragraphs)
+            duplicate_tokens += max(0, original_tokens - unique_tokens)
+
+            if not paragraphs:
+                continue
+
+            # Llenar el presupuesto en orden de relevancia
+            remaining = budget - used_tokens
+            kept = []
+            kept_tokens = 0
+            for paragraph in paragraphs:
+                if kept_tokens + paragraph[2] > remaining:
+                    # El párrafo que no cabe se completa por oraciones
+                    partial = self._fit_sentences(paragraph[0], remaining - kept_tokens)
+                    if partial:
+                        partial_tokens = self.count_tokens(partial)
+                        kept.append((partial, self._normalize(partial), partial_tokens))
+                        kept_tokens += partial_tokens
+                    break
+                kept.append(paragraph)
+                kept_tokens += paragraph[2]
+
+            truncated = kept_tokens < unique_tokens
+            if truncated and kept_tokens < self.MIN_TRUNCATED_TOKENS:
+                kept, kept_tokens = [], 0
+
+            dropped_tokens += unique_tokens - kept_tokens
+            if not kept:
+                dropped_documents += 1
+                continue
+            if truncated:
+                truncated_documents += 1
+
+            document = "\n\n".join(paragraph for paragraph, _, _ in kept)
+            context_documents.append(document)
+            sources.append(source)
+            accepted_by_source.setdefault(base_source, []).append(document)
+            for _, normalized, _ in kept:
+                seen_paragraphs.add(normalized)
+            accepted_normalized += " " + self._normalize(document)
+            used_tokens += kept_tokens
+
+        return {
+            "context_documents": context_documents,
+            "sources": sources,
+            "used_tokens": used_tokens,
+            "dropped_tokens": dropped_tokens,
+            "duplicate_tokens": duplicate_tokens,
+            "dropped_documents": dropped_documents,
+            "truncated_documents": truncated_documents,
+            "budget": budget
+        }
+
+
+if __name__ == "__main__":
+    # Test con chunks solapados y un presupuesto pequeño
+    import sys
+    from pathlib import Path
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from ingestion.markdown_chunker import approximate_token_count
+
+    base = (
+        "Las becas de excelencia académica requieren un índice mínimo de 80%. "
+        "La solicitud se presenta en la VOAE durante las dos primeras semanas del período."
+    )
+    results = [
+        ("Becas_UNAH.md_chunk_0", "# Becas\n\n" + base, 0.82),
+        ("Becas_UNAH.md_chunk_1", base[-120:] + "\n\nLos estudiantes deben mantener el índice cada período.", 0.80),
+        ("faq/faq_becas.md", base, 0.78),
+        ("Reglamento.md", "Artículo con texto largo. " * 100, 0.70),
+    ]
+
+    builder = ContextBuilder(approximate_token_count, max_tokens=120)
+    built = builder.build(results)
+
+    for source, document in zip(built["sources"], built["context_documents"]):
+        print(f"[{source}]\n{document}\n")
+    print({key: value for key, value in built.items() if key not in ("context_documents", "sources")})
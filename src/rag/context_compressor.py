@@ -0,0 +1,310 @@
+"""
+Módulo de compresión extractiva del contexto: conserva solo las oraciones
+de los documentos más cercanas a la consulta (y sus vecinas)
+"""
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+
+class ContextCompressor:
+    """
+    Comprime los documentos recuperados antes de enviarlos al LLM.
+
+    Cada documento se divide en oraciones (los títulos, ítems de lista y
+    filas de tabla cuentan como una unidad). Las oraciones de todos los
+    documentos sin caché se embeben en una sola llamada al Embedder y se
+    guardan por documento. En cada consulta se eligen las oraciones más
+    similares a la pregunta, se agregan sus vecinas y el título de su sección,
+    y cada documento comprimido conserva su archivo de origen (para las citas).
+    Los documentos sin oraciones elegidas se descartan.
+    """
+
+    DEFAULT_TOP_SENTENCES = 8
+    DEFAULT_NEIGHBORS = 1
+    DEFAULT_MIN_SENTENCES = 4  # Documentos más cortos se envían completos
+    DEFAULT_CACHE_SIZE = 2000  # Documentos con oraciones embebidas en memoria
+    GAP_MARKER = "[...]"
+
+    def __init__(
+        self,
+        embedder,
+        token_counter: Callable[[str], int],
+        enabled: Optional[bool] = None,
+        top_sentences: Optional[int] = None,
+        neighbors: Optional[int] = None,
+        cache_size: Optional[int] = None
+    ):
+        """
+        Inicializa el compresor (los valores omitidos se leen de .env)
+
+        Args:
+            embedder: Embedder ya cargado (BGE-M3)
+            token_counter: Función que cuenta tokens (para las estadísticas)
+            enabled: Activa la compresión (CONTEXT_COMPRESSION_ENABLED)
+            top_sentences: Oraciones a conservar en total (CONTEXT_COMPRESSION_TOP_SENTENCES)
+            neighbors: Oraciones vecinas a cada lado de una elegida (CONTEXT_COMPRESSION_NEIGHBORS)
+            cache_size: Documentos con embeddings en caché (CONTEXT_COMPRESSION_CACHE_SIZE)
+        """
+        load_dotenv()
+
+        if enabled is None:
+            enabled = os.getenv('CONTEXT_COMPRESSION_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+        if top_sentences is None:
+            top_sentences = int(os.getenv('CONTEXT_COMPRESSION_TOP_SENTENCES', self.DEFAULT_TOP_SENTENCES))
+        if neighbors is None:
+            neighbors = int(os.getenv('CONTEXT_COMPRESSION_NEIGHBORS', self.DEFAULT_NEIGHBORS))
+        if cache_size is None:
+            cache_size = int(os.getenv('CONTEXT_COMPRESSION_CACHE_SIZE', self.DEFAULT_CACHE_SIZE))
+
+        self.embedder = embedder
+        self.count_tokens = token_counter
+        self.enabled = enabled
+        self.top_sentences = top_sentences
+        self.neighbors = neighbors
+        self.min_sentences = self.DEFAULT_MIN_SENTENCES
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()  # {(source, hash): (unidades, embeddings)}, orden LRU
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @staticmethod
+    def split_sentences(text: str) -> List[Dict]:
+        """
+        Divide un documento markdown en unidades (oraciones, títulos, ítems)
+
+        Args:
+            text: Contenido del documento
+
+        Returns:
+            Lista de {text, line, heading, is_heading}, donde heading es el
+            índice de la unidad de título de su sección (None si no hay)
+        """
+        units = []
+        heading = None
+
+        for line_number, line in enumerate(text.split('\n')):
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith('#'):
+                heading = len(units)
+                units.append({"text": line, "line": line_number, "heading": None, "is_heading": True})
+                continue
+
+            # Ítems de lista y filas de tabla se mantienen enteros
+            if re.match(r'^([-*+|>]|\d+[.)])\s*', line):
+                parts = [line]
+            else:
+                parts = re.split(r'(?<=[.!?])\s+(?=[A-ZÁÉÍÓÚÑ¿¡0-9])', line)
+
+            for part in parts:
+                if part.strip():
+                    units.append({
+                        "text": part.strip(), "line": line_number, "heading": heading, "is_heading": False
+                    })
+
+        return units
+
+    def _document_key(self, source: str, content: str) -> Tuple[str, str]:
+        return source, hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def embed_documents(self, documents: List[Tuple[str, str]]) -> List[Tuple[List[Dict], np.ndarray]]:
+        """
+        Obtiene las unidades y sus embeddings de cada documento
+
+        Las oraciones de todos los documentos sin caché se embeben juntas
+        en una sola llamada al modelo.
+
+        Args:
+            documents: Lista de (source, content)
+
+        Returns:
+            Lista de (unidades, matriz de embeddings) en el mismo orden
+        """
+        prepared = [None] * len(documents)
+        pending = []  # [(índice, clave, unidades)]
+
+        with self._lock:
+            for index, (source, content) in enumerate(documents):
+                key = self._document_key(source, content)
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    self.cache_hits += 1
+                    prepared[index] = cached
+                else:
+                    self.cache_misses += 1
+                    pending.append((index, key, self.split_sentences(content)))
+
+        texts = [unit["text"] for _, _, units in pending for unit in units]
+        if texts:
+            embeddings = self.embedder.generate_embeddings_batch(texts)
+            offset = 0
+            with self._lock:
+                for index, key, units in pending:
+                    entry = (units, embeddings[offset:offset + len(units)])
+                    offset += len(units)
+                    prepared[index] = entry
+                    self._cache[key] = entry
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        for index, _, units in pending:
+            if prepared[index] is None:  # Documento vacío
+                prepared[index] = (units, np.zeros((0, 0), dtype='float32'))
+
+        return prepared
+
+    def render(self, units: List[Dict], keep: List[int]) -> str:
+        """Reconstruye el texto de las unidades elegidas, marcando los saltos"""
+        parts = []
+        previous = None
+        for index in keep:
+            if previous is not None and index != previous + 1:
+                parts.append("\n" + self.GAP_MARKER + "\n")
+            elif previous is not None:
+                parts.append(" " if units[index]["line"] == units[previous]["line"] else "\n")
+            parts.append(units[index]["text"])
+            previous = index
+        return "".join(parts).strip()
+
+    def compress(
+        self,
+        query_embedding: np.ndarray,
+        results: List[Tuple[str, str, float]]
+    ) -> Tuple[List[Tuple[str, str, float]], Dict]:
+        """
+        Comprime los documentos conservando las oraciones más relevantes
+
+        Args:
+            query_embedding: Embedding normalizado de la consulta
+            results: Lista de (source, content, score) en orden de relevancia
+
+        Returns:
+            Tupla (compressed, stats)
+            - compressed: Lista de (source, texto comprimido, score) en el mismo orden
+            - stats: original_tokens, compressed_tokens y documentos descartados
+        """
+        original_tokens = sum(self.count_tokens(content) for _, content, _ in results)
+        stats = {
+            "enabled": self.enabled,
+            "original_tokens": original_tokens,
+            "compressed_tokens": original_tokens,
+            "dropped_documents": 0
+        }
+
+        if not self.enabled or not results:
+            return list(results), stats
+
+        prepared = self.embed_documents([(source, content) for source, content, _ in results])
+
+        # Puntuar todas las oraciones contra la consulta y elegir las mejores en conjunto
+        candidates = []  # [(score, documento, unidad)]
+        for doc_index, (units, embeddings) in enumerate(prepared):
+            if len(units) < self.min_sentences:
+                continue
+            scores = embeddings @ query_embedding
+            for unit_index, unit in enumerate(units):
+                if unit["is_heading"]:
+                    continue  # Los títulos solo se agregan como encabezado de una oración elegida
+                candidates.append((float(scores[unit_index]), doc_index, unit_index))
+
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        selected = {}  # {documento: set(unidades)}
+        for _, doc_index, unit_index in candidates[:self.top_sentences]:
+            selected.setdefault(doc_index, set()).add(unit_index)
+
+        compressed = []
+        for doc_index, (source, content, score) in enumerate(results):
+            units, _ = prepared[doc_index]
+
+            if len(units) < self.min_sentences:
+                compressed.append((source, content, score))
+                continue
+
+            chosen = selected.get(doc_index)
+            if not chosen:
+                stats["dropped_documents"] += 1
+                continue
+
+            keep = set()
+            for unit_index in chosen:
+                start = max(0, unit_index - self.neighbors)
+                end = min(len(units), unit_index + self.neighbors + 1)
+                keep.update(range(start, end))
+                if units[unit_index]["heading"] is not None:
+                    keep.add(units[unit_index]["heading"])
+
+            compressed.append((source, self.render(units, sorted(keep)), score))
+
+        stats["compressed_tokens"] = sum(self.count_tokens(content) for _, content, _ in compressed)
+        return compressed, stats
+
+    def clear(self):
+        """Vacía la caché de oraciones embebidas"""
+        with self._lock:
+            self._cache.clear()
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas del compresor
+
+        Returns:
+            Diccionario con estado, documentos en caché, hits y misses
+        """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'cached_documents': len(self._cache),
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses
+            }
+
+
+if __name__ == "__main__":
+    # Test del compresor con el modelo BGE-M3
+    import sys
+    from pathlib import Path
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from embeddings.embedder import Embedder
+
+    embedder = Embedder()
+    compressor = ContextCompressor(embedder, embedder.count_tokens, enabled=True, top_sentences=3)
+
+    document = (
+        "# Becas\n\n"
+        "La VOAE administra varios programas de apoyo. "
+        "Las becas de excelencia académica requieren un índice mínimo de 80%. "
+        "La solicitud se presenta durante las dos primeras semanas del período.\n\n"
+        "## Comedor\n\n"
+        "El comedor universitario abre de 7:00 a 19:00. "
+        "Los estudiantes becados reciben almuerzo gratuito.\n\n"
+        "## Deportes\n\n"
+        "Las selecciones deportivas entrenan por las tardes. "
+        "Las inscripciones a equipos abren cada período."
+    )
+    results = [
+        ("services/Becas.md", document, 0.71),
+        ("about/Historia.md", "La universidad fue fundada en 1847. Tiene varios centros regionales. "
+                              "Su sede principal está en Tegucigalpa. Ofrece más de cien carreras.", 0.52)
+    ]
+
+    question = "¿Qué índice necesito para la beca de excelencia?"
+    compressed, stats = compressor.compress(embedder.generate_embedding(question), results)
+
+    for source, content, _ in compressed:
+        print(f"[{source}]\n{content}\n")
+    print(stats)
+
+    compressor.compress(embedder.generate_embedding("horario del comedor"), results)
+    print(compressor.get_stats())
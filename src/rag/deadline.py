@@ -0,0 +1,241 @@
+"""
+Módulo de presupuesto de latencia por petición: reparte el presupuesto entre
+las etapas y decide qué degradaciones aplicar cuando no alcanza
+"""
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+
+# Degradaciones en el orden en que se aplican
+DEGRADATIONS = (
+    "skip_compression",   # No comprimir el contexto (etapa opcional)
+    "shrink_context",     # Contexto más chico: menos tokens de prompt que procesar
+    "fast_model",         # Ruta de modelo rápida
+    "faq_or_extractive",  # Sin LLM: mejor FAQ o pasaje recuperado
+    "truncate_stream"     # Stream cortado al agotarse el presupuesto
+)
+
+
+class Deadline:
+    """Presupuesto de latencia de una petición, medido con reloj monotónico"""
+
+    def __init__(self, budget_ms: float):
+        """
+        Args:
+            budget_ms: Presupuesto total en milisegundos
+        """
+        self.budget_ms = budget_ms
+        self.started = time.monotonic()
+
+    def elapsed_ms(self) -> float:
+        """Milisegundos transcurridos desde el inicio de la petición"""
+        return (time.monotonic() - self.started) * 1000
+
+    def remaining_ms(self) -> float:
+        """Milisegundos restantes (negativo si ya se venció)"""
+        return self.budget_ms - self.elapsed_ms()
+
+    def remaining_seconds(self) -> float:
+        """Segundos restantes (0 si ya se venció)"""
+        return max(0.0, self.remaining_ms() / 1000)
+
+    def expired(self) -> bool:
+        """Indica si ya se agotó el presupuesto"""
+        return self.remaining_ms() <= 0
+
+    def to_dict(self) -> Dict:
+        """Resumen para la respuesta"""
+        return {"budget_ms": self.budget_ms, "elapsed_ms": round(self.elapsed_ms(), 1)}
+
+
+class DeadlinePolicy:
+    """
+    Reparte el presupuesto de una petición entre las etapas y decide las
+    degradaciones.
+
+    Las decisiones comparan los milisegundos restantes con la duración
+    esperada de cada etapa: la compresión se estima con sus duraciones
+    recientes y la generación con la latencia observada de la ruta. Las
+    partes del presupuesto (DEADLINE_SHARES: compresión y generación) solo
+    se usan como estimación mientras no hay muestras. Con el presupuesto
+    ajustado se degrada en este orden:
+    1. skip_compression: si lo que queda no cubre la compresión más la
+       generación esperada (como mínimo DEADLINE_MIN_GENERATION_MS).
+    2. shrink_context: si lo que queda no cubre la latencia esperada de la
+       ruta de modelo (p50 observado o la parte de la generación).
+    3. fast_model: si tampoco alcanza con el contexto reducido.
+    4. faq_or_extractive: si ni la ruta rápida alcanza, o quedan menos de
+       DEADLINE_MIN_GENERATION_MS, se responde sin LLM.
+    5. truncate_stream: un stream que sigue al agotarse el presupuesto se
+       corta con lo emitido hasta ese momento.
+    """
+
+    DEFAULT_SHARES = {"compression": 0.10, "generation": 0.70}
+    COMPRESSION_WINDOW = 50  # Duraciones recientes de la compresión que se conservan
+    DEFAULT_MIN_GENERATION_MS = 800
+    SHRINK_FACTOR = 0.5  # El contexto reducido usa la mitad de los tokens
+    SHRINK_SPEEDUP = 0.8  # Latencia esperada con el contexto reducido (proporción)
+    FAST_SPEEDUP = 0.5  # Latencia esperada de la ruta rápida sin muestras propias
+
+    def __init__(
+        self,
+        default_budget_ms: Optional[float] = None,
+        shares: Optional[Dict[str, float]] = None,
+        min_generation_ms: Optional[float] = None
+    ):
+        """
+        Inicializa la política (los valores omitidos se leen de .env)
+
+        Args:
+            default_budget_ms: Presupuesto cuando el cliente no envía uno
+                (REQUEST_LATENCY_BUDGET_MS; 0 = sin presupuesto)
+            shares: Parte del presupuesto de cada etapa
+                (DEADLINE_SHARES, ej: "compression=0.10,generation=0.70")
+            min_generation_ms: Tiempo mínimo para intentar la generación (DEADLINE_MIN_GENERATION_MS)
+        """
+        load_dotenv()
+
+        if default_budget_ms is None:
+            default_budget_ms = float(os.getenv('REQUEST_LATENCY_BUDGET_MS', 0))
+        if shares is None:
+            shares = dict(self.DEFAULT_SHARES)
+            for item in os.getenv('DEADLINE_SHARES', '').split(','):
+                if '=' in item:
+                    stage, value = item.split('=', 1)
+                    # Solo hay estimación para estas etapas; las demás se ignoran
+                    if stage.strip() in self.DEFAULT_SHARES:
+                        shares[stage.strip()] = float(value)
+        if min_generation_ms is None:
+            min_generation_ms = float(os.getenv('DEADLINE_MIN_GENERATION_MS', self.DEFAULT_MIN_GENERATION_MS))
+
+        self.default_budget_ms = default_budget_ms
+        self.shares = shares
+        self.min_generation_ms = min_generation_ms
+
+        self._compression_ms = deque(maxlen=self.COMPRESSION_WINDOW)
+        self._lock = threading.Lock()
+
+    def start(self, budget_ms: Optional[float] = None) -> Optional[Deadline]:
+        """
+        Inicia el presupuesto de una petición
+
+        Args:
+            budget_ms: Presupuesto pedido por el cliente (None = el configurado)
+
+        Returns:
+            Deadline, o None si la petición no tiene presupuesto
+        """
+        if budget_ms is None:
+            budget_ms = self.default_budget_ms
+        if not budget_ms or budget_ms <= 0:
+            return None
+        return Deadline(budget_ms)
+
+    def stage_budget_ms(self, deadline: Deadline, stage: str) -> float:
+        """Parte del presupuesto asignada a una etapa"""
+        return deadline.budget_ms * self.shares.get(stage, 0.0)
+
+    def record_compression(self, elapsed_ms: float):
+        """Registra la duración de una compresión del contexto"""
+        with self._lock:
+            self._compression_ms.append(elapsed_ms)
+
+    def compression_estimate_ms(self, deadline: Deadline) -> float:
+        """
+        Duración esperada de la compresión
+
+        Returns:
+            Mediana de las compresiones recientes, o la parte de la
+            compresión en el presupuesto si todavía no hay muestras
+        """
+        with self._lock:
+            samples = sorted(self._compression_ms)
+        if not samples:
+            return self.stage_budget_ms(deadline, "compression")
+        return samples[len(samples) // 2]
+
+    def allow_compression(self, deadline: Optional[Deadline], generation_expected_ms: Optional[float] = None) -> bool:
+        """
+        Indica si queda tiempo para la compresión sin comerse el de la generación
+
+        Args:
+            deadline: Presupuesto de la petición (None = sin límite)
+            generation_expected_ms: Latencia esperada de la generación
+                (None = parte de la generación en el presupuesto)
+
+        Returns:
+            True si los milisegundos restantes cubren la compresión y la generación
+        """
+        if deadline is None:
+            return True
+        if generation_expected_ms is None:
+            generation_expected_ms = self.stage_budget_ms(deadline, "generation")
+        needed = max(self.min_generation_ms, generation_expected_ms) + self.compression_estimate_ms(deadline)
+        return deadline.remaining_ms() >= needed
+
+    def plan_generation(
+        self,
+        deadline: Optional[Deadline],
+        expected_ms: Optional[float] = None,
+        fast_expected_ms: Optional[float] = None
+    ) -> List[str]:
+        """
+        Decide las degradaciones de la generación según el tiempo restante
+
+        Args:
+            deadline: Presupuesto de la petición (None = sin límite)
+            expected_ms: Latencia esperada de la ruta elegida (None = parte de la generación)
+            fast_expected_ms: Latencia esperada de la ruta rápida (None = estimada)
+
+        Returns:
+            Degradaciones a aplicar, en orden (vacío si alcanza el tiempo)
+        """
+        if deadline is None:
+            return []
+
+        remaining = deadline.remaining_ms()
+        if remaining < self.min_generation_ms:
+            return ["faq_or_extractive"]
+
+        if expected_ms is None:
+            expected_ms = self.stage_budget_ms(deadline, "generation")
+        if remaining >= expected_ms:
+            return []
+
+        degradations = ["shrink_context"]
+        if remaining >= expected_ms * self.SHRINK_SPEEDUP:
+            return degradations
+
+        degradations.append("fast_model")
+        if fast_expected_ms is None:
+            fast_expected_ms = expected_ms * self.FAST_SPEEDUP
+        if remaining >= fast_expected_ms * self.SHRINK_SPEEDUP:
+            return degradations
+
+        degradations.append("faq_or_extractive")
+        return degradations
+
+
+if __name__ == "__main__":
+    # Test de las decisiones con distintos tiempos restantes (latencia esperada: 2 s)
+    policy = DeadlinePolicy(min_generation_ms=800)
+    policy.record_compression(300)
+
+    for budget_ms in [10000, 2500, 2200, 1800, 1200, 500]:
+        deadline = policy.start(budget_ms)
+        print(
+            f"Presupuesto {budget_ms:5} ms -> "
+            f"compresión: {policy.allow_compression(deadline, generation_expected_ms=2000)!s:5} "
+            f"generación: {policy.plan_generation(deadline, expected_ms=2000) or 'sin degradar'}"
+        )
+
+    # La compresión se decide en milisegundos absolutos, no en proporción al presupuesto
+    assert policy.allow_compression(policy.start(2400), generation_expected_ms=2000)
+    assert not policy.allow_compression(policy.start(2200), generation_expected_ms=2000)
+    assert not policy.allow_compression(policy.start(20000), generation_expected_ms=19800)
+    print("OK")
@@ -0,0 +1,174 @@
+"""
+Módulo de respuestas extractivas: arma una respuesta sin LLM con la FAQ
+o los pasajes ya recuperados, usando el embedding de la consulta
+"""
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+
+class ExtractiveAnswerer:
+    """
+    Responde sin LLM a partir de lo que la búsqueda ya recuperó.
+
+    - FAQ: con un match alto o medio (o sin documentos) se devuelve la
+      respuesta de la mejor FAQ tal como está escrita.
+    - Documentos: cada documento se divide en oraciones con el
+      ContextCompressor (comparte su caché de oraciones embebidas), se toma
+      la oración más cercana a la consulta con sus vecinas y el título de su
+      sección, y se devuelven los mejores pasajes con su archivo de origen.
+
+    Es la respuesta de respaldo cuando el LLM falla o no responde a tiempo,
+    y la del modo explícito 'extractive' (baja latencia, sin costo de tokens).
+    """
+
+    DEFAULT_MAX_PASSAGES = 3
+    DEFAULT_NEIGHBORS = 1
+    PASSAGES_INTRO = "Estos son los fragmentos más relevantes que encontré en los documentos:"
+    NO_RESULTS_ANSWER = "No se encontraron documentos relevantes para tu pregunta."
+
+    def __init__(
+        self,
+        compressor,
+        fallback_enabled: Optional[bool] = None,
+        max_passages: Optional[int] = None,
+        neighbors: Optional[int] = None
+    ):
+        """
+        Inicializa el motor extractivo (los valores omitidos se leen de .env)
+
+        Args:
+            compressor: ContextCompressor (divide y embebe oraciones, con caché)
+            fallback_enabled: Responder de forma extractiva si falla el LLM
+                (EXTRACTIVE_FALLBACK_ENABLED)
+            max_passages: Pasajes como máximo en la respuesta (EXTRACTIVE_MAX_PASSAGES)
+            neighbors: Oraciones vecinas a cada lado de la elegida (EXTRACTIVE_NEIGHBORS)
+        """
+        load_dotenv()
+
+        if fallback_enabled is None:
+            fallback_enabled = os.getenv('EXTRACTIVE_FALLBACK_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        if max_passages is None:
+            max_passages = int(os.getenv('EXTRACTIVE_MAX_PASSAGES', self.DEFAULT_MAX_PASSAGES))
+        if neighbors is None:
+            neighbors = int(os.getenv('EXTRACTIVE_NEIGHBORS', self.DEFAULT_NEIGHBORS))
+
+        self.compressor = compressor
+        self.fallback_enabled = fallback_enabled
+        self.max_passages = max(1, max_passages)
+        self.neighbors = max(0, neighbors)
+
+    @staticmethod
+    def _base_source(source: str) -> str:
+        """Archivo de origen de un chunk ("Becas.md_chunk_3" -> "Becas.md")"""
+        return re.sub(r'_chunk_\d+$', '', source)
+
+    def select_passages(
+        self,
+        query_embedding: np.ndarray,
+        documents: List[Tuple[str, str, float]]
+    ) -> List[Tuple[str, str, float]]:
+        """
+        Elige el mejor pasaje de cada documento y los ordena por similitud
+
+        Args:
+            query_embedding: Embedding normalizado de la consulta
+            documents: Lista de (source, content, score)
+
+        Returns:
+            Lista de (archivo de origen, pasaje, similitud) de mayor a menor similitud
+        """
+        if not documents:
+            return []
+
+        prepared = self.compressor.embed_documents([(source, content) for source, content, _ in documents])
+
+        passages = []
+        for (source, _, _), (units, embeddings) in zip(documents, prepared):
+            candidates = [index for index, unit in enumerate(units) if not unit["is_heading"]]
+            if not candidates:
+                continue
+
+            scores = embeddings @ query_embedding
+            best = max(candidates, key=lambda index: scores[index])
+
+            start = max(0, best - self.neighbors)
+            end = min(len(units), best + self.neighbors + 1)
+            keep = set(range(start, end))
+            if units[best]["heading"] is not None:
+                keep.add(units[best]["heading"])
+
+            passage = self.compressor.render(units, sorted(keep))
+            passages.append((self._base_source(source), passage, float(scores[best])))
+
+        passages.sort(key=lambda passage: passage[2], reverse=True)
+        return passages[:self.max_passages]
+
+    def answer(
+        self,
+        query_embedding: Optional[np.ndarray],
+        match_type: str,
+        faq_entries: List[Dict],
+        faq_results: List[Tuple[str, str, float]],
+        doc_results: List[Tuple[str, str, float]]
+    ) -> Dict:
+        """
+        Arma la respuesta extractiva
+
+        Args:
+            query_embedding: Embedding normalizado de la consulta
+            match_type: 'high', 'medium', 'low' o 'none'
+            faq_entries: Registros de FAQ (pregunta coincidente y respuesta)
+            faq_results: FAQs recuperadas (filename, content, similarity)
+            doc_results: Documentos recuperados (filename, content, score)
+
+        Returns:
+            Diccionario con:
+            - answer: texto de la respuesta
+            - method: 'faq', 'passages' o 'none'
+            - sources: archivos citados
+        """
+        if faq_entries and (match_type in ('high', 'medium') or not doc_results):
+            entry = faq_entries[0]
+            return {"answer": entry['answer'], "method": "faq", "sources": [entry['filename']]}
+
+        # Sin registros por pregunta (flujo anterior), las FAQs son documentos más
+        documents = list(doc_results) if faq_entries else list(faq_results) + list(doc_results)
+        passages = self.select_passages(query_embedding, documents) if query_embedding is not None else []
+        if not passages:
+            return {"answer": self.NO_RESULTS_ANSWER, "method": "none", "sources": []}
+
+        blocks = [f"{passage}\n(Fuente: {source})" for source, passage, _ in passages]
+        return {
+            "answer": "\n\n".join([self.PASSAGES_INTRO] + blocks),
+            "method": "passages",
+            "sources": [source for source, _, _ in passages]
+        }
+
+
+if __name__ == "__main__":
+    # Test con el modelo BGE-M3
+    import sys
+    from pathlib import Path
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from embeddings.embedder import Embedder
+    from rag.context_compressor import ContextCompressor
+
+    embedder = Embedder()
+    answerer = ExtractiveAnswerer(ContextCompressor(embedder, embedder.count_tokens))
+
+    documents = [
+        ("services/Becas.md_chunk_0",
+         "# Becas\n\nLa VOAE administra varios programas de apoyo. "
+         "Las becas de excelencia académica requieren un índice mínimo de 80%. "
+         "La solicitud se presenta durante las dos primeras semanas del período.", 0.71),
+        ("services/Comedor.md", "# Comedor\n\nEl comedor universitario abre de 7:00 a 19:00. "
+                                "Los estudiantes becados reciben almuerzo gratuito.", 0.55)
+    ]
+
+    question = "¿Qué índice necesito para la beca de excelencia?"
+    result = answerer.answer(embedder.generate_embedding(question), "low", [], [], documents)
+    print(f"[{result['method']}] {result['sources']}\n{result['answer']}")
@@ -1,58 +1,155 @@
 """
-Módulo para manejar el sistema FAQ híbrido con umbrales dobles (90%/80%)
+Módulo para manejar el sistema FAQ híbrido con umbrales dobles (75%/65%)
 """
 import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from typing import List, Tuple, Optional, Dict
+import os
+import numpy as np
+from dotenv import load_dotenv
 from rag.retriever import DocumentRetriever
 from database.repository import DocumentRepository
 from embeddings.embedder import Embedder
+from ingestion.faq_parser import FAQParser
 
 
 class FAQHandler:
     """
     Maneja la lógica de FAQs con sistema de umbrales dobles:
-    - >= 90%: Match fuerte (solo FAQs)
-    - 80-89%: Match medio (FAQs + documentos)
-    - < 80%: Sin match (solo documentos - flujo original)
+    - >= 75%: Match fuerte (solo FAQs)
+    - 65-74%: Match medio (FAQs + documentos)
+    - < 65%: Sin match (solo documentos - flujo original)
+
+    La consulta se compara contra cada variante de pregunta indexada
+    (preguntas cortas contra preguntas cortas), no contra archivos completos.
     """
 
     # Umbrales de similitud
     HIGH_THRESHOLD = 0.75  # Match fuerte
     MEDIUM_THRESHOLD = 0.65  # Match medio
 
-    def __init__(self, repository: DocumentRepository, embedder: Embedder):
+    # Respuesta directa (sin LLM) para matches fuertes
+    DIRECT_ANSWER_ENABLED = True
+    # Plantilla opcional antes de la respuesta, ej: "Sobre \"{question}\":\n\n"
+    DIRECT_ANSWER_INTRO = ""
+
+    def __init__(
+        self,
+        repository: DocumentRepository,
+        embedder: Embedder,
+        direct_answer: Optional[bool] = None,
+        direct_answer_intro: Optional[str] = None
+    ):
         """
         Inicializa el handler de FAQs
 
         Args:
             repository: Repositorio de documentos
             embedder: Generador de embeddings
+            direct_answer: Si es True, los matches fuertes se responden con el texto
+                de la FAQ sin llamar al LLM (por defecto, FAQ_DIRECT_ANSWER)
+            direct_answer_intro: Plantilla de introducción para la respuesta directa;
+                admite {question} (por defecto, FAQ_DIRECT_ANSWER_INTRO)
         """
         self.retriever = DocumentRetriever(repository, embedder)
         self.repository = repository
+        self.embedder = embedder
+        load_dotenv()
+
+        if direct_answer is None:
+            direct_answer = os.getenv(
+                'FAQ_DIRECT_ANSWER', str(self.DIRECT_ANSWER_ENABLED)
+            ).lower() in ('1', 'true', 'yes')
+        if direct_answer_intro is None:
+            direct_answer_intro = os.getenv('FAQ_DIRECT_ANSWER_INTRO', self.DIRECT_ANSWER_INTRO)
+
+        self.direct_answer = direct_answer
+        self.direct_answer_intro = direct_answer_intro
 
-    def classify_query(self, query: str, top_k: int = 5) -> Dict:
+    def classify_query(
+        self,
+        query: str,
+        top_k: int = 5,
+        query_embedding: Optional[np.ndarray] = None
+    ) -> Dict:
         """
         Clasifica la consulta según similitud con FAQs
 
         Args:
             query: Pregunta del usuario
             top_k: Número máximo de FAQs a recuperar
+            query_embedding: Embedding de la consulta si ya fue calculado
 
         Returns:
             Diccionario con:
-            - match_type: 'high' (>=90%), 'medium' (80-89%), 'low' (<80%)
-            - faq_results: Lista de FAQs relevantes
+            - match_type: 'high' (>=75%), 'medium' (65-74%), 'low' (<65%)
+            - faq_results: Lista de FAQs relevantes (filename, content, similarity)
+            - faq_entries: Registros de las FAQs (pregunta coincidente y respuesta)
             - best_similarity: Mejor score de similitud
         """
+        if query_embedding is None:
+            query_embedding = self.embedder.generate_embedding(query)
+
+        # Bases ingeridas antes del índice por pregunta: usar el flujo anterior
+        if self.repository.count_faq_questions() == 0:
+            return self._classify_by_documents(query, top_k, query_embedding)
+
+        # Buscar variantes de preguntas (varias variantes pueden apuntar a la misma FAQ)
+        matches = self.repository.search_faq_questions(query_embedding, top_k=top_k * 3)
+
+        best_by_answer = {}
+        for answer_id, question, score in matches:
+            if score < self.MEDIUM_THRESHOLD:
+                continue
+            if answer_id not in best_by_answer:
+                best_by_answer[answer_id] = (question, score)
+
+        answer_ids = list(best_by_answer.keys())[:top_k]
+        answers = self.repository.get_faq_answers(answer_ids)
+
+        faq_entries = []
+        for answer_id in answer_ids:
+            if answer_id not in answers:
+                continue
+            question, score = best_by_answer[answer_id]
+            entry = dict(answers[answer_id])
+            entry['matched_question'] = question
+            entry['similarity'] = score
+            faq_entries.append(entry)
+
+        faq_results = [
+            (entry['filename'], FAQParser.format_entry(entry), entry['similarity'])
+            for entry in faq_entries
+        ]
+
+        return self._build_classification(faq_results, faq_entries)
+
+    def _classify_by_documents(
+        self,
+        query: str,
+        top_k: int = 5,
+        query_embedding: Optional[np.ndarray] = None
+    ) -> Dict:
+        """
+        Clasifica la consulta comparándola con los archivos FAQ completos
+        (flujo anterior, para bases sin índice de preguntas)
+
+        Args:
+            query: Pregunta del usuario
+            top_k: Número máximo de FAQs a recuperar
+            query_embedding: Embedding de la consulta si ya fue calculado
+
+        Returns:
+            Diccionario con el mismo formato que classify_query
+        """
         # Buscar en TODOS los documentos primero
         all_results = self.retriever.retrieve_with_threshold(
             query=query,
             threshold=self.MEDIUM_THRESHOLD,
-            max_documents=top_k * 2  # Buscar más para tener suficientes FAQs
+            max_documents=top_k * 2,  # Buscar más para tener suficientes FAQs
+            query_embedding=query_embedding
         )
 
         # Filtrar SOLO los que están en carpeta faq/
@@ -63,12 +160,28 @@ class FAQHandler:
         ]
 
         # Limitar a top_k
-        faq_results = faq_results[:top_k]
+        return self._build_classification(faq_results[:top_k], [])
+
+    def _build_classification(
+        self,
+        faq_results: List[Tuple[str, str, float]],
+        faq_entries: List[Dict]
+    ) -> Dict:
+        """
+        Determina el tipo de match a partir de los resultados FAQ
+
+        Args:
+            faq_results: Lista de (filename, content, similarity) ordenada por similitud
+            faq_entries: Registros de FAQ correspondientes (vacío en el flujo anterior)
 
+        Returns:
+            Diccionario de clasificación
+        """
         if not faq_results:
             return {
                 'match_type': 'low',
                 'faq_results': [],
+                'faq_entries': [],
                 'best_similarity': 0.0
             }
 
@@ -85,54 +198,91 @@ class FAQHandler:
         return {
             'match_type': match_type,
             'faq_results': faq_results,
+            'faq_entries': faq_entries,
             'best_similarity': best_similarity
         }
 
-    def get_context_for_llm(
+    def get_direct_answer(self, classification: Dict) -> Optional[str]:
+        """
+        Obtiene la respuesta almacenada de la FAQ para responder sin LLM
+
+        Solo aplica a matches fuertes con registros de FAQ por pregunta
+        (el flujo anterior por archivo completo no tiene respuestas separadas).
+
+        Args:
+            classification: Resultado de classify_query
+
+        Returns:
+            Texto de la respuesta, o None si no aplica la respuesta directa
+        """
+        if not self.direct_answer or classification.get('match_type') != 'high':
+            return None
+
+        entries = classification.get('faq_entries') or []
+        if not entries:
+            return None
+
+        entry = entries[0]
+        intro = self.direct_answer_intro.format(question=entry['title']) if self.direct_answer_intro else ""
+        return f"{intro}{entry['answer']}"
+
+    def select_context(
         self,
-        query: str,
         match_type: str,
         faq_results: List[Tuple[str, str, float]],
         doc_results: Optional[List[Tuple[str, str, float]]] = None
-    ) -> Tuple[List[str], str]:
+    ) -> Tuple[List[Tuple[str, str, float]], str]:
         """
-        Prepara el contexto apropiado para el LLM según el tipo de match
+        Selecciona los resultados que forman el contexto según el tipo de match
 
         Args:
-            query: Pregunta del usuario
             match_type: Tipo de match ('high', 'medium', 'low')
             faq_results: Resultados de FAQs
             doc_results: Resultados de documentos (opcional)
 
         Returns:
-            Tupla (context_documents, context_type)
-            - context_documents: Lista de strings con el contexto
+            Tupla (selected, context_type)
+            - selected: Lista de (source, content, score) en orden de relevancia
             - context_type: 'faq_only', 'faq_and_docs', 'docs_only'
         """
         if match_type == 'high':
             # Match fuerte: Solo top-3 FAQs
-            context = [content for _, content, _ in faq_results[:3]]
-            return context, 'faq_only'
+            return list(faq_results[:3]), 'faq_only'
 
         elif match_type == 'medium':
             # Match medio: Top-2 FAQs + Top-2 Docs
-            faq_context = [content for _, content, _ in faq_results[:2]]
-
+            selected = list(faq_results[:2])
             if doc_results:
-                doc_context = [content for _, content, _ in doc_results[:2]]
-                context = faq_context + doc_context
-            else:
-                context = faq_context
-
-            return context, 'faq_and_docs'
+                selected += doc_results[:2]
+            return selected, 'faq_and_docs'
 
         else:
             # Match bajo: Solo documentos
-            if doc_results:
-                context = [content for _, content, _ in doc_results]
-            else:
-                context = []
-            return context, 'docs_only'
+            return list(doc_results or []), 'docs_only'
+
+    def get_context_for_llm(
+        self,
+        query: str,
+        match_type: str,
+        faq_results: List[Tuple[str, str, float]],
+        doc_results: Optional[List[Tuple[str, str, float]]] = None
+    ) -> Tuple[List[str], str]:
+        """
+        Prepara el contexto apropiado para el LLM según el tipo de match
+
+        Args:
+            query: Pregunta del usuario
+            match_type: Tipo de match ('high', 'medium', 'low')
+            faq_results: Resultados de FAQs
+            doc_results: Resultados de documentos (opcional)
+
+        Returns:
+            Tupla (context_documents, context_type)
+            - context_documents: Lista de strings con el contexto
+            - context_type: 'faq_only', 'faq_and_docs', 'docs_only'
+        """
+        selected, context_type = self.select_context(match_type, faq_results, doc_results)
+        return [content for _, content, _ in selected], context_type
 
     def format_faq_for_display(
         self,
@@ -0,0 +1,230 @@
+"""
+Módulo de intenciones conversacionales (saludos, agradecimientos, despedidas,
+ayuda) que se responden localmente, sin búsqueda ni llamada al LLM
+"""
+import os
+import re
+import threading
+import unicodedata
+from typing import Dict, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+
+# Respuesta local, reglas (sobre el texto normalizado completo) y prototipos de cada intención
+INTENTS = {
+    "greeting": {
+        "response": "¡Hola! Soy el asistente universitario. ¿En qué te puedo ayudar? "
+                    "Puedes preguntarme sobre trámites, becas, servicios de la VOAE y más.",
+        "pattern": r"(hola+|holi|buen(os|as) (dias|tardes|noches)|buenas|saludos|hey|que tal|"
+                   r"hola (como estas|que tal|buen(os|as) (dias|tardes|noches)))",
+        "prototypes": ["hola", "buenos días", "buenas tardes", "buenas noches", "hola, ¿cómo estás?",
+                       "qué tal", "saludos"]
+    },
+    "thanks": {
+        "response": "¡Con gusto! Si tienes otra pregunta, aquí estoy.",
+        "pattern": r"((muchas|mil) )?gracias( (por (todo|la ayuda|tu ayuda)|mil))?|te agradezco|"
+                   r"ok gracias|(perfecto|excelente|genial|listo),? gracias",
+        "prototypes": ["gracias", "muchas gracias", "gracias por la ayuda", "te lo agradezco",
+                       "mil gracias", "perfecto, gracias"]
+    },
+    "goodbye": {
+        "response": "¡Hasta luego! Vuelve cuando necesites más información.",
+        "pattern": r"(adios|chao|chau|hasta (luego|pronto|manana)|nos vemos|bye)",
+        "prototypes": ["adiós", "hasta luego", "nos vemos", "chao", "hasta pronto"]
+    },
+    "acknowledgement": {
+        "response": "Perfecto. ¿Hay algo más en lo que te pueda ayudar?",
+        "pattern": r"(ok|okay|okey|vale|entendido|de acuerdo|perfecto|excelente|genial|listo|bien|"
+                   r"muy bien|esta bien|ya entendi|claro|si|ah ok)",
+        "prototypes": ["ok", "entendido", "de acuerdo", "perfecto", "ya entendí", "está bien"]
+    },
+    "help": {
+        "response": "Puedo responder preguntas sobre la universidad usando las FAQs y los documentos "
+                    "cargados: becas, matrícula, servicios de la VOAE, horas VOAE, ubicaciones y más. "
+                    "Escribe tu pregunta con el mayor detalle posible.",
+        "pattern": r"(ayuda|help|que puedes hacer|en que me (puedes|podes) ayudar|como funcionas|"
+                   r"quien eres|que eres)",
+        "prototypes": ["ayuda", "¿qué puedes hacer?", "¿en qué me puedes ayudar?", "¿quién eres?",
+                       "¿cómo funcionas?"]
+    }
+}
+
+
+class IntentClassifier:
+    """
+    Detecta mensajes conversacionales que no necesitan RAG.
+
+    Dos niveles, ambos antes de la búsqueda:
+    - Reglas: el mensaje normalizado coincide completo con el patrón de una
+      intención ("hola", "muchas gracias"). No necesita embedding.
+    - Centroides: para mensajes cortos, el embedding de la consulta (que el
+      pipeline ya calcula) se compara con el promedio de los prototipos de
+      cada intención, embebidos una sola vez al iniciar.
+
+    Un mensaje con contenido ("hola, ¿cuándo es la matrícula?") no coincide
+    con ninguna regla y supera el largo máximo para los centroides, así que
+    sigue el flujo normal.
+    """
+
+    DEFAULT_SIMILARITY_THRESHOLD = 0.80
+    DEFAULT_MAX_WORDS = 5  # Mensajes más largos no se comparan con los centroides
+
+    def __init__(
+        self,
+        embedder=None,
+        enabled: Optional[bool] = None,
+        similarity_threshold: Optional[float] = None,
+        max_words: Optional[int] = None
+    ):
+        """
+        Inicializa el clasificador (los valores omitidos se leen de .env)
+
+        Args:
+            embedder: Embedder para los centroides (sin él solo se usan las reglas)
+            enabled: Activa las respuestas locales (INTENTS_ENABLED)
+            similarity_threshold: Similitud mínima con un centroide (INTENT_SIMILARITY_THRESHOLD)
+            max_words: Palabras máximas para comparar con los centroides (INTENT_MAX_WORDS)
+        """
+        load_dotenv()
+
+        if enabled is None:
+            enabled = os.getenv('INTENTS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        if similarity_threshold is None:
+            similarity_threshold = float(
+                os.getenv('INTENT_SIMILARITY_THRESHOLD', self.DEFAULT_SIMILARITY_THRESHOLD)
+            )
+        if max_words is None:
+            max_words = int(os.getenv('INTENT_MAX_WORDS', self.DEFAULT_MAX_WORDS))
+
+        self.enabled = enabled
+        self.similarity_threshold = similarity_threshold
+        self.max_words = max_words
+
+        self._patterns = {
+            name: re.compile(rf"^(?:{intent['pattern']})$") for name, intent in INTENTS.items()
+        }
+
+        self._lock = threading.Lock()
+        self.hits = {name: 0 for name in INTENTS}
+
+        # Centroides normalizados: una fila por intención
+        self._names = list(INTENTS)
+        self._centroids = None
+        if enabled and embedder is not None:
+            self._centroids = self._build_centroids(embedder)
+
+    def _build_centroids(self, embedder) -> np.ndarray:
+        """Embebe todos los prototipos en una sola llamada y promedia por intención"""
+        prototypes = [(name, text) for name in self._names for text in INTENTS[name]["prototypes"]]
+        embeddings = np.asarray(embedder.generate_embeddings_batch([text for _, text in prototypes]))
+
+        centroids = []
+        for name in self._names:
+            rows = [embeddings[i] for i, (intent, _) in enumerate(prototypes) if intent == name]
+            centroid = np.mean(rows, axis=0)
+            centroids.append(centroid / np.linalg.norm(centroid))
+        return np.vstack(centroids).astype('float32')
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        """
+        Normaliza un mensaje para las reglas: minúsculas, sin tildes ni signos
+
+        Args:
+            message: Mensaje del usuario
+
+        Returns:
+            Mensaje normalizado ("¡Buenos días!" -> "buenos dias")
+        """
+        text = unicodedata.normalize('NFKD', message.casefold())
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+        text = re.sub(r'[^\w\s]', ' ', text)
+        return re.sub(r'\s+', ' ', text).strip()
+
+    def match_rules(self, message: str) -> Optional[str]:
+        """
+        Busca una intención por reglas (sin embedding)
+
+        Args:
+            message: Mensaje del usuario
+
+        Returns:
+            Nombre de la intención o None
+        """
+        if not self.enabled:
+            return None
+
+        text = self.normalize(message)
+        for name, pattern in self._patterns.items():
+            if pattern.match(text):
+                return name
+        return None
+
+    def match_embedding(self, message: str, query_embedding: np.ndarray) -> Optional[str]:
+        """
+        Busca una intención por similitud con los centroides
+
+        Args:
+            message: Mensaje del usuario
+            query_embedding: Embedding normalizado del mensaje
+
+        Returns:
+            Nombre de la intención o None
+        """
+        if not self.enabled or self._centroids is None:
+            return None
+        if len(self.normalize(message).split()) > self.max_words:
+            return None
+
+        similarities = self._centroids @ query_embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        return self._names[best]
+
+    def respond(self, intent: str) -> Dict:
+        """
+        Construye la respuesta local de una intención y cuenta el hit
+
+        Args:
+            intent: Nombre de la intención
+
+        Returns:
+            Resultado con el mismo formato que query_with_faq
+        """
+        with self._lock:
+            self.hits[intent] += 1
+
+        return {
+            "answer": INTENTS[intent]["response"],
+            "relevant_documents": [],
+            "match_type": "none",
+            "context_type": "intent",
+            "intent": intent,
+            "error": None
+        }
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas del clasificador
+
+        Returns:
+            Diccionario con estado y hits por intención
+        """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'centroids': self._centroids is not None,
+                'hits': dict(self.hits)
+            }
+
+
+if __name__ == "__main__":
+    # Test de las reglas (sin modelo)
+    classifier = IntentClassifier()
+
+    for message in ["Hola", "¡Buenos días!", "muchas gracias", "Ok", "adiós", "¿Qué puedes hacer?",
+                    "Hola, ¿cuándo es la matrícula?", "¿Qué becas ofrece la VOAE?"]:
+        print(f"{message:34} -> {classifier.match_rules(message)}")
@@ -6,53 +6,175 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 import os
-from typing import List, Optional
+import time
+import asyncio
+import threading
+from dotenv import load_dotenv
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
 from embeddings.embedder import Embedder
 from database.chroma_vector_store import ChromaVectorStore
 from database.repository import DocumentRepository
 from ingestion.ingest_docs import DocumentIngestion
-from llm.deepseek_client import DeepSeekClient
-from llm.groq_client import GroqClient
+from llm.deepseek_client import AsyncDeepSeekClient
+from llm.groq_client import AsyncGroqClient
+from llm.response_cache import LLMResponseCache
+from llm.router import LLMRouter
+from llm.model_routing import ModelRoutingPolicy
+from llm.tokenizer import get_token_counter
+from llm.prompts import stable_context_order
 from rag.retriever import DocumentRetriever
 from rag.faq_handler import FAQHandler
+from rag.semantic_cache import SemanticCache
+from rag.concurrency import run_cpu
+from rag.single_flight import SingleFlight, normalize_question
+from rag.context_builder import ContextBuilder
+from rag.context_compressor import ContextCompressor
+from rag.retrieval_reuse import SessionRetrievalCache
+from rag.intents import IntentClassifier
+from rag.admission import AdmissionRejected, get_admission_controller, track_queue_times
+from rag.deadline import DEGRADATIONS, Deadline, DeadlinePolicy
+from rag.extractive import ExtractiveAnswerer
+from monitoring.metrics import get_metrics
+from monitoring.tracing import RequestTrace, get_tracer
+from monitoring.logger import get_logger
+
+logger = get_logger("rag.pipeline")
 
 
 class RAGPipeline:
     """Pipeline completo para el sistema RAG"""
 
-    def __init__(self, docs_folder: str = "data/docs", llm_provider: str = "deepseek"):
+    # Proveedores soportados y la variable con su API key
+    LLM_PROVIDERS = {"groq": "GROQ_API_KEY", "deepseek": "DEEPSEEK_API_KEY"}
+    # generative: respuesta del LLM; extractive: FAQ o pasajes recuperados, sin LLM
+    ANSWER_MODES = ("generative", "extractive")
+    # Campos propios de cada petición: no se guardan en la caché semántica
+    REQUEST_FIELDS = ("model_route", "context_stats", "retrieval_decision", "degradations", "deadline", "queue_ms", "timings")
+
+    def __init__(
+        self,
+        docs_folder: str = "data/docs",
+        llm_provider: str = "deepseek",
+        semantic_cache: Optional[SemanticCache] = None,
+        embedder: Optional[Embedder] = None
+    ):
         """
         Inicializa el pipeline RAG con ChromaDB
 
         Args:
             docs_folder: Carpeta con los documentos markdown
             llm_provider: Proveedor de LLM ("groq" o "deepseek")
+            semantic_cache: Caché semántica de respuestas (opcional, se crea una por defecto)
+            embedder: Embedder ya cargado para compartir el modelo entre pipelines (opcional)
         """
-        print("Inicializando pipeline RAG...")
+        logger.info("pipeline.init", "Inicializando pipeline RAG", llm_provider=llm_provider)
+        load_dotenv()
 
         # Inicializar componentes
-        self.embedder = Embedder()
+        self.embedder = embedder if embedder is not None else Embedder()
         self.storage = ChromaVectorStore()
         self.storage_type = "chroma"
-        print("🔷 Usando ChromaDB para almacenamiento vectorial")
 
         self.repository = DocumentRepository(self.storage)
-        self.ingestion = DocumentIngestion(docs_folder)
+        self.ingestion = DocumentIngestion(docs_folder, token_counter=self.embedder.count_tokens)
         self.retriever = DocumentRetriever(self.repository, self.embedder)
         self.faq_handler = FAQHandler(self.repository, self.embedder)
+        # Saludos, agradecimientos y despedidas se responden sin RAG ni LLM
+        self.intent_classifier = IntentClassifier(self.embedder)
+
+        # Caché semántica: se invalida por documento fuente y por generación del índice.
+        # La generación avanza también cuando otro proceso cambia el sello del índice
+        self.semantic_cache = semantic_cache if semantic_cache is not None else SemanticCache()
+        self.index_generation = 0
+        self._index_stamp = self.repository.get_index_stamp()
+        self._generation_lock = threading.Lock()
 
-        # Inicializar LLM según el proveedor
+        # Preguntas idénticas simultáneas comparten un solo cálculo
+        self.single_flight = SingleFlight()
+
+        # Caché exacta de prompts en disco (compartida entre procesos del nodo)
+        self.llm_response_cache = LLMResponseCache()
+
+        # Inicializar LLM según el proveedor. El router reintenta, hace failover
+        # al otro proveedor (si tiene API key) y opcionalmente hedging
         self.llm_provider = llm_provider.lower()
-        if self.llm_provider == "groq":
-            self.llm_client = GroqClient(model="llama-3.3-70b-versatile")
-            print("✨ Usando Groq API con Llama 3.3 70B (ultra-rápido)")
-        elif self.llm_provider == "deepseek":
-            self.llm_client = DeepSeekClient()
-            print("🔷 Usando DeepSeek API")
-        else:
+        if self.llm_provider not in self.LLM_PROVIDERS:
             raise ValueError(f"LLM provider no soportado: {llm_provider}. Usa 'groq' o 'deepseek'")
 
-        print("Pipeline RAG inicializado exitosamente\n")
+        clients = [(self.llm_provider, self._create_llm_client(self.llm_provider))]
+        if os.getenv('LLM_FALLBACK_ENABLED', 'true').lower() in ('1', 'true', 'yes'):
+            for provider, key_variable in self.LLM_PROVIDERS.items():
+                if provider != self.llm_provider and os.getenv(key_variable):
+                    clients.append((provider, self._create_llm_client(provider)))
+                    logger.info("pipeline.fallback_provider", f"Proveedor alternativo: {provider}", provider=provider)
+
+        # Límites de concurrencia por etapa (embedding y cada proveedor), compartidos por el proceso
+        self.admission = get_admission_controller()
+        self.llm_client = LLMRouter(clients, admission=self.admission)
+
+        # Modelo y tope de tokens según el tipo y tamaño del contexto
+        self.routing_policy = ModelRoutingPolicy()
+        # Presupuesto de latencia por petición y degradaciones cuando no alcanza
+        self.deadline_policy = DeadlinePolicy()
+
+        # Contexto dentro de un presupuesto de tokens, contados con el tokenizer del modelo
+        self.context_builder = ContextBuilder(get_token_counter(self.llm_client.model).count)
+        # Compresión extractiva opcional: solo las oraciones relevantes de cada documento
+        self.context_compressor = ContextCompressor(self.embedder, self.context_builder.count_tokens)
+        # Respuestas sin LLM (modo extractive y respaldo si el LLM falla o no llega a tiempo)
+        self.extractive = ExtractiveAnswerer(self.context_compressor)
+        self.metrics = get_metrics()
+        # Tiempos por etapa de cada petición (en la respuesta y en el archivo de trazas)
+        self.tracer = get_tracer()
+        self.metrics.describe(
+            "rag_context_dropped_tokens_total",
+            "Tokens de contexto descartados por presupuesto o por duplicados"
+        )
+        self.metrics.describe(
+            "rag_intent_hits_total",
+            "Mensajes respondidos localmente por intención y método (rule o centroid)"
+        )
+        self.metrics.describe(
+            "rag_followup_retrieval_total",
+            "Búsquedas de turnos con sesión según la decisión (reuse, extend o fresh)"
+        )
+        self.metrics.describe(
+            "rag_degradations_total",
+            "Degradaciones aplicadas por falta de presupuesto de latencia"
+        )
+        self.metrics.describe(
+            "rag_extractive_answers_total",
+            "Respuestas extractivas sin LLM por motivo (mode, deadline, timeout o llm_error)"
+        )
+
+        logger.info(
+            "pipeline.ready", "Pipeline RAG inicializado",
+            llm_provider=self.llm_provider, storage=self.storage_type
+        )
+
+    def _create_llm_client(self, provider: str):
+        """
+        Crea el cliente de un proveedor de LLM
+
+        Los clientes asíncronos conservan los métodos síncronos, así que
+        sirven a la CLI y a la API por igual.
+
+        Args:
+            provider: "groq" o "deepseek"
+
+        Returns:
+            AsyncGroqClient o AsyncDeepSeekClient
+        """
+        if provider == "groq":
+            client = AsyncGroqClient(
+                model="llama-3.3-70b-versatile",
+                response_cache=self.llm_response_cache
+            )
+        else:
+            client = AsyncDeepSeekClient(response_cache=self.llm_response_cache)
+        logger.info("pipeline.llm_client", f"Cliente LLM: {provider}", provider=provider, model=client.model)
+
+        return client
 
     def ingest_documents(self, chunk_documents: bool = False, skip_existing: bool = True):
         """
@@ -66,18 +188,23 @@ class RAGPipeline:
         print("INICIANDO INGESTION DE DOCUMENTOS")
         print("=" * 60)
 
-        # Cargar y procesar documentos
-        documents = self.ingestion.process_documents(chunk_documents=chunk_documents)
+        # Cargar y procesar documentos (las FAQs se indexan por separado)
+        documents = self.ingestion.process_documents(
+            chunk_documents=chunk_documents,
+            include_faq=False
+        )
+        faq_files = self.ingestion.process_faq_documents()
 
-        if not documents:
+        if not documents and not faq_files:
             print("No hay documentos para procesar")
             return
 
         # Procesar cada documento
         processed_count = 0
         skipped_count = 0
+        changed_files = []
 
-        for filename, content in documents:
+        for filename, content, metadata in documents:
             # Verificar si ya existe
             if skip_existing and self.repository.document_exists(filename):
                 print(f"⏭️  Saltando '{filename}' (ya existe)")
@@ -87,36 +214,138 @@ class RAGPipeline:
             try:
                 # Generar embedding
                 print(f"\n📝 Procesando: {filename}")
-                embedding = self.embedder.generate_embedding(content)
+
+                # Los chunks se embeben junto con su ruta de encabezados para
+                # que conserven el contexto de la sección a la que pertenecen
+                heading_path = metadata.get("heading_path")
+                embedding_text = f"{heading_path}\n\n{content}" if heading_path else content
+                embedding = self.embedder.generate_embedding(embedding_text)
 
                 # Convertir a bytes
                 embedding_bytes = self.embedder.embedding_to_bytes(embedding)
 
                 # Guardar en base de datos
-                self.repository.insert_document(filename, content, embedding_bytes)
+                self.repository.insert_document(filename, content, embedding_bytes, metadata)
                 processed_count += 1
+                changed_files.append(filename)
 
             except Exception as e:
                 print(f"❌ Error procesando {filename}: {str(e)}")
                 continue
 
+        faq_count, changed_faq_files = self._ingest_faq_files(faq_files, skip_existing=skip_existing)
+        changed_files.extend(changed_faq_files)
+
+        # Descartar respuestas en caché que dependían de documentos modificados
+        if changed_files:
+            self._advance_index_generation(changed_files)
+
         print("\n" + "=" * 60)
         print(f"INGESTION COMPLETADA")
         print(f"Documentos procesados: {processed_count}")
         print(f"Documentos saltados: {skipped_count}")
+        print(f"FAQs indexadas: {faq_count}")
         print(f"Total en base de datos: {self.repository.count_documents()}")
+        print(f"Variantes de preguntas FAQ: {self.repository.count_faq_questions()}")
         print("=" * 60)
 
+    def _advance_index_generation(self, changed_files: List[str]):
+        """
+        Avanza la generación del índice e invalida la caché de los documentos modificados
+
+        Args:
+            changed_files: Documentos insertados o reemplazados
+        """
+        invalidated = self.semantic_cache.invalidate_sources(changed_files)
+        stamp = self.repository.touch_index_stamp()
+        with self._generation_lock:
+            self._index_stamp = stamp
+            self.index_generation += 1
+            self.semantic_cache.advance_generation(self.index_generation)
+        print(f"Caché semántica: {invalidated} respuestas invalidadas")
+
+    def _sync_index_generation(self) -> int:
+        """
+        Generación del índice, comprobada contra el sello compartido en ChromaDB
+
+        Si otro proceso modificó el índice (python src/main.py --ingest) no se
+        sabe qué documentos cambiaron: se avanza la generación y se vacía la
+        caché semántica.
+
+        Returns:
+            Generación actual del índice
+        """
+        stamp = self.repository.get_index_stamp()
+        with self._generation_lock:
+            if stamp != self._index_stamp:
+                self._index_stamp = stamp
+                self.index_generation += 1
+                self.semantic_cache.clear()
+                logger.info(
+                    "cache.index_changed", "El índice cambió en otro proceso: caché semántica vaciada",
+                    generation=self.index_generation
+                )
+            return self.index_generation
+
+    def _ingest_faq_files(self, faq_files: dict, skip_existing: bool = True) -> Tuple[int, List[str]]:
+        """
+        Indexa las FAQs: un vector por variante de pregunta que apunta
+        a un registro de respuesta compartido
+
+        Args:
+            faq_files: Diccionario {filename: lista de FAQs}
+            skip_existing: Si es True, no vuelve a procesar archivos ya indexados
+
+        Returns:
+            Tupla (número de FAQs indexadas, archivos modificados)
+        """
+        indexed_count = 0
+        changed_files = []
+
+        for filename, entries in faq_files.items():
+            if skip_existing and self.repository.faq_file_exists(filename):
+                print(f"⏭️  Saltando FAQs de '{filename}' (ya existen)")
+                continue
+
+            try:
+                # Reemplazar las FAQs anteriores del archivo
+                changed_files.append(filename)
+                self.repository.delete_faq_file(filename)
+
+                for entry in entries:
+                    print(f"\n❓ Indexando FAQ: {entry['title']} ({len(entry['questions'])} variantes)")
+                    question_embeddings = self.embedder.generate_embeddings_batch(entry['questions'])
+                    answer_embedding = self.embedder.generate_embedding(
+                        self.ingestion.faq_parser.format_entry(entry)
+                    )
+                    self.repository.insert_faq_entry(
+                        entry,
+                        self.embedder.embedding_to_bytes(answer_embedding),
+                        question_embeddings
+                    )
+                    indexed_count += 1
+
+            except Exception as e:
+                print(f"❌ Error procesando FAQs de {filename}: {str(e)}")
+                continue
+
+        return indexed_count, changed_files
+
     def query_with_faq(
         self,
         question: str,
         top_k: int = 3,
         temperature: float = 0.7,
         max_tokens: int = 2000,
-        enable_faq: bool = True
+        enable_faq: bool = True,
+        retrieval_query: Optional[str] = None,
+        conversation: Optional[str] = None,
+        retrieval_cache: Optional[SessionRetrievalCache] = None,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
     ) -> dict:
         """
-        Realiza una consulta con sistema FAQ híbrido (umbrales 90%/80%)
+        Realiza una consulta con sistema FAQ híbrido (umbrales 75%/65%)
 
         Args:
             question: Pregunta del usuario
@@ -124,141 +353,1159 @@ class RAGPipeline:
             temperature: Temperatura base (se ajusta según contexto)
             max_tokens: Máximo de tokens en la respuesta
             enable_faq: Si es True, busca en FAQs primero
+            retrieval_query: Consulta para la búsqueda si difiere de la pregunta
+                (pregunta de seguimiento condensada con el tema de la conversación)
+            conversation: Memoria de la conversación para el prompt (opcional)
+            retrieval_cache: Candidatos del turno anterior de la sesión (opcional)
+            latency_budget_ms: Presupuesto de latencia de la petición (None = REQUEST_LATENCY_BUDGET_MS)
+            mode: 'generative' (LLM) o 'extractive' (FAQ o pasajes recuperados, sin LLM)
 
         Returns:
             Diccionario con la respuesta, metadatos y tipo de match
         """
-        print("=" * 60)
-        print("PROCESANDO CONSULTA CON SISTEMA FAQ HÍBRIDO")
-        print("=" * 60)
-        print(f"Pregunta: {question}\n")
+        key = self._single_flight_key(
+            question, top_k, max_tokens, enable_faq, retrieval_query, conversation, retrieval_cache,
+            latency_budget_ms, mode
+        )
+        return self.single_flight.do(
+            key,
+            lambda: self._query_with_faq(
+                question, top_k, max_tokens, enable_faq, retrieval_query, conversation, retrieval_cache,
+                latency_budget_ms, mode
+            )
+        )
+
+    def _query_with_faq(
+        self,
+        question: str,
+        top_k: int,
+        max_tokens: int,
+        enable_faq: bool,
+        retrieval_query: Optional[str] = None,
+        conversation: Optional[str] = None,
+        retrieval_cache: Optional[SessionRetrievalCache] = None,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
+    ) -> dict:
+        """Cuerpo de query_with_faq (sin coalescencia)"""
+        deadline = self.deadline_policy.start(latency_budget_ms)
+        trace = self._start_trace(mode)
+        plan = self._prepare_query(
+            question, top_k, max_tokens, enable_faq, retrieval_query, conversation, retrieval_cache,
+            deadline, mode, trace
+        )
+        if plan["result"] is not None:
+            return self._finish_trace(plan, plan["result"])
+
+        # PASO 6: Generar respuesta con LLM (el cliente espera como mucho lo que
+        # queda del presupuesto)
+        try:
+            timeout = deadline.remaining_seconds() if deadline is not None else None
+            answer = self.llm_client.generate_response(**self._llm_kwargs(plan), timeout=timeout)
+            result = self._finalize_answer(plan, answer)
+
+        except Exception as e:
+            if deadline is not None and (isinstance(e, TimeoutError) or deadline.expired()):
+                # Se agotó el presupuesto esperando al LLM: última degradación
+                logger.warning(
+                    "deadline.llm_timeout", f"Presupuesto agotado esperando al LLM ({deadline.budget_ms:.0f} ms)",
+                    budget_ms=deadline.budget_ms
+                )
+                self._record_route(plan, error=True)
+                self._degrade(plan, "faq_or_extractive")
+                result = self._extractive_result(plan, "timeout")
+            else:
+                result = self._generation_error(plan, e)
+
+        return self._finish_trace(plan, result)
+
+    def query_with_faq_stream(
+        self,
+        question: str,
+        top_k: int = 3,
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        enable_faq: bool = True,
+        retrieval_query: Optional[str] = None,
+        conversation: Optional[str] = None,
+        retrieval_cache: Optional[SessionRetrievalCache] = None,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
+    ) -> Iterator[dict]:
+        """
+        Realiza una consulta con sistema FAQ híbrido emitiendo la respuesta por partes
+
+        Emite eventos en este orden:
+        - {"type": "metadata", "data": {...}}: documentos relevantes y tipo de match
+        - {"type": "token", "data": {"content": "..."}}: fragmentos de la respuesta
+        - {"type": "degradation", "data": {...}}: solo si se agotó el presupuesto
+          de latencia durante el stream (se corta, o se responde de forma extractiva)
+        - {"type": "done", "data": {...}}: resultado completo (igual que query_with_faq)
+
+        Args:
+            question: Pregunta del usuario
+            top_k: Número de documentos relevantes a recuperar
+            temperature: Temperatura base (se ajusta según contexto)
+            max_tokens: Máximo de tokens en la respuesta
+            enable_faq: Si es True, busca en FAQs primero
+            retrieval_query: Consulta para la búsqueda si difiere de la pregunta
+            conversation: Memoria de la conversación para el prompt (opcional)
+            retrieval_cache: Candidatos del turno anterior de la sesión (opcional)
+            latency_budget_ms: Presupuesto de latencia de la petición (None = REQUEST_LATENCY_BUDGET_MS)
+            mode: 'generative' (LLM) o 'extractive' (FAQ o pasajes recuperados, sin LLM)
+
+        Yields:
+            Diccionarios de evento con 'type' y 'data'
+        """
+        deadline = self.deadline_policy.start(latency_budget_ms)
+        trace = self._start_trace(mode)
+        plan = self._prepare_query(
+            question, top_k, max_tokens, enable_faq, retrieval_query, conversation, retrieval_cache,
+            deadline, mode, trace
+        )
+
+        # Respuestas sin LLM (caché, FAQ directa, errores): un solo fragmento
+        if plan["result"] is not None:
+            result = self._finish_trace(plan, plan["result"])
+            yield {"type": "metadata", "data": self._stream_metadata(result)}
+            yield {"type": "token", "data": {"content": result["answer"]}}
+            yield {"type": "done", "data": result}
+            return
+
+        yield {
+            "type": "metadata",
+            "data": self._stream_metadata({
+                "relevant_documents": self._build_relevant_documents(
+                    plan["faq_results"], plan["doc_results"], plan["match_type"]
+                ),
+                "match_type": plan["match_type"],
+                "context_type": plan["context_type"],
+                "best_faq_similarity": plan["best_similarity"]
+            })
+        }
+
+        parts = []
+        stream = self.llm_client.generate_response_stream(**self._llm_kwargs(plan))
+        try:
+            # Sin corrutinas no se puede interrumpir la espera de un token:
+            # el presupuesto se comprueba al llegar cada uno
+            for token in stream:
+                if deadline is not None and deadline.expired():
+                    stream.close()
+                    result, events = self._cut_stream(plan, parts)
+                    yield from events
+                    break
+                if not parts:
+                    trace.record("llm_ttft", plan["llm_started"])
+                parts.append(token)
+                yield {"type": "token", "data": {"content": token}}
+            else:
+                result = self._finalize_answer(plan, "".join(parts).strip())
+
+        except Exception as e:
+            result = self._generation_error(plan, e, fallback=not parts)
+            if parts:
+                # Conservar lo que alcanzó a llegar antes del error
+                result["answer"] = "".join(parts).strip()
+            elif result.get("extractive"):
+                yield {"type": "token", "data": {"content": result["answer"]}}
+
+        yield {"type": "done", "data": self._finish_trace(plan, result)}
+
+    async def aquery_with_faq(
+        self,
+        question: str,
+        top_k: int = 3,
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        enable_faq: bool = True,
+        retrieval_query: Optional[str] = None,
+        conversation: Optional[str] = None,
+        retrieval_cache: Optional[SessionRetrievalCache] = None,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
+    ) -> dict:
+        """
+        Versión asíncrona de query_with_faq
+
+        Las etapas de CPU (embedding, búsqueda y scoring) se ejecutan en el
+        executor acotado y la llamada al LLM es una corrutina, por lo que el
+        event loop nunca queda bloqueado.
+
+        Preguntas idénticas en curso (misma pregunta normalizada, proveedor
+        y generación del índice) esperan al mismo cálculo.
+
+        Con presupuesto de latencia, la llamada al LLM se corta cuando se
+        agota y se responde de forma extractiva (mejor FAQ o pasajes recuperados).
+
+        Returns:
+            Diccionario con la respuesta, metadatos y tipo de match
+        """
+        key = self._single_flight_key(
+            question, top_k, max_tokens, enable_faq, retrieval_query, conversation, retrieval_cache,
+            latency_budget_ms, mode
+        )
+        return await self.single_flight.ado(
+            key,
+            lambda: self._aquery_with_faq(
+                question, top_k, max_tokens, enable_faq, retrieval_query, conversation, retrieval_cache,
+                latency_budget_ms, mode
+            )
+        )
+
+    async def _aquery_with_faq(
+        self,
+        question: str,
+        top_k: int,
+        max_tokens: int,
+        enable_faq: bool,
+        retrieval_query: Optional[str] = None,
+        conversation: Optional[str] = None,
+        retrieval_cache: Optional[SessionRetrievalCache] = None,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
+    ) -> dict:
+        """Cuerpo de aquery_with_faq (sin coalescencia)"""
+        # El presupuesto corre desde que llega la petición (incluye la espera en cola)
+        deadline = self.deadline_policy.start(latency_budget_ms)
+        trace = self._start_trace(mode)
+        queue_times = track_queue_times()
+        plan = await self._aprepare_query(
+            question, top_k, max_tokens, enable_faq, retrieval_query, conversation, retrieval_cache,
+            deadline, mode, trace
+        )
+        plan["queue_times"] = queue_times
+        if plan["result"] is not None:
+            return self._finish_trace(plan, plan["result"])
+
+        try:
+            timeout = deadline.remaining_seconds() if deadline is not None else None
+            answer = await asyncio.wait_for(self.llm_client.agenerate_response(**self._llm_kwargs(plan)), timeout)
+            result = self._finalize_answer(plan, answer)
+
+        except asyncio.TimeoutError:
+            # Se agotó el presupuesto esperando al LLM: última degradación
+            logger.warning(
+                "deadline.llm_timeout", f"Presupuesto agotado esperando al LLM ({deadline.budget_ms:.0f} ms)",
+                budget_ms=deadline.budget_ms
+            )
+            self._record_route(plan, error=True)
+            self._degrade(plan, "faq_or_extractive")
+            result = await run_cpu(self._extractive_result, plan, "timeout")
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            # La respuesta extractiva embebe oraciones: fuera del event loop
+            result = await run_cpu(self._generation_error, plan, e)
+
+        return self._finish_trace(plan, result)
+
+    async def aquery_with_faq_stream(
+        self,
+        question: str,
+        top_k: int = 3,
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        enable_faq: bool = True,
+        retrieval_query: Optional[str] = None,
+        conversation: Optional[str] = None,
+        retrieval_cache: Optional[SessionRetrievalCache] = None,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
+    ) -> AsyncIterator[dict]:
+        """
+        Versión asíncrona de query_with_faq_stream (mismos eventos)
+
+        Los streams idénticos en curso se comparten: quien llega tarde
+        recibe los eventos ya emitidos y después los nuevos.
+
+        Yields:
+            Diccionarios de evento con 'type' y 'data'
+        """
+        key = ("stream",) + self._single_flight_key(
+            question, top_k, max_tokens, enable_faq, retrieval_query, conversation, retrieval_cache,
+            latency_budget_ms, mode
+        )
+        async for event in self.single_flight.astream(
+            key,
+            lambda: self._aquery_with_faq_stream(
+                question, top_k, max_tokens, enable_faq, retrieval_query, conversation, retrieval_cache,
+                latency_budget_ms, mode
+            )
+        ):
+            yield event
+
+    async def _aquery_with_faq_stream(
+        self,
+        question: str,
+        top_k: int,
+        max_tokens: int,
+        enable_faq: bool,
+        retrieval_query: Optional[str] = None,
+        conversation: Optional[str] = None,
+        retrieval_cache: Optional[SessionRetrievalCache] = None,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
+    ) -> AsyncIterator[dict]:
+        """Cuerpo de aquery_with_faq_stream (sin coalescencia)"""
+        deadline = self.deadline_policy.start(latency_budget_ms)
+        trace = self._start_trace(mode)
+        queue_times = track_queue_times()
+        plan = await self._aprepare_query(
+            question, top_k, max_tokens, enable_faq, retrieval_query, conversation, retrieval_cache,
+            deadline, mode, trace
+        )
+        plan["queue_times"] = queue_times
+
+        if plan["result"] is not None:
+            result = self._finish_trace(plan, plan["result"])
+            yield {"type": "metadata", "data": self._stream_metadata(result)}
+            yield {"type": "token", "data": {"content": result["answer"]}}
+            yield {"type": "done", "data": result}
+            return
+
+        yield {
+            "type": "metadata",
+            "data": self._stream_metadata({
+                "relevant_documents": self._build_relevant_documents(
+                    plan["faq_results"], plan["doc_results"], plan["match_type"]
+                ),
+                "match_type": plan["match_type"],
+                "context_type": plan["context_type"],
+                "best_faq_similarity": plan["best_similarity"]
+            })
+        }
+
+        parts = []
+        stream = self.llm_client.agenerate_response_stream(**self._llm_kwargs(plan))
+        try:
+            while True:
+                # Cada token se espera como mucho hasta que se agote el presupuesto
+                timeout = deadline.remaining_seconds() if deadline is not None else None
+                try:
+                    token = await asyncio.wait_for(stream.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                if not parts:
+                    trace.record("llm_ttft", plan["llm_started"])
+                parts.append(token)
+                yield {"type": "token", "data": {"content": token}}
+
+            result = self._finalize_answer(plan, "".join(parts).strip())
+
+        except asyncio.TimeoutError:
+            result, events = await run_cpu(self._cut_stream, plan, parts)
+            for event in events:
+                yield event
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            result = await run_cpu(self._generation_error, plan, e, not parts)
+            if parts:
+                result["answer"] = "".join(parts).strip()
+            elif result.get("extractive"):
+                yield {"type": "token", "data": {"content": result["answer"]}}
+        finally:
+            await stream.aclose()
+
+        yield {"type": "done", "data": self._finish_trace(plan, result)}
+
+    def _single_flight_key(
+        self,
+        question: str,
+        top_k: int,
+        max_tokens: int,
+        enable_faq: bool,
+        retrieval_query: Optional[str] = None,
+        conversation: Optional[str] = None,
+        retrieval_cache: Optional[SessionRetrievalCache] = None,
+        latency_budget_ms: Optional[float] = None,
+        mode: str = "generative"
+    ) -> tuple:
+        """
+        Clave de coalescencia: pregunta normalizada, consulta de búsqueda,
+        memoria de la conversación, candidatos de la sesión, proveedor,
+        generación del índice y parámetros que cambian el resultado
+        (incluidos el presupuesto de latencia, que puede degradar la respuesta,
+        y el modo de respuesta)
+
+        Returns:
+            Tupla usable como clave de SingleFlight
+        """
+        return (
+            normalize_question(question),
+            normalize_question(retrieval_query) if retrieval_query else None,
+            conversation or None,
+            # Con candidatos guardados el resultado depende de la sesión
+            id(retrieval_cache) if retrieval_cache is not None and not retrieval_cache.is_empty() else None,
+            self.llm_provider,
+            self.index_generation,
+            top_k,
+            max_tokens,
+            enable_faq,
+            latency_budget_ms,
+            mode
+        )
+
+    def _llm_kwargs(self, plan: dict) -> dict:
+        """
+        Argumentos de la llamada al LLM según el plan (incluye la ruta de modelo)
+
+        Args:
+            plan: Plan devuelto por _prepare_query
+
+        Returns:
+            Diccionario de argumentos para generate_response y sus variantes
+        """
+        plan["llm_started"] = time.monotonic()
+        return {
+            "query": plan["question"],
+            "context_documents": plan["context_documents"],
+            "temperature": plan["temperature"],
+            "max_tokens": plan["max_tokens"],
+            "context_type": plan["context_type"],
+            "models": plan["route"]["models"],
+            "on_usage": plan["usage"].update,
+            "conversation": plan["conversation"]
+        }
+
+    def _record_route(self, plan: dict, error: bool):
+        """Registra latencia y uso de tokens de la ruta de modelo usada"""
+        if plan.get("route") is None or plan.get("llm_started") is None:
+            return
+        plan["trace"].record("llm_total", plan["llm_started"])
+        usage = plan["usage"]
+        if usage.get("cached_prompt_tokens"):
+            logger.debug(
+                "llm.prefix_cache", "Caché de prefijo del proveedor",
+                cached_prompt_tokens=usage['cached_prompt_tokens'], prompt_tokens=usage['prompt_tokens']
+            )
+        self.routing_policy.record(
+            plan["route"]["name"],
+            time.monotonic() - plan["llm_started"],
+            plan["usage"],
+            error=error
+        )
+
+    def _stream_metadata(self, result: dict) -> dict:
+        """
+        Extrae la metadata de recuperación que se envía como primer evento del stream
+
+        Args:
+            result: Resultado parcial o completo de la consulta
+
+        Returns:
+            Diccionario sin la respuesta
+        """
+        return {key: value for key, value in result.items() if key != "answer"}
+
+    def _prepare_query(
+        self,
+        question: str,
+        top_k: int,
+        max_tokens: int,
+        enable_faq: bool,
+        retrieval_query: Optional[str] = None,
+        conversation: Optional[str] = None,
+        retrieval_cache: Optional[SessionRetrievalCache] = None,
+        deadline: Optional[Deadline] = None,
+        mode: str = "generative",
+        trace: Optional[RequestTrace] = None
+    ) -> dict:
+        """
+        Ejecuta todas las etapas previas a la generación: caché semántica,
+        clasificación FAQ, búsqueda de documentos y armado del contexto
+
+        Args:
+            question: Pregunta del usuario
+            top_k: Número de documentos relevantes a recuperar
+            max_tokens: Máximo de tokens en la respuesta
+            enable_faq: Si es True, busca en FAQs primero
+            retrieval_query: Consulta para la búsqueda (default: la pregunta)
+            conversation: Memoria de la conversación para el prompt
+            retrieval_cache: Candidatos del turno anterior de la sesión; decide
+                si se reutilizan, se extienden o se hace una búsqueda completa
+            deadline: Presupuesto de latencia de la petición; decide las
+                degradaciones (compresión, contexto, modelo o respuesta sin LLM)
+            mode: 'generative' o 'extractive' (responde con la búsqueda, sin LLM)
+            trace: Traza de la petición donde se registra el tiempo de cada etapa
+
+        Returns:
+            Diccionario con el plan de generación. Si 'result' no es None,
+            la consulta ya está respondida y no hace falta llamar al LLM.
+        """
+        plan = self._start_query(question, max_tokens, retrieval_query, conversation, deadline, mode, trace)
+        if plan["result"] is None:
+            self._embed_query(plan)
+            self._plan_retrieval(plan, top_k, enable_faq, retrieval_cache)
+        return plan
+
+    async def _aprepare_query(
+        self,
+        question: str,
+        top_k: int,
+        max_tokens: int,
+        enable_faq: bool,
+        retrieval_query: Optional[str] = None,
+        conversation: Optional[str] = None,
+        retrieval_cache: Optional[SessionRetrievalCache] = None,
+        deadline: Optional[Deadline] = None,
+        mode: str = "generative",
+        trace: Optional[RequestTrace] = None
+    ) -> dict:
+        """
+        Versión asíncrona de _prepare_query (mismos argumentos y resultado)
+
+        Las tres fases corren en el executor de CPU, pero solo el embedding
+        ocupa un lugar de la etapa 'embedding' del control de admisión: las
+        intenciones por reglas no esperan en la cola ni reciben 429, y la
+        búsqueda en ChromaDB no retiene el lugar.
+        """
+        plan = await run_cpu(self._start_query, question, max_tokens, retrieval_query, conversation, deadline, mode, trace)
+        if plan["result"] is not None:
+            return plan
+        async with self.admission.slot("embedding"):
+            await run_cpu(self._embed_query, plan)
+        return await run_cpu(self._plan_retrieval, plan, top_k, enable_faq, retrieval_cache)
+
+    def _start_query(
+        self,
+        question: str,
+        max_tokens: int,
+        retrieval_query: Optional[str],
+        conversation: Optional[str],
+        deadline: Optional[Deadline],
+        mode: str,
+        trace: Optional[RequestTrace]
+    ) -> dict:
+        """
+        Primera fase de _prepare_query: arma el plan y responde lo que no
+        necesita embedding (intenciones por reglas, índice vacío)
+
+        Returns:
+            Plan de la consulta ('result' no es None si ya está respondida)
+        """
+        if mode not in self.ANSWER_MODES:
+            raise ValueError(f"Modo de respuesta no soportado: {mode}. Usa 'generative' o 'extractive'")
+        if trace is None:
+            trace = self.tracer.start("rag.query")
+
+        logger.debug("query.start", "Procesando consulta con sistema FAQ híbrido", question=question, mode=mode)
+
+        retrieval_query = retrieval_query or question
+        # Una pregunta de seguimiento depende de la conversación: no se busca en
+        # la caché semántica ni se responde con la FAQ directa
+        is_followup = normalize_question(retrieval_query) != normalize_question(question)
+        if is_followup:
+            logger.debug("query.followup", "Consulta de búsqueda reescrita", retrieval_query=retrieval_query)
+
+        generation = self._sync_index_generation()
+
+        plan = {
+            "question": question,
+            "retrieval_query": retrieval_query,
+            "conversation": conversation,
+            "followup": is_followup,
+            # La caché semántica es de todo el proceso: una respuesta generada con
+            # la memoria de una sesión no se guarda para que no llegue a otras
+            "cacheable": not is_followup and not conversation,
+            "mode": mode,
+            "trace": trace,
+            "max_tokens": max_tokens,
+            "query_embedding": None,
+            "generation": generation,
+            "match_type": "none",
+            "faq_results": [],
+            "faq_entries": [],
+            "doc_results": [],
+            "best_similarity": 0.0,
+            "retrieval_decision": None,
+            "deadline": deadline,
+            "degradations": [],
+            "context_documents": [],
+            "context_stats": None,
+            "context_type": None,
+            "temperature": None,
+            "route": None,
+            "usage": {},
+            "llm_started": None,
+            "queue_times": None,
+            "result": None
+        }
+
+        # Intenciones conversacionales por reglas: sin embedding ni búsqueda
+        intent = self.intent_classifier.match_rules(question)
+        if intent is not None:
+            plan["result"] = self._intent_result(intent, "rule")
+            return plan
 
         # Verificar que haya documentos
         doc_count = self.repository.count_documents()
-        if doc_count == 0:
-            return {
+        if doc_count == 0 and self.repository.count_faq_questions() == 0:
+            plan["result"] = {
                 "answer": "No hay documentos en la base de datos. Por favor, ejecuta primero la ingestion de documentos.",
                 "relevant_documents": [],
                 "match_type": "none",
                 "error": "No documents in database"
             }
+            return plan
 
-        print(f"Documentos en base de datos: {doc_count}")
+        logger.debug("query.index", f"Documentos en base de datos: {doc_count}", documents=doc_count)
+        return plan
+
+    def _embed_query(self, plan: dict):
+        """
+        Segunda fase de _prepare_query: embedding de la consulta de búsqueda
+
+        El embedding se calcula una sola vez y se reutiliza en la caché, la
+        búsqueda de FAQs y la búsqueda de documentos.
+        """
+        with plan["trace"].stage("embed"):
+            plan["query_embedding"] = self.embedder.generate_embedding(plan["retrieval_query"])
+
+    def _plan_retrieval(
+        self,
+        plan: dict,
+        top_k: int,
+        enable_faq: bool,
+        retrieval_cache: Optional[SessionRetrievalCache]
+    ) -> dict:
+        """
+        Tercera fase de _prepare_query: caché semántica, clasificación FAQ,
+        búsqueda de documentos, armado del contexto y degradaciones
+
+        Returns:
+            El mismo plan, completo
+        """
+        question = plan["question"]
+        retrieval_query = plan["retrieval_query"]
+        query_embedding = plan["query_embedding"]
+        is_followup = plan["followup"]
+        max_tokens = plan["max_tokens"]
+        deadline = plan["deadline"]
+        mode = plan["mode"]
+        trace = plan["trace"]
+
+        # Intenciones por similitud con los prototipos (mensajes cortos y autónomos)
+        intent = self.intent_classifier.match_embedding(question, query_embedding) if not is_followup else None
+        if intent is not None:
+            plan["result"] = self._intent_result(intent, "centroid")
+            return plan
+
+        # PASO 0: Buscar una respuesta a una pregunta parafraseada
+        cached = None
+        if not plan["followup"] and mode == "generative":
+            cached = self.semantic_cache.lookup(query_embedding, plan["generation"])
+        if cached is not None:
+            logger.debug(
+                "cache.semantic_hit", f"Respuesta desde caché semántica (similitud: {cached['similarity']:.2%})",
+                similarity=round(cached['similarity'], 4)
+            )
+            result = cached['result']
+            result["cache_hit"] = "semantic"
+            result["cache_similarity"] = cached['similarity']
+            result["deadline"] = self._deadline_info(plan)
+            plan["result"] = result
+            return plan
+
+        # Seguimiento en la sesión: ¿sirven los candidatos del turno anterior?
+        decision = "fresh"
+        if retrieval_cache is not None:
+            decision, reuse_similarity = retrieval_cache.decide(
+                query_embedding, plan["generation"], top_k, enable_faq
+            )
+            plan["retrieval_decision"] = decision
+            self.metrics.inc("rag_followup_retrieval_total", labels={"decision": decision})
+            if decision != "fresh":
+                logger.debug(
+                    "retrieval.reuse", f"Candidatos del turno anterior: {decision}",
+                    decision=decision, similarity=round(reuse_similarity, 4)
+                )
 
         # PASO 1: Clasificar la consulta según FAQs
-        if enable_faq and self.faq_handler.should_use_faq(question):
-            print("\n🔍 Buscando en FAQs...")
-            faq_classification = self.faq_handler.classify_query(question, top_k=5)
+        if decision != "fresh":
+            # Misma clasificación que el turno anterior (sin buscar en FAQs)
+            classification = retrieval_cache.get_classification()
+            match_type = classification['match_type']
+            faq_results = classification['faq_results']
+            faq_entries = classification['faq_entries']
+            best_similarity = classification['best_similarity']
+        elif enable_faq and self.faq_handler.should_use_faq(question):
+            with trace.stage("faq_search"):
+                faq_classification = self.faq_handler.classify_query(
+                    retrieval_query,
+                    top_k=5,
+                    query_embedding=query_embedding
+                )
             match_type = faq_classification['match_type']
             faq_results = faq_classification['faq_results']
+            faq_entries = faq_classification.get('faq_entries', [])
             best_similarity = faq_classification['best_similarity']
 
-            print(f"Match type: {match_type.upper()}")
-            print(f"Best FAQ similarity: {best_similarity:.2%}")
+            logger.debug(
+                "faq.classified", f"Match type: {match_type}",
+                match_type=match_type, best_similarity=round(best_similarity, 4)
+            )
+
+            # Match fuerte: responder con el texto de la FAQ sin llamar al LLM
+            # (no en seguimientos: la respuesta depende de la conversación)
+            direct_answer = None
+            if not plan["followup"]:
+                direct_answer = self.faq_handler.get_direct_answer(faq_classification)
+            if direct_answer is not None:
+                logger.debug("faq.direct_answer", "Respuesta directa desde FAQ (sin LLM)")
+                plan["result"] = {
+                    "answer": direct_answer,
+                    "relevant_documents": self._build_relevant_documents(faq_results, [], match_type),
+                    "match_type": match_type,
+                    "context_type": "faq_direct",
+                    "best_faq_similarity": best_similarity,
+                    "error": None
+                }
+                return plan
         else:
             match_type = 'low'
             faq_results = []
+            faq_entries = []
             best_similarity = 0.0
-            print("\n⏭️  Saltando búsqueda en FAQs (disabled o comando especial)")
+            logger.debug("faq.skipped", "Búsqueda en FAQs omitida (desactivada o comando especial)")
 
         # PASO 2: Obtener documentos si es necesario (EXCLUIR FAQs)
         doc_results = []
+        candidates = []  # Con sus vectores, para reutilizarlos en el turno siguiente
+        doc_search_started = time.monotonic()
         if match_type in ['medium', 'low']:
-            print(f"\n📄 Buscando en documentos generales (top-{top_k})...")
-            all_docs = self.retriever.retrieve_relevant_documents(
-                query=question,
-                top_k=top_k * 2  # Buscar más para compensar filtrado
-            )
-
-            # Filtrar SOLO documentos que NO son FAQs
-            doc_results = [
-                (filename, content, score)
-                for filename, content, score in all_docs
-                if not filename.startswith('faq/')
-            ]
+            if decision == "reuse":
+                candidates = retrieval_cache.rank(query_embedding, top_k)
+            else:
+                # Buscar más para compensar el filtrado (y guardar candidatos de sobra)
+                factor = max(2, retrieval_cache.candidate_factor) if retrieval_cache is not None else 2
+                logger.debug("retrieval.search", f"Buscando en documentos generales (top-{top_k})", top_k=top_k)
+                all_docs = self.retriever.retrieve_candidates(
+                    query=retrieval_query,
+                    top_k=top_k * factor,
+                    query_embedding=query_embedding
+                )
+
+                # Filtrar SOLO documentos que NO son FAQs
+                candidates = [candidate for candidate in all_docs if not candidate[0].startswith('faq/')]
+
+                if decision == "extend":
+                    candidates = retrieval_cache.rank(query_embedding, top_k * factor, extra_candidates=candidates)
 
             # Limitar a top_k
-            doc_results = doc_results[:top_k]
+            doc_results = [(filename, content, score) for filename, content, score, _ in candidates[:top_k]]
+            trace.record("doc_search", doc_search_started)
+
+        # Los candidatos reutilizados quedan anclados a la consulta que los buscó
+        if retrieval_cache is not None and decision != "reuse":
+            retrieval_cache.update(
+                query_embedding, plan["generation"], top_k, enable_faq,
+                {
+                    "match_type": match_type, "faq_results": faq_results,
+                    "faq_entries": faq_entries, "best_similarity": best_similarity
+                },
+                candidates
+            )
 
-        # PASO 3: Preparar contexto para el LLM
-        context_documents, context_type = self.faq_handler.get_context_for_llm(
-            query=question,
-            match_type=match_type,
-            faq_results=faq_results,
-            doc_results=doc_results
+        plan.update({
+            "match_type": match_type,
+            "faq_results": faq_results,
+            "faq_entries": faq_entries,
+            "doc_results": doc_results,
+            "best_similarity": best_similarity
+        })
+
+        # Modo extractivo: la respuesta sale de lo recuperado, sin contexto ni LLM
+        if mode == "extractive":
+            plan["result"] = self._extractive_result(plan, "mode")
+            return plan
+
+        # PASO 3: Preparar contexto para el LLM (sin duplicados y dentro del presupuesto)
+        selected, context_type = self.faq_handler.select_context(match_type, faq_results, doc_results)
+        # Sin tiempo de sobra, la compresión (etapa opcional) es lo primero que se omite
+        skip_compression = self.context_compressor.enabled and not self.deadline_policy.allow_compression(
+            deadline,
+            self.routing_policy.latency_estimate_ms(self.routing_policy.select(context_type, 0)["name"])
         )
+        if skip_compression:
+            self._degrade(plan, "skip_compression")
+        with trace.stage("context_build"):
+            context_stats = self._build_context(selected, query_embedding, skip_compression=skip_compression)
+        context_documents = context_stats.pop("context_documents")
 
         if not context_documents:
-            return {
+            plan["result"] = {
                 "answer": "No se encontraron documentos relevantes para tu pregunta.",
                 "relevant_documents": [],
                 "match_type": match_type,
                 "error": "No relevant documents found"
             }
+            return plan
 
         # PASO 4: Ajustar temperatura según contexto
         adjusted_temperature = self.faq_handler.get_temperature_for_context(context_type)
 
-        print(f"\n🎯 Tipo de contexto: {context_type}")
-        print(f"🌡️  Temperature ajustada: {adjusted_temperature}")
-        print(f"\n🤖 Generando respuesta con {self.llm_provider.upper()}...\n")
+        # PASO 5: Elegir modelo según el tipo y tamaño del contexto
+        context_tokens = context_stats["used_tokens"]
+        route = self.routing_policy.select(context_type, context_tokens)
 
-        # PASO 5: Generar respuesta con LLM
-        try:
-            answer = self.llm_client.generate_response(
-                query=question,
-                context_documents=context_documents,
-                temperature=adjusted_temperature,
-                max_tokens=max_tokens,
-                context_type=context_type
+        # PASO 5b: Degradar si el tiempo restante no alcanza para la ruta elegida
+        degradations = self.deadline_policy.plan_generation(
+            deadline,
+            self.routing_policy.latency_estimate_ms(route["name"]),
+            self.routing_policy.latency_estimate_ms(self.routing_policy.fast_route["name"])
+        )
+        if "faq_or_extractive" in degradations:
+            logger.warning(
+                "deadline.no_time", f"Sin tiempo para generar ({deadline.remaining_ms():.0f} ms restantes)",
+                remaining_ms=round(deadline.remaining_ms(), 1)
             )
+            self._degrade(plan, "faq_or_extractive")
+            plan["result"] = self._extractive_result(plan, "deadline")
+            return plan
+        if "shrink_context" in degradations:
+            self._degrade(plan, "shrink_context")
+            with trace.stage("context_build"):
+                context_stats = self._build_context(
+                    selected, query_embedding, skip_compression=skip_compression,
+                    max_tokens=int(context_stats["budget"] * self.deadline_policy.SHRINK_FACTOR)
+                )
+            context_documents = context_stats.pop("context_documents")
+            context_tokens = context_stats["used_tokens"]
+        if "fast_model" in degradations:
+            self._degrade(plan, "fast_model")
+            route = self.routing_policy.fast_route
+
+        plan.update({
+            "context_documents": context_documents,
+            "context_stats": context_stats,
+            "context_type": context_type,
+            "temperature": adjusted_temperature,
+            "route": route,
+            "max_tokens": self.routing_policy.max_tokens_for(route, max_tokens)
+        })
+
+        logger.debug(
+            "generation.plan", f"Generando respuesta con {self.llm_provider}",
+            context_type=context_type, temperature=adjusted_temperature,
+            route=route['name'], context_tokens=context_tokens
+        )
 
-            print("=" * 60)
-            print("RESPUESTA GENERADA")
-            print("=" * 60)
+        return plan
 
-            # Preparar metadata de documentos relevantes
-            relevant_docs = []
+    def _start_trace(self, mode: str) -> RequestTrace:
+        """
+        Traza donde se registran las etapas de la consulta
 
-            # Agregar FAQs si se usaron
-            if faq_results:
-                for filename, content, score in faq_results[:3]:
-                    relevant_docs.append({
-                        "filename": filename,
-                        "similarity": score,
-                        "type": "faq",
-                        "preview": content[:200] + "..." if len(content) > 200 else content
-                    })
+        Si la API ya abrió una traza para la petición, las etapas se agregan
+        a ella (y la API la cierra); si no, el pipeline crea y cierra la suya.
 
-            # Agregar docs generales si se usaron
-            if doc_results and match_type in ['medium', 'low']:
-                for filename, content, score in doc_results[:3]:
-                    relevant_docs.append({
-                        "filename": filename,
-                        "similarity": score,
-                        "type": "document",
-                        "preview": content[:200] + "..." if len(content) > 200 else content
-                    })
+        Args:
+            mode: Modo de respuesta (atributo del span)
 
-            return {
-                "answer": answer,
-                "relevant_documents": relevant_docs,
-                "match_type": match_type,
-                "context_type": context_type,
-                "best_faq_similarity": best_similarity,
-                "error": None
-            }
+        Returns:
+            RequestTrace de la petición
+        """
+        trace = self.tracer.current()
+        if trace is None:
+            trace = self.tracer.start("rag.query")
+        trace.set_attribute("rag.mode", mode)
+        trace.set_attribute("rag.llm_provider", self.llm_provider)
+        return trace
+
+    def _finish_trace(self, plan: dict, result: dict) -> dict:
+        """
+        Agrega los tiempos por etapa al resultado y cierra la traza propia
 
-        except Exception as e:
-            error_msg = f"Error al generar respuesta: {str(e)}"
-            print(f"❌ {error_msg}")
+        Args:
+            plan: Plan devuelto por _prepare_query
+            result: Resultado de la consulta
 
-            return {
-                "answer": "Ocurrió un error al generar la respuesta.",
-                "relevant_documents": [],
-                "match_type": match_type,
-                "error": error_msg
-            }
+        Returns:
+            Copia del resultado con 'timings' ({etapa: ms}); el original
+            puede estar guardado en la caché semántica
+        """
+        trace = plan["trace"]
+        for key in ("match_type", "context_type", "model_route", "retrieval_decision", "cache_hit", "intent"):
+            trace.set_attribute(f"rag.{key}", result.get(key))
+        if trace is not self.tracer.current():
+            self.tracer.finish(trace, error=result.get("error"))
+        return dict(result, timings=trace.timings_ms())
+
+    def _queue_ms(self, plan: dict) -> Optional[dict]:
+        """Milisegundos que la petición esperó en la cola de cada etapa (solo camino async)"""
+        if plan["queue_times"] is None:
+            return None
+        return {stage: round(seconds * 1000, 1) for stage, seconds in plan["queue_times"].items()}
+
+    def _intent_result(self, intent: str, method: str) -> dict:
+        """
+        Respuesta local de una intención conversacional
+
+        Args:
+            intent: Nombre de la intención
+            method: Cómo se detectó ('rule' o 'centroid')
+
+        Returns:
+            Resultado con el mismo formato que query_with_faq
+        """
+        logger.debug("intent.local_answer", f"Intención '{intent}': respuesta local sin LLM", intent=intent, method=method)
+        self.metrics.inc("rag_intent_hits_total", labels={"intent": intent, "method": method})
+        return self.intent_classifier.respond(intent)
+
+    def _degrade(self, plan: dict, degradation: str):
+        """Registra una degradación aplicada por falta de presupuesto de latencia"""
+        logger.warning(
+            "deadline.degraded", f"Degradación por presupuesto de latencia: {degradation}", degradation=degradation
+        )
+        plan["degradations"].append(degradation)
+        self.metrics.inc("rag_degradations_total", labels={"degradation": degradation})
+
+    def _deadline_info(self, plan: dict) -> Optional[dict]:
+        """Presupuesto y tiempo consumido de la petición (None si no tiene presupuesto)"""
+        return plan["deadline"].to_dict() if plan["deadline"] is not None else None
+
+    def _extractive_result(self, plan: dict, reason: str) -> dict:
+        """
+        Respuesta sin LLM con lo ya recuperado: la respuesta de la mejor FAQ
+        o los pasajes más cercanos a la consulta con su archivo de origen
+
+        Args:
+            plan: Plan devuelto por _prepare_query (con la búsqueda hecha)
+            reason: Motivo: 'mode', 'deadline', 'timeout' o 'llm_error'
+
+        Returns:
+            Resultado con el mismo formato que query_with_faq
+        """
+        with plan["trace"].stage("extractive"):
+            extractive = self.extractive.answer(
+                plan["query_embedding"], plan["match_type"], plan["faq_entries"],
+                plan["faq_results"], plan["doc_results"]
+            )
+        self.metrics.inc("rag_extractive_answers_total", labels={"reason": reason})
+        logger.debug(
+            "extractive.answer", f"Respuesta extractiva ({extractive['method']})",
+            method=extractive['method'], reason=reason
+        )
+
+        return {
+            "answer": extractive["answer"],
+            "relevant_documents": self._build_relevant_documents(
+                plan["faq_results"], plan["doc_results"], plan["match_type"]
+            ),
+            "match_type": plan["match_type"],
+            "context_type": "extractive",
+            "best_faq_similarity": plan["best_similarity"],
+            "retrieval_decision": plan["retrieval_decision"],
+            "extractive": {"method": extractive["method"], "reason": reason, "sources": extractive["sources"]},
+            "degradations": list(plan["degradations"]),
+            "deadline": self._deadline_info(plan),
+            "queue_ms": self._queue_ms(plan),
+            "error": None
+        }
+
+    def _build_context(
+        self,
+        selected: List[Tuple[str, str, float]],
+        query_embedding,
+        skip_compression: bool = False,
+        max_tokens: Optional[int] = None
+    ) -> dict:
+        """
+        Comprime los documentos (si está activado), arma el contexto con el
+        ContextBuilder y registra los tokens descartados
+
+        Args:
+            selected: Resultados (source, content, score) en orden de relevancia
+            query_embedding: Embedding de la consulta
+            skip_compression: Omite la compresión (degradación por latencia)
+            max_tokens: Presupuesto del contexto (default: el del ContextBuilder)
+
+        Returns:
+            Resultado de ContextBuilder.build (con 'compression' si se comprimió)
+        """
+        compression = None
+        if self.context_compressor.enabled and not skip_compression:
+            started = time.monotonic()
+            selected, compression = self.context_compressor.compress(query_embedding, selected)
+            self.deadline_policy.record_compression((time.monotonic() - started) * 1000)
+            logger.debug(
+                "context.compressed", "Contexto comprimido",
+                original_tokens=compression['original_tokens'], compressed_tokens=compression['compressed_tokens']
+            )
+
+        built = self.context_builder.build(selected, max_tokens=max_tokens)
+        # FAQs primero y en orden fijo: más prefijo en común con consultas anteriores
+        built["context_documents"], built["sources"] = stable_context_order(
+            built["context_documents"], built["sources"]
+        )
+        if compression is not None:
+            built["compression"] = compression
+
+        for reason, key in (("budget", "dropped_tokens"), ("duplicate", "duplicate_tokens")):
+            if built[key]:
+                self.metrics.inc("rag_context_dropped_tokens_total", built[key], labels={"reason": reason})
+
+        logger.debug(
+            "context.built", f"Contexto: {built['used_tokens']}/{built['budget']} tokens",
+            used_tokens=built['used_tokens'], budget=built['budget'],
+            dropped_tokens=built['dropped_tokens'], duplicate_tokens=built['duplicate_tokens']
+        )
+        return built
+
+    def _finalize_answer(self, plan: dict, answer: str, complete: bool = True) -> dict:
+        """
+        Construye el resultado de una respuesta generada por el LLM y la guarda en caché
+
+        Args:
+            plan: Plan devuelto por _prepare_query
+            answer: Respuesta generada
+            complete: False si la generación se cortó (cuenta como error de la ruta)
+
+        Returns:
+            Diccionario con la respuesta y metadatos
+        """
+        self._record_route(plan, error=not complete)
+        logger.debug(
+            "query.answered", "Respuesta generada",
+            context_type=plan["context_type"], route=plan["route"]["name"], usage=plan["usage"]
+        )
+
+        faq_results = plan["faq_results"]
+        doc_results = plan["doc_results"]
+
+        result = {
+            "answer": answer,
+            "relevant_documents": self._build_relevant_documents(faq_results, doc_results, plan["match_type"]),
+            "match_type": plan["match_type"],
+            "context_type": plan["context_type"],
+            "best_faq_similarity": plan["best_similarity"],
+            "model_route": plan["route"]["name"],
+            "context_stats": plan["context_stats"],
+            "retrieval_decision": plan["retrieval_decision"],
+            "degradations": list(plan["degradations"]),
+            "deadline": self._deadline_info(plan),
+            "queue_ms": self._queue_ms(plan),
+            "error": None
+        }
+
+        # Una respuesta degradada no se reutiliza en peticiones con más tiempo
+        if plan["cacheable"] and not plan["degradations"]:
+            sources = [filename for filename, _, _ in faq_results + doc_results]
+            # La ruta, los tiempos y la cola de esta petición no se sirven en los hits
+            cached = {key: value for key, value in result.items() if key not in self.REQUEST_FIELDS}
+            self.semantic_cache.store(plan["query_embedding"], cached, sources, plan["generation"])
+
+        return result
+
+    def _cut_stream(self, plan: dict, parts: List[str]) -> Tuple[dict, List[dict]]:
+        """
+        Cierra un stream cuyo presupuesto de latencia se agotó
+
+        Si ya se emitió texto, la respuesta queda en lo emitido
+        (truncate_stream); si no, se responde de forma extractiva
+        (faq_or_extractive). En ambos casos el cliente recibe un evento
+        'degradation' y el resultado no se guarda en caché.
+
+        Args:
+            plan: Plan devuelto por _prepare_query
+            parts: Fragmentos ya emitidos
+
+        Returns:
+            Tupla (resultado, eventos que faltan emitir antes de 'done')
+        """
+        deadline = plan["deadline"]
+        logger.warning(
+            "deadline.stream_cut", f"Presupuesto agotado durante el stream ({deadline.budget_ms:.0f} ms)",
+            budget_ms=deadline.budget_ms, emitted_tokens=len(parts)
+        )
+
+        if parts:
+            self._degrade(plan, "truncate_stream")
+            result = self._finalize_answer(plan, "".join(parts).strip(), complete=False)
+            events = []
+        else:
+            self._record_route(plan, error=True)
+            self._degrade(plan, "faq_or_extractive")
+            result = self._extractive_result(plan, "timeout")
+            events = [{"type": "token", "data": {"content": result["answer"]}}]
+
+        degradation = {"degradation": plan["degradations"][-1], "deadline": self._deadline_info(plan)}
+        return result, [{"type": "degradation", "data": degradation}] + events
+
+    def _generation_error(self, plan: dict, error: Exception, fallback: bool = True) -> dict:
+        """
+        Construye el resultado cuando falla la generación con el LLM
+
+        Con EXTRACTIVE_FALLBACK_ENABLED se responde con la FAQ o los pasajes
+        ya recuperados en lugar de un error genérico.
+
+        Args:
+            plan: Plan devuelto por _prepare_query
+            error: Excepción producida
+            fallback: Permite la respuesta extractiva (False si el stream ya emitió texto)
+
+        Returns:
+            Diccionario de respuesta (extractiva, o con el error)
+        """
+        self._record_route(plan, error=True)
+
+        error_msg = f"Error al generar respuesta: {str(error)}"
+        logger.error("llm.error", error_msg, exc_info=error, route=(plan.get("route") or {}).get("name"))
+
+        if fallback and self.extractive.fallback_enabled:
+            result = self._extractive_result(plan, "llm_error")
+            result["llm_error"] = error_msg
+            return result
+
+        return {
+            "answer": "Ocurrió un error al generar la respuesta.",
+            "relevant_documents": [],
+            "match_type": plan["match_type"],
+            "error": error_msg
+        }
+
+    def _build_relevant_documents(
+        self,
+        faq_results: List[tuple],
+        doc_results: List[tuple],
+        match_type: str
+    ) -> List[dict]:
+        """
+        Prepara la metadata de los documentos relevantes para la respuesta
+
+        Args:
+            faq_results: FAQs usadas (filename, content, similarity)
+            doc_results: Documentos generales usados (filename, content, similarity)
+            match_type: Tipo de match de la consulta
+
+        Returns:
+            Lista de diccionarios con filename, similarity, type y preview
+        """
+        relevant_docs = []
+
+        # Agregar FAQs si se usaron
+        if faq_results:
+            for filename, content, score in faq_results[:3]:
+                relevant_docs.append({
+                    "filename": filename,
+                    "similarity": score,
+                    "type": "faq",
+                    "preview": content[:200] + "..." if len(content) > 200 else content
+                })
+
+        # Agregar docs generales si se usaron
+        if doc_results and match_type in ['medium', 'low']:
+            for filename, content, score in doc_results[:3]:
+                relevant_docs.append({
+                    "filename": filename,
+                    "similarity": score,
+                    "type": "document",
+                    "preview": content[:200] + "..." if len(content) > 200 else content
+                })
+
+        return relevant_docs
 
     def query(
         self,
@@ -279,10 +1526,7 @@ class RAGPipeline:
         Returns:
             Diccionario con la respuesta y metadatos
         """
-        print("=" * 60)
-        print("PROCESANDO CONSULTA RAG")
-        print("=" * 60)
-        print(f"Pregunta: {question}\n")
+        logger.debug("query.start", "Procesando consulta RAG", question=question)
 
         # Verificar que haya documentos
         doc_count = self.repository.count_documents()
@@ -293,12 +1537,14 @@ class RAGPipeline:
                 "error": "No documents in database"
             }
 
-        print(f"Documentos en base de datos: {doc_count}\n")
+        logger.debug("query.index", f"Documentos en base de datos: {doc_count}", documents=doc_count)
 
         # Recuperar documentos relevantes
+        query_embedding = self.embedder.generate_embedding(question)
         relevant_docs = self.retriever.retrieve_relevant_documents(
             query=question,
-            top_k=top_k
+            top_k=top_k,
+            query_embedding=query_embedding
         )
 
         if not relevant_docs:
@@ -308,11 +1554,11 @@ class RAGPipeline:
                 "error": "No relevant documents found"
             }
 
-        # Extraer solo el contenido de los documentos para el contexto
-        context_documents = [content for _, content, _ in relevant_docs]
+        # Armar el contexto sin duplicados y dentro del presupuesto de tokens
+        context_documents = self._build_context(relevant_docs, query_embedding)["context_documents"]
 
         # Generar respuesta con DeepSeek
-        print("\n🤖 Generando respuesta con DeepSeek...\n")
+        logger.debug("generation.plan", f"Generando respuesta con {self.llm_provider}")
 
         try:
             answer = self.llm_client.generate_response(
@@ -321,10 +1567,7 @@ class RAGPipeline:
                 temperature=temperature,
                 max_tokens=max_tokens
             )
-
-            print("=" * 60)
-            print("RESPUESTA GENERADA")
-            print("=" * 60)
+            logger.debug("query.answered", "Respuesta generada")
 
             return {
                 "answer": answer,
@@ -341,7 +1584,7 @@ class RAGPipeline:
 
         except Exception as e:
             error_msg = f"Error al generar respuesta: {str(e)}"
-            print(f"❌ {error_msg}")
+            logger.error("llm.error", error_msg, exc_info=e)
 
             return {
                 "answer": "Ocurrió un error al generar la respuesta.",
@@ -359,7 +1602,12 @@ class RAGPipeline:
     def reset_database(self):
         """Elimina todos los documentos de la base de datos"""
         count = self.repository.delete_all_documents()
-        print(f"Base de datos limpiada. {count} documentos eliminados.")
+        self.semantic_cache.clear()
+        self.context_compressor.clear()
+        with self._generation_lock:
+            self._index_stamp = self.repository.get_index_stamp()
+            self.index_generation += 1
+        logger.info("pipeline.cleared", f"Base de datos limpiada. {count} documentos eliminados.", count=count)
 
     def get_stats(self) -> dict:
         """
@@ -370,9 +1618,27 @@ class RAGPipeline:
         """
         stats = {
             "total_documents": self.repository.count_documents(),
+            "total_faq_questions": self.repository.count_faq_questions(),
             "storage_type": self.storage_type,
             "embedder_model": "BAAI/bge-m3",
-            "llm_model": self.llm_client.model
+            "llm_model": self.llm_client.model,
+            "semantic_cache": self.semantic_cache.get_stats(),
+            "llm_response_cache": self.llm_response_cache.get_stats(),
+            "llm_router": self.llm_client.get_stats(),
+            "model_routes": self.routing_policy.get_stats(),
+            "single_flight": self.single_flight.get_stats(),
+            "context_compression": self.context_compressor.get_stats(),
+            "intents": self.intent_classifier.get_stats(),
+            "admission": self.admission.get_stats(),
+            "tracing": self.tracer.get_stats(),
+            "followup_retrieval": {
+                decision: self.metrics.get_counter("rag_followup_retrieval_total", {"decision": decision})
+                for decision in ("reuse", "extend", "fresh")
+            },
+            "degradations": {
+                degradation: self.metrics.get_counter("rag_degradations_total", {"degradation": degradation})
+                for degradation in DEGRADATIONS
+            }
         }
 
         if self.storage_type == "sql":
@@ -0,0 +1,223 @@
+"""
+Módulo de reutilización de la búsqueda del turno anterior en preguntas de seguimiento
+"""
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+
+class SessionRetrievalCache:
+    """
+    Candidatos recuperados en el último turno de una sesión.
+
+    Guarda la clasificación FAQ y un conjunto amplio de documentos candidatos
+    con sus vectores. En el turno siguiente, la similitud entre la consulta
+    nueva y la anterior decide:
+    - 'reuse': se reutiliza la clasificación FAQ y los documentos se vuelven a
+      ordenar con la consulta nueva (sin buscar en la base).
+    - 'extend': se reutiliza la clasificación FAQ y se buscan documentos, que
+      se combinan con los candidatos guardados.
+    - 'fresh': búsqueda completa.
+
+    Una instancia por sesión (RAGChatbot); el pipeline la consulta y la actualiza.
+    """
+
+    DEFAULT_REUSE_THRESHOLD = 0.85
+    DEFAULT_EXTEND_THRESHOLD = 0.65
+    DEFAULT_CANDIDATE_FACTOR = 3  # Candidatos guardados = top_k * factor
+
+    def __init__(
+        self,
+        reuse_threshold: Optional[float] = None,
+        extend_threshold: Optional[float] = None,
+        candidate_factor: Optional[int] = None
+    ):
+        """
+        Inicializa la caché (los valores omitidos se leen de .env)
+
+        Args:
+            reuse_threshold: Similitud mínima con la consulta anterior para
+                reutilizar sin buscar (RETRIEVAL_REUSE_THRESHOLD)
+            extend_threshold: Similitud mínima para extender los candidatos
+                (RETRIEVAL_EXTEND_THRESHOLD)
+            candidate_factor: Candidatos a guardar por cada documento pedido
+                (RETRIEVAL_CANDIDATE_FACTOR)
+        """
+        load_dotenv()
+
+        if reuse_threshold is None:
+            reuse_threshold = float(os.getenv('RETRIEVAL_REUSE_THRESHOLD', self.DEFAULT_REUSE_THRESHOLD))
+        if extend_threshold is None:
+            extend_threshold = float(os.getenv('RETRIEVAL_EXTEND_THRESHOLD', self.DEFAULT_EXTEND_THRESHOLD))
+        if candidate_factor is None:
+            candidate_factor = int(os.getenv('RETRIEVAL_CANDIDATE_FACTOR', self.DEFAULT_CANDIDATE_FACTOR))
+
+        self.reuse_threshold = reuse_threshold
+        self.extend_threshold = extend_threshold
+        self.candidate_factor = max(1, candidate_factor)
+
+        self._lock = threading.Lock()
+        self._state = None
+
+    def is_empty(self) -> bool:
+        """True si todavía no hay candidatos guardados"""
+        with self._lock:
+            return self._state is None
+
+    def decide(self, query_embedding: np.ndarray, generation: int, top_k: int, enable_faq: bool) -> Tuple[str, float]:
+        """
+        Decide cómo obtener el contexto de la consulta nueva
+
+        Args:
+            query_embedding: Embedding normalizado de la consulta nueva
+            generation: Generación actual del índice
+            top_k: Documentos pedidos
+            enable_faq: Si la consulta busca en FAQs
+
+        Returns:
+            Tupla (decisión, similitud con la consulta anterior)
+            decisión: 'reuse', 'extend' o 'fresh'
+        """
+        with self._lock:
+            state = self._state
+
+        # Candidatos de otro índice o con otros parámetros: no sirven
+        if (
+            state is None
+            or state["generation"] != generation
+            or state["enable_faq"] != enable_faq
+            or state["top_k"] < top_k
+        ):
+            return "fresh", 0.0
+
+        similarity = float(np.dot(query_embedding, state["query_embedding"]))
+
+        if similarity >= self.reuse_threshold:
+            return "reuse", similarity
+        if similarity >= self.extend_threshold:
+            return "extend", similarity
+        return "fresh", similarity
+
+    def get_classification(self) -> Dict:
+        """
+        Clasificación FAQ guardada
+
+        Returns:
+            Diccionario con match_type, faq_results, faq_entries y best_similarity
+        """
+        with self._lock:
+            state = self._state
+        return {
+            "match_type": state["match_type"],
+            "faq_results": list(state["faq_results"]),
+            "faq_entries": list(state["faq_entries"]),
+            "best_similarity": state["best_similarity"]
+        }
+
+    def rank(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int,
+        extra_candidates: Optional[List[Tuple[str, str, float, np.ndarray]]] = None
+    ) -> List[Tuple[str, str, float, np.ndarray]]:
+        """
+        Ordena los candidatos guardados (y los nuevos) con la consulta nueva
+
+        Args:
+            query_embedding: Embedding normalizado de la consulta nueva
+            top_k: Candidatos a devolver
+            extra_candidates: Candidatos recién recuperados (filename, content, score, embedding)
+
+        Returns:
+            Lista de (filename, content, score, embedding) sin repetidos, de mayor a menor score
+        """
+        with self._lock:
+            state = self._state
+
+        merged = {}
+        for filename, content, _, embedding in (extra_candidates or []) + (state["candidates"] if state else []):
+            if filename not in merged:
+                score = float(np.dot(query_embedding, embedding))
+                merged[filename] = (filename, content, score, embedding)
+
+        ranked = sorted(merged.values(), key=lambda candidate: candidate[2], reverse=True)
+        return ranked[:top_k]
+
+    def update(
+        self,
+        query_embedding: np.ndarray,
+        generation: int,
+        top_k: int,
+        enable_faq: bool,
+        classification: Dict,
+        candidates: List[Tuple[str, str, float, np.ndarray]]
+    ):
+        """
+        Guarda los candidatos del turno actual
+
+        Args:
+            query_embedding: Embedding de la consulta
+            generation: Generación del índice usada
+            top_k: Documentos pedidos
+            enable_faq: Si la consulta buscó en FAQs
+            classification: match_type, faq_results, faq_entries (opcional) y best_similarity
+            candidates: Documentos candidatos (filename, content, score, embedding)
+        """
+        with self._lock:
+            self._state = {
+                "query_embedding": query_embedding,
+                "generation": generation,
+                "top_k": top_k,
+                "enable_faq": enable_faq,
+                "match_type": classification["match_type"],
+                "faq_results": list(classification["faq_results"]),
+                "faq_entries": list(classification.get("faq_entries", [])),
+                "best_similarity": classification["best_similarity"],
+                "candidates": list(candidates[:top_k * self.candidate_factor])
+            }
+
+    def memory_bytes(self) -> int:
+        """Tamaño aproximado de los candidatos y vectores guardados, en bytes"""
+        with self._lock:
+            state = self._state
+        if state is None:
+            return 0
+        return state["query_embedding"].nbytes + sum(
+            len(content.encode('utf-8')) + embedding.nbytes for _, content, _, embedding in state["candidates"]
+        )
+
+    def clear(self):
+        """Olvida los candidatos guardados"""
+        with self._lock:
+            self._state = None
+
+
+if __name__ == "__main__":
+    # Test con vectores sintéticos
+    rng = np.random.default_rng(0)
+
+    def unit(vector):
+        return (vector / np.linalg.norm(vector)).astype('float32')
+
+    topic = unit(rng.normal(size=64))
+    documents = [
+        (f"doc_{i}.md", f"Contenido {i}", 0.0, unit(topic + rng.normal(scale=0.2, size=64)))
+        for i in range(9)
+    ]
+
+    cache = SessionRetrievalCache()
+    cache.update(topic, 0, 3, True, {"match_type": "low", "faq_results": [], "best_similarity": 0.4}, documents)
+
+    for label, query in [
+        ("seguimiento", unit(topic + rng.normal(scale=0.05, size=64))),
+        ("relacionada", unit(topic + rng.normal(scale=0.12, size=64))),
+        ("tema nuevo", unit(rng.normal(size=64)))
+    ]:
+        decision, similarity = cache.decide(query, 0, 3, True)
+        ranked = [filename for filename, _, _, _ in cache.rank(query, 3)]
+        print(f"{label:12} similitud={similarity:.2f} -> {decision:6} {ranked if decision == 'reuse' else ''}")
+
+    print(f"Índice re-ingerido -> {cache.decide(topic, 1, 3, True)[0]}")
@@ -6,9 +6,12 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 import numpy as np
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from database.repository import DocumentRepository
 from embeddings.embedder import Embedder
+from monitoring.logger import get_logger
+
+logger = get_logger("rag.retriever")
 
 
 class DocumentRetriever:
@@ -48,7 +51,8 @@ class DocumentRetriever:
     def retrieve_relevant_documents(
         self,
         query: str,
-        top_k: int = 3
+        top_k: int = 3,
+        query_embedding: Optional[np.ndarray] = None
     ) -> List[Tuple[str, str, float]]:
         """
         Recupera los documentos más relevantes para una consulta
@@ -56,21 +60,44 @@ class DocumentRetriever:
         Args:
             query: Pregunta del usuario
             top_k: Número de documentos a recuperar
+            query_embedding: Embedding de la consulta si ya fue calculado
 
         Returns:
             Lista de tuplas (filename, content, similarity_score)
             ordenadas por relevancia (mayor a menor)
         """
+        candidates = self.retrieve_candidates(query, top_k, query_embedding)
+        return [(filename, content, score) for filename, content, score, _ in candidates]
+
+    def retrieve_candidates(
+        self,
+        query: str,
+        top_k: int = 3,
+        query_embedding: Optional[np.ndarray] = None
+    ) -> List[Tuple[str, str, float, np.ndarray]]:
+        """
+        Igual que retrieve_relevant_documents, pero incluye el embedding de
+        cada documento (para volver a puntuarlos sin buscar otra vez)
+
+        Args:
+            query: Pregunta del usuario
+            top_k: Número de documentos a recuperar
+            query_embedding: Embedding de la consulta si ya fue calculado
+
+        Returns:
+            Lista de tuplas (filename, content, similarity_score, embedding)
+            ordenadas por relevancia (mayor a menor)
+        """
         # Generar embedding de la consulta
-        print(f"Generando embedding para la consulta...")
-        query_embedding = self.embedder.generate_embedding(query)
+        if query_embedding is None:
+            logger.debug("retrieval.embed", "Generando embedding para la consulta")
+            query_embedding = self.embedder.generate_embedding(query)
 
         # Obtener todos los documentos de la base de datos
-        print("Recuperando documentos de la base de datos...")
         all_documents = self.repository.get_all_documents()
 
         if not all_documents:
-            print("Advertencia: No hay documentos en la base de datos")
+            logger.warning("retrieval.empty_index", "No hay documentos en la base de datos")
             return []
 
         # Calcular similitud con cada documento
@@ -83,7 +110,7 @@ class DocumentRetriever:
             # Calcular similitud
             similarity = self.cosine_similarity(query_embedding, doc_embedding)
 
-            similarities.append((filename, content, similarity))
+            similarities.append((filename, content, similarity, doc_embedding))
 
         # Ordenar por similitud (mayor a menor)
         similarities.sort(key=lambda x: x[2], reverse=True)
@@ -91,9 +118,11 @@ class DocumentRetriever:
         # Retornar top-k documentos
         top_documents = similarities[:top_k]
 
-        print(f"\nTop {top_k} documentos más relevantes:")
-        for i, (filename, _, score) in enumerate(top_documents, 1):
-            print(f"{i}. {filename} (similitud: {score:.4f})")
+        for rank, (filename, _, score, _) in enumerate(top_documents, 1):
+            logger.debug(
+                "retrieval.document", f"{rank}. {filename} (similitud: {score:.4f})",
+                rank=rank, filename=filename, similarity=round(float(score), 4)
+            )
 
         return top_documents
 
@@ -101,7 +130,8 @@ class DocumentRetriever:
         self,
         query: str,
         threshold: float = 0.5,
-        max_documents: int = 10
+        max_documents: int = 10,
+        query_embedding: Optional[np.ndarray] = None
     ) -> List[Tuple[str, str, float]]:
         """
         Recupera documentos que superen un umbral de similitud
@@ -110,12 +140,14 @@ class DocumentRetriever:
             query: Pregunta del usuario
             threshold: Umbral mínimo de similitud (0-1)
             max_documents: Máximo número de documentos a retornar
+            query_embedding: Embedding de la consulta si ya fue calculado
 
         Returns:
             Lista de tuplas (filename, content, similarity_score)
         """
         # Generar embedding de la consulta
-        query_embedding = self.embedder.generate_embedding(query)
+        if query_embedding is None:
+            query_embedding = self.embedder.generate_embedding(query)
 
         # Obtener todos los documentos
         all_documents = self.repository.get_all_documents()
@@ -0,0 +1,251 @@
+"""
+Módulo de caché semántica de respuestas: reutiliza respuestas de preguntas
+parafraseadas comparando embeddings de las consultas
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+
+class SemanticCache:
+    """
+    Caché de respuestas indexada por similitud coseno entre embeddings de consultas.
+
+    Cada entrada guarda (vector de la consulta, respuesta, documentos fuente,
+    generación del índice). Las entradas se descartan por LRU, por TTL y cuando
+    cambia alguno de sus documentos fuente.
+    """
+
+    DEFAULT_THRESHOLD = 0.95
+    DEFAULT_MAX_ENTRIES = 500
+    DEFAULT_TTL_SECONDS = 3600
+
+    def __init__(
+        self,
+        threshold: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        enabled: Optional[bool] = None
+    ):
+        """
+        Inicializa la caché (los valores omitidos se leen de .env)
+
+        Args:
+            threshold: Similitud coseno mínima para reutilizar una respuesta
+                (SEMANTIC_CACHE_THRESHOLD)
+            max_entries: Número máximo de entradas (SEMANTIC_CACHE_MAX_ENTRIES)
+            ttl_seconds: Tiempo de vida de cada entrada (SEMANTIC_CACHE_TTL)
+            enabled: Si es False, la caché nunca guarda ni devuelve respuestas
+                (SEMANTIC_CACHE_ENABLED)
+        """
+        load_dotenv()
+
+        if threshold is None:
+            threshold = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', self.DEFAULT_THRESHOLD))
+        if max_entries is None:
+            max_entries = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', self.DEFAULT_MAX_ENTRIES))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.getenv('SEMANTIC_CACHE_TTL', self.DEFAULT_TTL_SECONDS))
+        if enabled is None:
+            enabled = os.getenv('SEMANTIC_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled and max_entries > 0
+
+        self._entries = OrderedDict()  # {entry_id: entrada}, orden LRU
+        self._next_id = 0
+        self._matrix = None  # Vectores apilados, se reconstruye al cambiar las entradas
+        self._matrix_ids = []
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _invalidate_matrix(self):
+        """Marca la matriz de vectores para reconstrucción"""
+        self._matrix = None
+        self._matrix_ids = []
+
+    def _remove_expired(self, now: float):
+        """Elimina las entradas cuyo TTL expiró"""
+        expired = [
+            entry_id for entry_id, entry in self._entries.items()
+            if now - entry['created_at'] > self.ttl_seconds
+        ]
+        for entry_id in expired:
+            del self._entries[entry_id]
+        if expired:
+            self._invalidate_matrix()
+
+    def lookup(self, query_embedding: np.ndarray, generation: int) -> Optional[Dict]:
+        """
+        Busca una respuesta guardada para una consulta similar
+
+        Args:
+            query_embedding: Embedding normalizado de la consulta
+            generation: Generación actual del índice de documentos
+
+        Returns:
+            Diccionario con 'result', 'sources' y 'similarity', o None si no hay match
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            self._remove_expired(time.monotonic())
+
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            if self._matrix is None:
+                self._matrix_ids = list(self._entries.keys())
+                self._matrix = np.stack([self._entries[i]['vector'] for i in self._matrix_ids])
+
+            # Los embeddings de BGE-M3 están normalizados: el producto punto es el coseno
+            similarities = self._matrix @ query_embedding.astype('float32')
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            entry_id = self._matrix_ids[best]
+            entry = self._entries[entry_id]
+
+            if similarity < self.threshold or entry['generation'] != generation:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+
+            return {
+                'result': dict(entry['result']),
+                'sources': list(entry['sources']),
+                'similarity': similarity
+            }
+
+    def store(
+        self,
+        query_embedding: np.ndarray,
+        result: Dict,
+        sources: Iterable[str],
+        generation: int
+    ):
+        """
+        Guarda una respuesta en la caché
+
+        Args:
+            query_embedding: Embedding normalizado de la consulta
+            result: Diccionario de respuesta del pipeline
+            sources: Nombres de los documentos usados como contexto
+            generation: Generación del índice con la que se generó la respuesta
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[self._next_id] = {
+                'vector': np.array(query_embedding, dtype='float32'),
+                'result': dict(result),
+                'sources': set(sources),
+                'generation': generation,
+                'created_at': time.monotonic()
+            }
+            self._next_id += 1
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+            self._invalidate_matrix()
+
+    def invalidate_sources(self, filenames: Iterable[str]) -> int:
+        """
+        Elimina las entradas que usaron alguno de los documentos indicados
+
+        Un archivo también invalida sus chunks ("<archivo>_chunk_N").
+
+        Args:
+            filenames: Documentos que cambiaron
+
+        Returns:
+            Número de entradas eliminadas
+        """
+        changed = set(filenames)
+        if not changed:
+            return 0
+
+        def affected(source: str) -> bool:
+            return source in changed or source.split('_chunk_')[0] in changed
+
+        with self._lock:
+            stale = [
+                entry_id for entry_id, entry in self._entries.items()
+                if any(affected(source) for source in entry['sources'])
+            ]
+            for entry_id in stale:
+                del self._entries[entry_id]
+            if stale:
+                self._invalidate_matrix()
+
+        return len(stale)
+
+    def advance_generation(self, generation: int):
+        """
+        Marca las entradas restantes como válidas para una nueva generación del índice
+
+        Se llama después de invalidate_sources: las entradas que sobrevivieron
+        no dependen de los documentos que cambiaron.
+
+        Args:
+            generation: Nueva generación del índice
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                entry['generation'] = generation
+
+    def clear(self):
+        """Elimina todas las entradas"""
+        with self._lock:
+            self._entries.clear()
+            self._invalidate_matrix()
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas de la caché
+
+        Returns:
+            Diccionario con tamaño, hits, misses y hit ratio
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0
+            }
+
+
+if __name__ == "__main__":
+    # Test de la caché con vectores sintéticos
+    cache = SemanticCache(threshold=0.9, max_entries=2, ttl_seconds=60, enabled=True)
+
+    v1 = np.random.rand(1024).astype('float32')
+    v1 /= np.linalg.norm(v1)
+    cache.store(v1, {"answer": "Respuesta 1"}, ["becas.md"], generation=0)
+
+    paraphrase = v1 + np.random.normal(0, 0.005, 1024).astype('float32')
+    paraphrase /= np.linalg.norm(paraphrase)
+
+    print(f"Paráfrasis: {cache.lookup(paraphrase, generation=0)}")
+    print(f"Generación distinta: {cache.lookup(paraphrase, generation=1)}")
+
+    cache.invalidate_sources(["becas.md"])
+    print(f"Después de invalidar: {cache.lookup(paraphrase, generation=0)}")
+    print(f"Stats: {cache.get_stats()}")
@@ -0,0 +1,279 @@
+"""
+Módulo de coalescencia de peticiones idénticas en curso (single-flight)
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import re
+import copy
+import asyncio
+import threading
+import unicodedata
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable
+
+from monitoring.metrics import get_metrics
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normaliza una pregunta para detectar peticiones idénticas
+
+    Ignora mayúsculas, espacios repetidos y signos de puntuación al inicio
+    y al final ("¿Cuándo es la matrícula?" == "cuándo es la matrícula").
+
+    Args:
+        question: Pregunta del usuario
+
+    Returns:
+        Pregunta normalizada
+    """
+    text = unicodedata.normalize('NFKC', question).casefold()
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip(' ¿?¡!.,;:')
+
+
+class _Call:
+    """Cálculo síncrono en curso compartido por varios hilos"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Broadcast:
+    """Stream en curso cuyos eventos se reenvían a todos los suscriptores"""
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error = None
+        self.condition = asyncio.Condition()
+        self.task = None
+
+
+class SingleFlight:
+    """
+    Ejecuta una sola vez los cálculos idénticos que están en curso.
+
+    Si llega una petición con la misma clave que otra todavía en proceso,
+    espera a esa y recibe una copia de su resultado en lugar de repetir
+    embedding, búsqueda y llamada al LLM. Al terminar, la clave se libera;
+    las peticiones posteriores ya no se coalescen (para eso está la caché).
+    """
+
+    def __init__(self, name: str = "rag_query"):
+        """
+        Args:
+            name: Nombre que identifica a este single-flight en las métricas
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}  # {clave: _Call}
+        self._tasks = {}  # {clave: asyncio.Task}
+        self._streams = {}  # {clave: _Broadcast}
+
+        self.metrics = get_metrics()
+        self.metrics.describe("rag_singleflight_leaders_total", "Cálculos ejecutados por single-flight")
+        self.metrics.describe(
+            "rag_coalesced_requests_total",
+            "Peticiones que esperaron a un cálculo idéntico en curso"
+        )
+
+    def _count(self, leader: bool, mode: str):
+        labels = {"flight": self.name, "mode": mode}
+        if leader:
+            self.metrics.inc("rag_singleflight_leaders_total", labels=labels)
+        else:
+            self.metrics.inc("rag_coalesced_requests_total", labels=labels)
+
+    def do(self, key: Hashable, fn: Callable[[], Dict]) -> Dict:
+        """
+        Versión síncrona (hilos): ejecuta fn() o espera al cálculo idéntico en curso
+
+        Args:
+            key: Clave de la petición
+            fn: Función que calcula el resultado
+
+        Returns:
+            Copia del resultado
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        self._count(leader, "sync")
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+        return copy.deepcopy(call.result)
+
+    async def ado(self, key: Hashable, factory: Callable[[], Awaitable[Dict]]) -> Dict:
+        """
+        Versión asíncrona: ejecuta factory() o espera al cálculo idéntico en curso
+
+        El cálculo corre en su propia tarea: si el cliente que lo inició se
+        desconecta, los demás que esperan siguen recibiendo el resultado.
+
+        Args:
+            key: Clave de la petición
+            factory: Función que devuelve la corrutina que calcula el resultado
+
+        Returns:
+            Copia del resultado
+        """
+        with self._lock:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = asyncio.ensure_future(factory())
+                self._tasks[key] = task
+                task.add_done_callback(lambda done, key=key: self._forget_task(key, done))
+
+        self._count(leader, "async")
+
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+
+    def _forget_task(self, key: Hashable, task: asyncio.Task):
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+        # Marcar la excepción como leída aunque todos los que esperaban se hayan ido
+        if not task.cancelled():
+            task.exception()
+
+    async def astream(self, key: Hashable, factory: Callable[[], AsyncIterator[Dict]]) -> AsyncIterator[Dict]:
+        """
+        Versión para streams: todos los suscriptores reciben los mismos eventos
+
+        Quien llega tarde recibe primero los eventos ya emitidos y después
+        los nuevos a medida que llegan.
+
+        Args:
+            key: Clave de la petición
+            factory: Función que devuelve el generador asíncrono de eventos
+
+        Yields:
+            Copias de los eventos
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = _Broadcast()
+                self._streams[key] = broadcast
+                broadcast.task = asyncio.ensure_future(self._pump(key, broadcast, factory))
+
+        self._count(leader, "stream")
+
+        index = 0
+        while True:
+            async with broadcast.condition:
+                await broadcast.condition.wait_for(lambda: len(broadcast.events) > index or broadcast.done)
+                pending = broadcast.events[index:]
+                finished = broadcast.done
+
+            index += len(pending)
+            for event in pending:
+                yield copy.deepcopy(event)
+
+            if finished and index == len(broadcast.events):
+                if broadcast.error is not None:
+                    raise broadcast.error
+                return
+
+    async def _pump(self, key: Hashable, broadcast: _Broadcast, factory: Callable[[], AsyncIterator[Dict]]):
+        """Consume el stream original y publica sus eventos"""
+        try:
+            async for event in factory():
+                async with broadcast.condition:
+                    broadcast.events.append(event)
+                    broadcast.condition.notify_all()
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            with self._lock:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+            async with broadcast.condition:
+                broadcast.done = True
+                broadcast.condition.notify_all()
+
+    def in_flight(self) -> int:
+        """Número de cálculos en curso"""
+        with self._lock:
+            return len(self._calls) + len(self._tasks) + len(self._streams)
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas del single-flight
+
+        Returns:
+            Diccionario con cálculos en curso, líderes y peticiones coalescidas por modo
+        """
+        stats = {'in_flight': self.in_flight(), 'leaders': {}, 'coalesced': {}}
+        for mode in ("sync", "async", "stream"):
+            labels = {"flight": self.name, "mode": mode}
+            stats['leaders'][mode] = int(self.metrics.get_counter("rag_singleflight_leaders_total", labels))
+            stats['coalesced'][mode] = int(self.metrics.get_counter("rag_coalesced_requests_total", labels))
+        return stats
+
+
+if __name__ == "__main__":
+    # Test: 50 preguntas idénticas simultáneas ejecutan un solo cálculo
+    import time
+
+    flight = SingleFlight("demo")
+    executions = []
+
+    async def answer(question: str) -> Dict:
+        executions.append(question)
+        await asyncio.sleep(0.3)  # Simula embedding + LLM
+        return {"answer": f"Respuesta a '{question}'"}
+
+    async def stream_answer(question: str) -> AsyncIterator[Dict]:
+        executions.append(question)
+        for word in ["La ", "matrícula ", "cierra ", "el ", "viernes"]:
+            await asyncio.sleep(0.05)
+            yield {"type": "token", "data": {"content": word}}
+
+    async def main():
+        questions = ["¿Cuándo cierra la matrícula?", "cuándo cierra la   matrícula", "¿CUÁNDO CIERRA LA MATRÍCULA?"]
+
+        start = time.monotonic()
+        results = await asyncio.gather(*[
+            flight.ado(normalize_question(questions[i % 3]), lambda q=questions[i % 3]: answer(q))
+            for i in range(50)
+        ])
+        print(f"50 peticiones en {time.monotonic() - start:.2f}s, cálculos: {len(executions)}")
+        print(f"Resultado compartido: {results[-1]['answer']}")
+
+        async def consume(question: str) -> str:
+            key = ("stream", normalize_question(question))
+            parts = [event["data"]["content"] async for event in flight.astream(key, lambda: stream_answer(question))]
+            return "".join(parts)
+
+        texts = await asyncio.gather(*[consume(q) for q in questions * 3])
+        print(f"Streams: {len(set(texts))} texto distinto ({texts[0]}), cálculos totales: {len(executions)}")
+
+    asyncio.run(main())
+    print(f"Stats: {flight.get_stats()}")